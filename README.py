@@ -1,8 +1,8 @@
-import pandas as pd
-from datetime import datetime
+from datetime import datetime, timezone
 from dateutil.parser import parse
+from email.utils import getaddresses, parsedate_to_datetime
 
-from .scripts.llama32 import llama32
+from pdfvision.llama32 import is_error_answer, llama32
 from .scripts.Pixtral import pixtral
 
 import json
@@ -18,9 +18,18 @@ from .scripts.Utils import (
     pymuLLM,
     extract_invoice_from_pdf_attachment,
     triagePeopleSoftInvalid,
-    splunkit,
+    splunkit as splunkitSync,
+)
+from pdfvision.vision_calls import HedgedCall, HedgePolicy, SingleFlightCall, call_deadline, ensemble_call
+from pdfvision.pdf_vision import DedupPolicy, PdfDocumentSession, image_fingerprint_b64
+from pdfvision.attachment_index import AttachmentIndex
+from pdfvision.layout_templates import LayoutTemplateStore, extract_invoice_with_templates
+from pdfvision.model_routing import ModelRouter
+from pdfvision.invoice_classifier import (
+    InvoiceClassifier,
+    log_classification_example,
+    select_relevant_excerpt,
 )
-from .scripts.dbpandas import Insertlogstodb
 from .prompts import (
     pdf_prompt_text,
     image_prompt_text,
@@ -47,19 +56,171 @@ from .prompts import (
 import sys
 from .scripts.gwlogging import init_logger
 
-import schedule
 import time
+import atexit
 import base64
+import email
+import email.policy
+import glob
+import hashlib
 import logging
 from logging.handlers import RotatingFileHandler
 import os
+import queue
+import random
 import re
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 # from prompts import pdf_prompt_text
 
 exchangeMailbox = Emails()
 
 
+def hecTransport(url, token, sourcetype="emily:agent", timeout=10):
+    """ships a batch of events to a Splunk HTTP Event Collector in one request"""
+    import requests
+
+    session = requests.Session()
+    headers = {"Authorization": f"Splunk {token}"}
+
+    def send(events):
+        payload = "".join(
+            json.dumps({"time": e["time"], "sourcetype": sourcetype, "event": e}, default=str) for e in events
+        )
+        session.post(url, headers=headers, data=payload, timeout=timeout).raise_for_status()
+
+    return send
+
+
+def fileTransport(path):
+    """local stand-in for HEC: appends the events as JSON lines"""
+
+    def send(events):
+        with open(path, "a", encoding="utf-8") as f:
+            for e in events:
+                f.write(json.dumps(e, default=str) + "\n")
+
+    return send
+
+
+def splunkitTransport(events):
+    """falls back to the synchronous Utils.splunkit, one call per event, on the worker thread"""
+    for e in events:
+        splunkitSync(e["message"], e["level"])
+
+
+class LogShipper:
+    """Queue-backed, non-blocking log shipping. ship() only enqueues; a background worker batches events to the
+    transport. Messages over max_event_chars are truncated, and only large_sample_rate of those oversized non-error
+    events are kept. When the queue is full, events are dropped and counted instead of blocking the agent; the
+    drop counts are reported in-band with the next batch."""
+
+    def __init__(self, transport, max_queue=10000, batch_size=100, flush_seconds=2.0, max_event_chars=4000, large_sample_rate=1.0):
+        self.transport = transport
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_event_chars = max_event_chars
+        self.large_sample_rate = large_sample_rate
+        self.stats = {"enqueued": 0, "shipped": 0, "truncated": 0, "sampled_out": 0, "dropped_queue_full": 0, "failed": 0}
+        self._reported = {"sampled_out": 0, "dropped_queue_full": 0, "failed": 0}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log-shipper", daemon=True)
+        self._thread.start()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def ship(self, message, level="info", **fields):
+        message = str(message)
+        if len(message) > self.max_event_chars:
+            if level != "error" and random.random() >= self.large_sample_rate:
+                self._count("sampled_out")
+                return
+            message = f"{message[: self.max_event_chars]}...[truncated {len(message) - self.max_event_chars} chars]"
+            self._count("truncated")
+
+        event = {"time": time.time(), "level": level, "message": message, "thread": threading.current_thread().name}
+        if fields:
+            event.update(fields)
+        try:
+            self._queue.put_nowait(event)
+            self._count("enqueued")
+        except queue.Full:
+            self._count("dropped_queue_full")
+
+    def _dropReport(self):
+        with self._lock:
+            delta = {k: self.stats[k] - self._reported[k] for k in self._reported}
+            if not any(delta.values()):
+                return None
+            self._reported = {k: self.stats[k] for k in self._reported}
+        return {"time": time.time(), "level": "warning", "message": f"LogShipper lost events since last report: {delta}", "thread": "log-shipper"}
+
+    def _send(self, batch):
+        report = self._dropReport()
+        if report:
+            batch.append(report)
+        if not batch:
+            return
+        try:
+            self.transport(batch)
+            self._count("shipped", len(batch))
+        except Exception as e:
+            self._count("failed", len(batch))
+            print(f"LogShipper: transport failed for {len(batch)} events: {e}")
+
+    def _run(self):
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._send(batch)
+            if self._stop.is_set() and self._queue.empty():
+                return
+
+    def close(self, timeout=10):
+        self._stop.set()
+        self._thread.join(timeout=timeout)
+
+
+def _defaultLogTransport():
+    if os.getenv("EMILY_SPLUNK_HEC_URL") and os.getenv("EMILY_SPLUNK_HEC_TOKEN"):
+        return hecTransport(os.getenv("EMILY_SPLUNK_HEC_URL"), os.getenv("EMILY_SPLUNK_HEC_TOKEN"))
+    if os.getenv("EMILY_SPLUNK_FILE"):
+        return fileTransport(os.getenv("EMILY_SPLUNK_FILE"))
+    return splunkitTransport
+
+
+logShipper = LogShipper(
+    _defaultLogTransport(),
+    max_queue=int(os.getenv("EMILY_LOG_QUEUE_SIZE", "10000")),
+    batch_size=int(os.getenv("EMILY_LOG_BATCH_SIZE", "100")),
+    flush_seconds=float(os.getenv("EMILY_LOG_FLUSH_SECONDS", "2")),
+    max_event_chars=int(os.getenv("EMILY_LOG_MAX_EVENT_CHARS", "4000")),
+    large_sample_rate=float(os.getenv("EMILY_LOG_LARGE_SAMPLE_RATE", "1.0")),
+)
+atexit.register(logShipper.close)
+
+
+def splunkit(message, level="info"):
+    """non-blocking replacement for Utils.splunkit; events are shipped by logShipper"""
+    logShipper.ship(message, level)
+
+
 class CurrentWorkingEmail:
     def __init__(self, data=None):
         if data is None:
@@ -136,7 +297,13 @@ class CurrentWorkingEmail:
         self.__init__(data)
 
     def assignAttachment(self, data):
-        self.attachments.append(Attachment(data))  # self.attachments = Attachment(data)
+        attachment = Attachment(data)
+        self.attachments.append(attachment)  # self.attachments = Attachment(data)
+        return attachment
+
+    def releaseAttachments(self):
+        for attachment in getattr(self, "attachments", None) or []:
+            attachment.release()
 
     def assignVoucher(self, data):
         self.voucher.append(Voucher(data))
@@ -172,19 +339,165 @@ class Attachment:
             self.is_inline = data["isInline"]
             self.content_id = data["contentId"]
             self.content_location = data["contentLocation"]
-            self.content_bytes = data["contentBytes"]
+            self.content_bytes = data.get("contentBytes")
+            self.spool_path = data.get("spoolPath")
             # self.voucher = []
 
+    @property
+    def content_bytes(self):
+        """base64 content; spooled attachments are read back from disk only when a caller needs the base64 form,
+        and then only once (images are fingerprinted, classified and sent as a data URL from the same string)"""
+        if self._content_bytes is None and getattr(self, "spool_path", None):
+            if getattr(self, "_spooledB64", None) is None:
+                with open(self.spool_path, "rb") as f:
+                    self._spooledB64 = base64.b64encode(f.read()).decode("ascii")
+            return self._spooledB64
+        return self._content_bytes
+
+    @content_bytes.setter
+    def content_bytes(self, value):
+        self._content_bytes = value
+        self._spooledB64 = None
+        self.spool_path = None
+        self._document = None
+
     def assign(self, data):
         self.__init__(data)
 
     # def assignVoucher(self, data):
     #     self.voucher.append(Voucher(data))
 
+    def document(self):
+        """decoded/parsed view of a PDF attachment, shared by classification and extraction"""
+        if getattr(self, "_document", None) is None:
+            self._document = AttachmentDocument(self.name, self._content_bytes, spool_path=self.spool_path)
+        return self._document
+
+    def extractInvoice(self):
+        """voucher and evidence dicts for a PDF attachment; EMILY_PDF_EXTRACTOR=pdfvision extracts through the
+        parsed session (templates, attachment index, routed model), anything else keeps the Utils extractor"""
+        if pdfExtractor == "pdfvision":
+            return self.document().extractInvoice()
+        return extract_invoice_from_pdf_attachment(self.content_bytes)
+
+    def release(self):
+        """close the parsed document and delete the spool file once the email is done"""
+        if getattr(self, "_document", None) is not None:
+            self._document.close()
+            self._document = None
+        self._spooledB64 = None
+        if getattr(self, "spool_path", None):
+            try:
+                os.remove(self.spool_path)
+            except OSError:
+                pass
+
     def __str__(self):
         return f"Attachment(id={self.id}, name={self.name})"
 
 
+# pages and attachments match on perceptual hash distance plus identical page text (or pixels), so
+# same-template invoices that differ only in their numbers are never taken for one another
+dedupPolicy = DedupPolicy()
+# EMILY_DEDUP_PERCEPTUAL=1 drops the content check between the attachments of one email, so a PDF and a
+# PNG of the same invoice collapse; the persistent index and pages within a document always confirm content
+emailDedupPolicy = DedupPolicy(confirm_content=os.getenv("EMILY_DEDUP_PERCEPTUAL", "0") != "1")
+attachmentIndex = AttachmentIndex(
+    os.getenv("EMILY_ATTACHMENT_INDEX", r"c:\data\Outputfiles\Emily_attachment_index.json"),
+    ttl_seconds=float(os.getenv("EMILY_ATTACHMENT_INDEX_TTL_HOURS", "72")) * 3600,
+    policy=dedupPolicy,
+)
+
+# vendor layouts learned from verified extractions; a known layout is read by coordinates without a model call
+layoutTemplates = LayoutTemplateStore(os.getenv("EMILY_TEMPLATE_STORE", r"c:\data\Outputfiles\Emily_layout_templates.json"))
+
+# per-stage model routing: EMILY_MODEL_ROUTES is a JSON file such as
+# {"default": {"model_size": 11}, "stages": {"ocr": {"model_size": 11, "max_tokens": 2048}, "verify": {"model_size": 90}}};
+# stages without a route keep MODEL / PSAFINT_API_URL as before
+modelRouter = ModelRouter.from_env("EMILY_MODEL_ROUTES")
+# a call running past the stage's EMILY_HEDGE_PERCENTILE latency gets a duplicate request; the first answer wins
+hedgePolicy = HedgePolicy(
+    percentile=float(os.getenv("EMILY_HEDGE_PERCENTILE", "95")),
+    call_timeout=float(os.getenv("EMILY_CALL_TIMEOUT_SECONDS", "300")),
+)
+# every model call for one attachment shares this budget, so a stuck endpoint cannot hold up the cycle
+documentBudgetSeconds = float(os.getenv("EMILY_DOCUMENT_BUDGET_SECONDS", "600"))
+# PDF extraction backend: "legacy" (Utils.extract_invoice_from_pdf_attachment) until pdfvision is signed off
+pdfExtractor = os.getenv("EMILY_PDF_EXTRACTOR", "legacy").strip().lower()
+# workers that hit the same attachment at the same time (CC'd to two mailboxes, attached twice) share one request
+routedLlama = SingleFlightCall(HedgedCall(modelRouter.bind(llama32), hedgePolicy, is_error=is_error_answer))
+
+
+def attachmentFingerprints(item):
+    """perceptual page fingerprints of a PDF or image attachment, or None when they cannot be computed"""
+    try:
+        if item.content_type == 'application/pdf':
+            return item.document().fingerprints()
+        if item.content_type in ('image/png', 'image/jpeg'):
+            return [image_fingerprint_b64(item.content_bytes, dedupPolicy)]
+    except Exception as e:
+        splunkit(f"fingerprinting {item.name} failed: {e}", "warning")
+    return None
+
+
+class AttachmentDocument:
+    """A PDF attachment decoded and parsed once; text, markdown, tables and page images are served from one pdf_vision session."""
+
+    def __init__(self, name, content_bytes=None, spool_path=None):
+        self.name = name
+        if spool_path:
+            self.session = PdfDocumentSession.from_file(spool_path, name=name or "")
+        else:
+            self.session = PdfDocumentSession.from_b64(content_bytes, name=name or "")
+
+    def pageTexts(self):
+        return self.session.page_texts()
+
+    def markdown(self):
+        return self.session.markdown()
+
+    def tables(self):
+        return [self.session.page_tables(n) for n in range(1, self.session.page_count + 1)]
+
+    def fingerprints(self):
+        return self.session.fingerprints(dedupPolicy)
+
+    def extractInvoice(self, vision_call=routedLlama):
+        fingerprints = self.fingerprints()
+        seen = attachmentIndex.lookup(fingerprints)
+        if seen and seen.get("invoice"):
+            splunkit(f"\n{self.name} matches recently extracted {seen.get('name')}; reusing its result", "info")
+            return dict(seen["invoice"]), dict(seen.get("evidence") or {})
+
+        with call_deadline(documentBudgetSeconds):
+            extraction = extract_invoice_with_templates(
+                self.session,
+                vision_call=vision_call,
+                store=layoutTemplates,
+                verify=True,
+                # EMILY_SINGLE_CALL_EXTRACT=1: one extract-with-evidence call, evidence checked locally instead of a verify call
+                single_call=os.getenv("EMILY_SINGLE_CALL_EXTRACT", "0") == "1",
+                return_evidence=True,
+                dedup_policy=dedupPolicy,
+            )
+        splunkit(
+            f"\n{self.name} extracted: pages={extraction.page_numbers} calls={extraction.call_counts} "
+            f"timings={extraction.timings} deduplicated={extraction.deduplicated_pages} "
+            f"template={extraction.template_id or '-'} locally_blanked={extraction.locally_blanked} "
+            f"models={modelRouter.stats()} coalesced={routedLlama.coalesced}",
+            "info",
+        )
+        invoice = extraction.invoice_dict()
+        if invoice.get("invoice_number") or invoice.get("gross_invoice_amount"):
+            attachmentIndex.add(
+                fingerprints, {"name": self.name, "invoice": invoice, "evidence": extraction.evidence or {}}
+            )
+        return invoice, extraction.evidence or {}
+
+    def close(self):
+        self.session.close()
+
+
 class Voucher:
     def __init__(self, data=None):
         if data is not None:
@@ -230,9 +543,55 @@ def getMessageList(count, folder):
     return None
 
 
+EMILY_SPOOL_DIR = os.getenv("EMILY_SPOOL_DIR") or os.path.join(tempfile.gettempdir(), "emily_spool")
+EMILY_SPOOL_THRESHOLD = int(os.getenv("EMILY_SPOOL_THRESHOLD_BYTES", str(1024 * 1024)))
+_B64_CHUNK = 4 * 256 * 1024  # multiple of 4 so every slice decodes on its own
+
+
+def _spoolFile(name):
+    os.makedirs(EMILY_SPOOL_DIR, exist_ok=True)
+    suffix = os.path.splitext(name or "")[1]
+    fd, path = tempfile.mkstemp(prefix="att_", suffix=suffix, dir=EMILY_SPOOL_DIR)
+    return os.fdopen(fd, "wb"), path
+
+
+def spoolAttachment(data, id=None):
+    """Moves a large attachment's content out of the response dict into a temp file (data["spoolPath"]). With a
+    mailbox interface that can stream one attachment (getAttachmentContent) the bytes never pass through memory;
+    otherwise the base64 already in the listing is decoded to disk in chunks and dropped."""
+    if (data.get("size") or 0) < EMILY_SPOOL_THRESHOLD or data.get("@odata.type", "").endswith("itemAttachment"):
+        return data
+
+    f, path = _spoolFile(data.get("name"))
+    with f:
+        b64 = data.get("contentBytes")
+        if b64 is None and id is not None and hasattr(exchangeMailbox, "getAttachmentContent"):
+            response = exchangeMailbox.getAttachmentContent(id, data["id"])
+            for chunk in response.iter_content(chunk_size=256 * 1024):
+                f.write(chunk)
+        else:
+            for i in range(0, len(b64 or ""), _B64_CHUNK):
+                f.write(base64.b64decode(b64[i : i + _B64_CHUNK]))
+    data["contentBytes"] = None
+    data["spoolPath"] = path
+    return data
+
+
 def getEmailAttachments(id):
     """Returns the attachments of the specific email with the specified id"""
-    attachments = exchangeMailbox.getAttachments(id).json()
+    if id in emlMessagePaths:
+        attachments = {"value": emlAttachments(emlMessagePaths[id])}
+    elif hasattr(exchangeMailbox, "getAttachmentsMetadata") and hasattr(exchangeMailbox, "getAttachmentContent"):
+        # list without contentBytes, then stream each large attachment on its own
+        attachments = exchangeMailbox.getAttachmentsMetadata(id).json()
+        for data in attachments.get("value", []):
+            if data.get("contentBytes") is None and (data.get("size") or 0) < EMILY_SPOOL_THRESHOLD:
+                data["contentBytes"] = base64.b64encode(exchangeMailbox.getAttachmentContent(id, data["id"]).content).decode("ascii")
+    else:
+        attachments = exchangeMailbox.getAttachments(id).json()
+
+    for data in attachments.get("value", []):
+        spoolAttachment(data, id)
 
     # with open('attachment.txt', 'w') as f:
     #      json.dump(attachments, f)
@@ -245,6 +604,8 @@ def getEmailAttachments(id):
 
 def getMIMEMessage(id):
     """Returns the MIME message of the specific email with the specified id"""
+    if id in emlMessagePaths:
+        return EmlMimeMessage(emlMessagePaths[id])
     msg = exchangeMailbox.getMIMEMessage(id)
 
     # for item in msg:
@@ -279,13 +640,13 @@ def processAttachments(attachments):
 
 def moveMessage(id, folderName):
     """Moves the specific email with the specified id to the specified folder"""
-    # agent.PS_BC_AI_RPT_LOG_DF.at[0,'BC_REMARKS'] = "Message moved to " + folderName
+    # agent.PS_BC_AI_RPT_LOG.BC_REMARKS = "Message moved to " + folderName
     return exchangeMailbox.moveMessage(id, folderName)
 
 
 def createReplyMessage(id, body):
     """Creates a reply to the specific email with the specified id"""
-    # agent.PS_BC_AI_RPT_LOG_DF.at[0,'ERROR_MSG_TXT'] = "Draft Message reply created " + to
+    # agent.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Draft Message reply created " + to
     return exchangeMailbox.createReplyMessage(id, body)
 
 
@@ -293,15 +654,254 @@ def createNewMessage(subject, body, toRecipients, ccRecipients=None, bccRecipien
     return exchangeMailbox.createNewMessage(subject, body, toRecipients, ccRecipients, bccRecipients, attachments)
 
 
+# Define the column names and data types for the log table for email dispositions
+# hosted in peopleSoft as a bolt on table. table name is PS_BC_AI_RPT_LOG
+PS_BC_AI_RPT_LOG_COLUMNS = {
+    "BC_MSG_ID": "VARCHAR2 (254 Byte)",
+    "BC_EMAIL_SUBJTEXT": "VARCHAR2 (254 Byte)",
+    "EMAIL_DATETIME": "TIMESTAMP(6)",
+    "INVOICE_ID": "VARCHAR2 (30 Byte)",
+    "INVOICE_AMOUNT": "NUMBER (26,3)",
+    "PO_ID": "VARCHAR2 (10 Byte)",
+    "INVOICE_DT": "VARCHAR2 (10 Byte)",
+    "EXPORT_DATE": "DATE",
+    "ERROR_MSG_TXT": "VARCHAR2 (254 Byte)",
+    "BC_RUNTIME": "TIMESTAMP(6)",
+    "BC_REMARKS": "VARCHAR2 (254 Byte)",
+}
+
+
+class DispositionRecord:
+    """One PS_BC_AI_RPT_LOG row as plain attributes. str() is a short key=value line for logs; no pandas involved."""
+
+    __slots__ = tuple(PS_BC_AI_RPT_LOG_COLUMNS)
+
+    def __init__(self, **values):
+        for col in self.__slots__:
+            setattr(self, col, values.get(col))
+
+    def asRow(self):
+        return {col: getattr(self, col) for col in self.__slots__}
+
+    def __str__(self):
+        return " | ".join(f"{col}={getattr(self, col)}" for col in self.__slots__)
+
+    __repr__ = __str__
+
+
+class DispositionWriter:
+    """Buffers disposition rows off the email critical path. Rows are coalesced per BC_MSG_ID (latest step wins),
+    bulk inserted from a background thread once max_batch rows are pending or every flush_seconds, and appended to
+    spill_path when the insert fails so they are replayed on the next successful flush. A batch the database
+    rejects is split in halves until the rows it rejects on their own are found; those go to quarantine_path
+    instead of blocking every later flush. The spill file keeps at most max_spill rows (the newest)."""
+
+    # this many single rows failing before any insert succeeds means the database is down, not that the rows are bad
+    _OUTAGE_ROW_FAILURES = 3
+
+    def __init__(self, insert=None, max_batch=50, flush_seconds=5.0, spill_path=None, quarantine_path=None, max_spill=10000):
+        self.insert = insert
+        self.max_batch = max_batch
+        self.flush_seconds = flush_seconds
+        self.spill_path = spill_path
+        self.quarantine_path = quarantine_path or (spill_path + ".rejected" if spill_path else None)
+        self.max_spill = max_spill
+        self.stats = {"submitted": 0, "coalesced": 0, "inserted": 0, "spilled": 0, "failed_flushes": 0, "quarantined": 0, "dropped": 0}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flushLock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="disposition-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, row):
+        """snapshot the current disposition; the caller keeps mutating its own record afterwards"""
+        rows = [row.asRow() if isinstance(row, DispositionRecord) else dict(row)]
+        with self._lock:
+            self._start()
+            for r in rows:
+                key = r.get("BC_MSG_ID")
+                if key in self._pending:
+                    self.stats["coalesced"] += 1
+                    del self._pending[key]  # re-insert so flush order follows the latest update
+                self._pending[key] = r
+                self.stats["submitted"] += 1
+            if len(self._pending) >= self.max_batch:
+                self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:  # the writer thread must outlive a bad flush
+                splunkit(f"\nDispositionWriter flush failed: {e}", "error")
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _requeue(self, rows):
+        """put rows back in front of anything submitted since; a newer row for the same BC_MSG_ID wins"""
+        with self._lock:
+            pending = OrderedDict((r.get("BC_MSG_ID"), r) for r in rows)
+            pending.update(self._pending)
+            self._pending = dict(pending)
+
+    def _readSpill(self):
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return []
+        rows = []
+        try:
+            with open(self.spill_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        try:
+                            rows.append(json.loads(line))
+                        except ValueError:
+                            continue
+        except OSError as e:
+            splunkit(f"\nDispositionWriter could not read spill file {self.spill_path}: {e}", "error")
+            return []
+        return rows
+
+    @staticmethod
+    def _writeRows(path, rows, mode):
+        with open(path, mode, encoding="utf-8") as f:
+            for r in rows:
+                f.write(json.dumps(r, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _spill(self, rows, spilled=()):
+        """True when the rows are safely on disk; otherwise they go back to the pending buffer. spilled are the rows
+        already in the spill file; past max_spill the file is rewritten with only the newest rows."""
+        if not self.spill_path:
+            splunkit(f"\nDispositionWriter keeping {len(rows)} rows pending: no spill file configured", "error")
+            self._requeue(rows)
+            return False
+        try:
+            overflow = len(spilled) + len(rows) - self.max_spill
+            if overflow > 0:
+                kept = (list(spilled) + list(rows))[overflow:]
+                tmp = self.spill_path + ".tmp"
+                self._writeRows(tmp, kept, "w")
+                os.replace(tmp, self.spill_path)
+                self._count("dropped", overflow)
+                splunkit(f"\nDispositionWriter spill file is full ({self.max_spill} rows); dropped the {overflow} oldest rows", "error")
+            else:
+                self._writeRows(self.spill_path, rows, "a")
+        except Exception as e:
+            splunkit(f"\nDispositionWriter could not spill {len(rows)} rows, keeping them pending: {e}", "error")
+            self._requeue(rows)
+            return False
+        self._count("spilled", len(rows))
+        return True
+
+    def _quarantine(self, rows, error):
+        self._count("quarantined", len(rows))
+        splunkit(f"\nDispositionWriter quarantined {len(rows)} rows the database rejects: {error}", "error")
+        try:
+            self._writeRows(self.quarantine_path, rows, "a")
+        except Exception as e:
+            # last resort: the rows end up in the log rather than blocking every later flush
+            splunkit(f"\nDispositionWriter could not write {self.quarantine_path}: {e}; rejected rows: {json.dumps(rows, default=str)}", "error")
+
+    def _insertRows(self, rows):
+        # pandas and the db layer are only needed here; keeps them off the agent's startup path
+        import pandas as pd
+
+        if self.insert is None:
+            from .scripts.dbpandas import Insertlogstodb
+
+            self.insert = Insertlogstodb
+        self.insert(pd.DataFrame(rows, columns=list(PS_BC_AI_RPT_LOG_COLUMNS)))
+
+    def _insertSplit(self, rows, progress):
+        """insert rows, halving around failures; returns the rows rejected on their own with the last error.
+        Raises while nothing has been inserted and _OUTAGE_ROW_FAILURES single rows have failed."""
+        try:
+            self._insertRows(rows)
+            progress["inserted"] += len(rows)
+            return [], None
+        except Exception as e:
+            if len(rows) == 1:
+                progress["row_failures"] += 1
+                if not progress["inserted"] and progress["row_failures"] >= self._OUTAGE_ROW_FAILURES:
+                    raise
+                return rows, e
+            error = e
+        mid = len(rows) // 2
+        left, leftError = self._insertSplit(rows[:mid], progress)
+        right, rightError = self._insertSplit(rows[mid:], progress)
+        return left + right, rightError or leftError or error
+
+    def flush(self):
+        with self._flushLock:
+            with self._lock:
+                rows = list(self._pending.values())
+                self._pending.clear()
+
+            spilled = self._readSpill()
+            batch = spilled + rows
+            if not batch:
+                return 0
+
+            progress = {"inserted": 0, "row_failures": 0}
+            try:
+                rejected, error = self._insertSplit(batch, progress)
+                if rejected and not progress["inserted"]:
+                    raise error  # every row failed: treat it as the database being unavailable
+            except Exception as e:
+                self._count("failed_flushes")
+                splunkit(f"\nDispositionWriter insert failed, spilling {len(rows)} rows ({len(spilled)} already spilled): {e}", "error")
+                self._spill(rows, spilled)  # rows already in the spill file stay there
+                return 0
+
+            if spilled:
+                try:
+                    os.remove(self.spill_path)
+                except OSError as e:
+                    splunkit(f"\nDispositionWriter could not remove spill file {self.spill_path}; its rows may be replayed: {e}", "error")
+            if rejected:
+                self._quarantine(rejected, error)
+            self._count("inserted", progress["inserted"])
+            return progress["inserted"]
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_seconds + 30)
+        self.flush()
+
+
+dispositionWriter = DispositionWriter(
+    max_batch=int(os.getenv("EMILY_DISPOSITION_BATCH", "50")),
+    flush_seconds=float(os.getenv("EMILY_DISPOSITION_FLUSH_SECONDS", "5")),
+    spill_path=os.getenv("EMILY_DISPOSITION_SPILL", r"c:\data\Outputfiles\Emily_disposition_spill.jsonl"),
+    max_spill=int(os.getenv("EMILY_DISPOSITION_MAX_SPILL", "10000")),
+)
+atexit.register(dispositionWriter.close)
+
+
 def updateEmailDisposition(incoming_df):
-    """function will update the outcome of the email handler with remarks. All the required data will be passed in the dataframe PS_BC_AI_RPT_LOG_DF"""
+    """function will update the outcome of the email handler with remarks. All the required data will be passed in the DispositionRecord PS_BC_AI_RPT_LOG"""
     print("\ninside updateEmailDisposition routine\n")
 
     # send_df = pd.read_json(incoming_df)
     # print(send_df)
     # Insertlogstodb(send_df)
 
-    Insertlogstodb(incoming_df)  # update the email disposition commented out on 06/02/2025 because it was not working in the image
+    # queued for the background bulk insert instead of a synchronous Insertlogstodb round-trip per step
+    dispositionWriter.submit(incoming_df)
     return True
 
 
@@ -323,14 +923,24 @@ def checkImageforInvoice(content_type, content_bytes):
         }
     ]
 
-    result = llama32(messages)
-    print(f"llama return {result}")
-    splunkit(f"\nLlama: {result}", "info")
-
-    result = pixtral(messages)
-    print(f"pixtral return {result}")
-    splunkit(f"\nPixtral: {result}", "info")
+    # both models run concurrently; by default pixtral's answer decides, as before
+    ensemble = ensemble_call(
+        {"llama32": routedLlama.for_stage("classify"), "pixtral": pixtral},
+        messages,
+        policy=os.getenv("EMILY_IMAGE_CLASSIFY_POLICY", "all"),
+        prefer="pixtral",
+        is_confident=lambda a: ("Yes" in a) != ("No" in a),
+        vote_key=lambda a: "yes" if "Yes" in a else ("no" if "No" in a else a.strip().lower()),
+    )
+    for model, answer in ensemble.answers.items():
+        print(f"{model} return {answer}")
+    splunkit(
+        f"\ncheckImageforInvoice ensemble ({ensemble.policy}): answers={ensemble.answers} "
+        f"latencies={ensemble.latencies} winner={ensemble.winner} cancelled={ensemble.cancelled}",
+        "info",
+    )
 
+    result = ensemble.answer or ""
     if "Yes" in result:
         return True
     if "No" in result:
@@ -338,7 +948,53 @@ def checkImageforInvoice(content_type, content_bytes):
     return True
 
 
+_invoiceClassifier = None
+_invoiceClassifierLock = threading.Lock()
+
+
+def getInvoiceClassifier():
+    """Local classifier used ahead of the LLM; trained weights come from EMILY_CLASSIFIER_MODEL when set."""
+    global _invoiceClassifier
+    with _invoiceClassifierLock:
+        if _invoiceClassifier is None:
+            model_path = os.getenv("EMILY_CLASSIFIER_MODEL")
+            if model_path and os.path.exists(model_path):
+                _invoiceClassifier = InvoiceClassifier.load(model_path)
+            else:
+                _invoiceClassifier = InvoiceClassifier()
+        return _invoiceClassifier
+
+
+def logClassificationExample(text, is_invoice, source):
+    """training data for the local classifier (EMILY_CLASSIFIER_LOG): local decisions, LLM answers and the final
+    outcome of every classified attachment, so the sample is not limited to the ambiguous cases"""
+    log_path = os.getenv("EMILY_CLASSIFIER_LOG")
+    if log_path:
+        try:
+            log_classification_example(log_path, text or "", is_invoice, source=source)
+        except Exception as e:
+            splunkit(f"\nclassifyAttachment could not log example: {e}", "error")
+
+
 def classifyAttachment(text):
+    decision = getInvoiceClassifier().classify(text or "")
+    if decision.is_invoice is not None:
+        splunkit(
+            f"\nclassifyAttachment decided locally: invoice={decision.is_invoice} p={decision.probability}",
+            "info",
+        )
+        logClassificationExample(text, decision.is_invoice, "local")
+        return decision.is_invoice
+
+    # ambiguous: only the most invoice-like parts of the text go to the LLM
+    excerpt = select_relevant_excerpt(
+        text or "", max_chars=int(os.getenv("EMILY_CLASSIFY_EXCERPT_CHARS", "6000"))
+    )
+    splunkit(
+        f"\nclassifyAttachment escalating to llama32: p={decision.probability} "
+        f"chars={len(text or '')} excerpt_chars={len(excerpt)}",
+        "info",
+    )
     messages = [
         {
             "role": "user",
@@ -348,19 +1004,19 @@ def classifyAttachment(text):
                     "text": (
                         "Given the text extracted from an attachment, determine if the attachment is an invoice or not. "
                         "Invoices typically include the word 'Invoice'. Answer with either 'Yes' or 'No'. "
-                        f"Attachment text: {text}"
+                        f"Attachment text: {excerpt}"
                     ),
                 },
             ],
         }
     ]
 
-    result = llama32(messages)
-    if result == "Yes":
-        return True
+    result = routedLlama.for_stage("classify")(messages)
     if result == "max_new_token_error":
         return "max_new_token_error"
-    return False
+
+    logClassificationExample(text, result == "Yes", "llm")
+    return result == "Yes"
 
 
 def validateVoucherOutcome(workingEmail):
@@ -370,6 +1026,79 @@ def validateVoucherOutcome(workingEmail):
     return True
 
 
+def summarizeMessageList(result):
+    """Compact stand-in for a getMessageList response in the llm history (the raw Graph payload includes full bodies)."""
+    summary = []
+    for msg in (result or {}).get("value", []):
+        sender = ((msg.get("from") or {}).get("emailAddress") or {}).get("address")
+        summary.append(
+            {
+                "id": msg.get("id"),
+                "subject": msg.get("subject"),
+                "from": sender,
+                "receivedDateTime": msg.get("receivedDateTime"),
+                "hasAttachments": msg.get("hasAttachments"),
+                "bodyPreview": (msg.get("bodyPreview") or "")[:200],
+            }
+        )
+    return json.dumps(summary)
+
+
+class ConversationContext:
+    """Per-email llm conversation. Keeps the system prompt plus the most recent max_messages turns; older turns are
+    folded into a short summary so the prompt size of each tool-routing call stays bounded. reset() is called between
+    emails and keeps a capped number of finished transcripts for troubleshooting."""
+
+    def __init__(self, system_prompt=None, max_messages=12, max_message_chars=2000, max_summary_chars=1500, keep_transcripts=20):
+        self.system_prompt = system_prompt
+        self.max_messages = max_messages
+        self.max_message_chars = max_message_chars
+        self.max_summary_chars = max_summary_chars
+        self.transcripts = deque(maxlen=keep_transcripts)
+        self.history = []
+        self.summary = []
+
+    def _truncate(self, content, limit):
+        if isinstance(content, str) and len(content) > limit:
+            return content[:limit] + f"... [truncated {len(content) - limit} chars]"
+        return content
+
+    def append(self, message):
+        message = dict(message)
+        message["content"] = self._truncate(message.get("content"), self.max_message_chars)
+        self.history.append(message)
+
+        while len(self.history) > self.max_messages:
+            dropped = self.history.pop(0)
+            content = dropped.get("content")
+            text = content if isinstance(content, str) else json.dumps(content)[:160]
+            self.summary.append(f"{dropped.get('role')}: {text[:160]}")
+            while self.summary and sum(len(x) for x in self.summary) > self.max_summary_chars:
+                self.summary.pop(0)
+
+    def window(self):
+        """Messages to send to the llm for the next call."""
+        out = []
+        if self.system_prompt:
+            out.append({"role": "system", "content": self.system_prompt})
+        if self.summary:
+            out.append({"role": "assistant", "content": "Earlier in this email:\n" + "\n".join(self.summary)})
+        out.extend(self.history)
+        return out
+
+    def reset(self):
+        if self.history or self.summary:
+            self.transcripts.append({"summary": list(self.summary), "history": list(self.history)})
+        self.history = []
+        self.summary = []
+
+    def __len__(self):
+        return len(self.history)
+
+    def __iter__(self):
+        return iter(self.window())
+
+
 class Agent:
     """This is the agent class that invokes tools and functions to work on the email and its attachements."""
 
@@ -390,9 +1119,12 @@ class Agent:
         # logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s', filename=self.logfilename,filemode="w")
         handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
 
-        # Create a logger
+        # Create a logger. Worker threads each own an Agent, so only the first one attaches the file handler.
         self.logger = logging.getLogger(__name__)
-        self.logger.addHandler(handler)
+        if not any(isinstance(h, RotatingFileHandler) for h in self.logger.handlers):
+            self.logger.addHandler(handler)
+        else:
+            handler.close()
 
         # self.logger = init_logger()
         try:
@@ -402,54 +1134,36 @@ class Agent:
             self.workingEmail = CurrentWorkingEmail()
             self.MIMEMessage = []
             self.system_prompt = system_prompt
-            self.messages = []
+            self.messages = ConversationContext(
+                system_prompt,
+                max_messages=int(os.getenv("EMILY_MAX_HISTORY_MESSAGES", "12")),
+                keep_transcripts=int(os.getenv("EMILY_TRANSCRIPTS_KEPT", "20")),
+            )
             self.bodyTxt = ""
             self.RTB_reason = ""
 
             if system_prompt:
-                self.messages.append({"role": "system", "content": system_prompt})
-
-                # Define the column names and data types for the log table for email dispositions
-                # hosted in peopleSoft as a bolt on table. table name is PS_BC_AI_RPT_LOG
-                columns = {
-                    "BC_MSG_ID": "VARCHAR2 (254 Byte)",
-                    "BC_EMAIL_SUBJTEXT": "VARCHAR2 (254 Byte)",
-                    "EMAIL_DATETIME": "TIMESTAMP(6)",
-                    "INVOICE_ID": "VARCHAR2 (30 Byte)",
-                    "INVOICE_AMOUNT": "NUMBER (26,3)",
-                    "PO_ID": "VARCHAR2 (10 Byte)",
-                    "INVOICE_DT": "VARCHAR2 (10 Byte)",
-                    "EXPORT_DATE": "DATE",
-                    "ERROR_MSG_TXT": "VARCHAR2 (254 Byte)",
-                    "BC_RUNTIME": "TIMESTAMP(6)",
-                    "BC_REMARKS": "VARCHAR2 (254 Byte)",
-                }
-
-                # Create an empty DataFrame with the specified columns
-                self.PS_BC_AI_RPT_LOG_DF = pd.DataFrame(columns=list(columns.keys()))
-
-                # Set the data types for each column
-                for col, dtype in columns.items():
-                    self.PS_BC_AI_RPT_LOG_DF[col] = self.PS_BC_AI_RPT_LOG_DF[col].astype(dtype)
-
-                self.PS_BC_AI_RPT_LOG_DF["BC_MSG_ID"] = "NULL"
-                self.PS_BC_AI_RPT_LOG_DF["EMAIL_DATETIME"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                self.PS_BC_AI_RPT_LOG_DF["INVOICE_ID"] = 0
-                self.PS_BC_AI_RPT_LOG_DF["INVOICE_AMOUNT"] = 0.00
-                self.PS_BC_AI_RPT_LOG_DF["PO_ID"] = 0
-                self.PS_BC_AI_RPT_LOG_DF["INVOICE_DT"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                self.PS_BC_AI_RPT_LOG_DF["EXPORT_DATE"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                self.PS_BC_AI_RPT_LOG_DF["ERROR_MSG_TXT"] = "Initializing the Email Agent. " + str(datetime.now())
-                self.PS_BC_AI_RPT_LOG_DF["BC_RUNTIME"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                self.PS_BC_AI_RPT_LOG_DF["BC_REMARKS"] = "Initializing the Email Agent. " + str(datetime.now())
-                self.PS_BC_AI_RPT_LOG_DF["BC_EMAIL_SUBJTEXT"] = " "
-
-                print(self.PS_BC_AI_RPT_LOG_DF)
+                # one disposition row for the email being worked; converted to a DataFrame only when flushed
+                self.PS_BC_AI_RPT_LOG = DispositionRecord()
+
+                self.PS_BC_AI_RPT_LOG.BC_MSG_ID = "NULL"
+                self.PS_BC_AI_RPT_LOG.EMAIL_DATETIME = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self.PS_BC_AI_RPT_LOG.INVOICE_ID = 0
+                self.PS_BC_AI_RPT_LOG.INVOICE_AMOUNT = 0.00
+                self.PS_BC_AI_RPT_LOG.PO_ID = 0
+                self.PS_BC_AI_RPT_LOG.INVOICE_DT = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self.PS_BC_AI_RPT_LOG.EXPORT_DATE = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Initializing the Email Agent. " + str(datetime.now())
+                self.PS_BC_AI_RPT_LOG.BC_RUNTIME = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self.PS_BC_AI_RPT_LOG.BC_REMARKS = "Initializing the Email Agent. " + str(datetime.now())
+                self.PS_BC_AI_RPT_LOG.BC_EMAIL_SUBJTEXT = " "
+
+                print(self.PS_BC_AI_RPT_LOG)
 
                 self.logger.info("Initializing the Email Agent completed. " + str(datetime.now()))
                 splunkit("Initializing the Email Agent completed. " + str(datetime.now()), "info")
-                self.logger.info(f"PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG_DF}")
-                splunkit(f"PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG_DF}", "info")
+                self.logger.info(f"PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG}")
+                splunkit(f"PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG}", "info")
                 # print(self.messages)
 
         except Exception as e:
@@ -506,17 +1220,17 @@ class Agent:
                             print(self.workingEmail)
 
                             # update the log table entries with email dispositions
-                            self.PS_BC_AI_RPT_LOG_DF.at[0, "BC_MSG_ID"] = self.workingEmail.id
+                            self.PS_BC_AI_RPT_LOG.BC_MSG_ID = self.workingEmail.id
                             format_date_time = datetime.fromisoformat(self.workingEmail.received_date_time)
-                            self.PS_BC_AI_RPT_LOG_DF.at[0, "EMAIL_DATETIME"] = format_date_time.strftime("%Y-%m-%d %H:%M:%S")
-                            self.PS_BC_AI_RPT_LOG_DF["EXPORT_DATE"] = datetime.now().strftime("%Y-%m-%d")
-                            self.PS_BC_AI_RPT_LOG_DF.at[0, "BC_EMAIL_SUBJTEXT"] = self.workingEmail.subject
-                            self.PS_BC_AI_RPT_LOG_DF.at[0, "ERROR_MSG_TXT"] = "Step 1: getMessageList - Success"
-                            self.PS_BC_AI_RPT_LOG_DF.at[0, "BC_REMARKS"] = "Successfuly read the email from the inbox"
+                            self.PS_BC_AI_RPT_LOG.EMAIL_DATETIME = format_date_time.strftime("%Y-%m-%d %H:%M:%S")
+                            self.PS_BC_AI_RPT_LOG.EXPORT_DATE = datetime.now().strftime("%Y-%m-%d")
+                            self.PS_BC_AI_RPT_LOG.BC_EMAIL_SUBJTEXT = self.workingEmail.subject
+                            self.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 1: getMessageList - Success"
+                            self.PS_BC_AI_RPT_LOG.BC_REMARKS = "Successfuly read the email from the inbox"
 
-                            self.logger.info(f"PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG_DF}")
-                            splunkit(f"PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG_DF}", "info")
-                            print(self.PS_BC_AI_RPT_LOG_DF)
+                            self.logger.info(f"PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG}")
+                            splunkit(f"PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG}", "info")
+                            print(self.PS_BC_AI_RPT_LOG)
 
                             self.messages.append(
                                 {
@@ -524,7 +1238,7 @@ class Agent:
                                     "content": "getMessage list successfully fetched the first email from Inbox. PS_BC_AI_RPT_LOG_DF is also updated.",
                                 }
                             )
-                            self.messages.append({"role": "assistant", "content": str(result)})  # keep track of response
+                            self.messages.append({"role": "assistant", "content": summarizeMessageList(result)})  # keep track of response
                             self.messages.append(
                                 {
                                     "role": "assistant",
@@ -532,7 +1246,7 @@ class Agent:
                                 }
                             )
                         else:
-                            self.messages.append({"role": "assistant", "content": str(result)})
+                            self.messages.append({"role": "assistant", "content": summarizeMessageList(result)})
                             self.messages.append(
                                 {"role": "assistant", "content": "There are no emails in the Inbox. Please check the Inbox."}
                             )
@@ -542,16 +1256,16 @@ class Agent:
 
                         print(f'\nGet email attachments function called')
 
-                        attachment = [Attachment(data) for data in result.get('value')]
-
-                        for data in result.get('value'):
-                            self.workingEmail.assignAttachment(data)
+                        attachment = [self.workingEmail.assignAttachment(data) for data in result.get('value')]
 
                         print(self.workingEmail)
 
                         NumberOfAttachments = len(self.workingEmail.attachments)
+                        # vendors often attach the same invoice twice; only the first copy is processed
+                        emailAttachments = AttachmentIndex(policy=emailDedupPolicy)
 
                         for item in attachment:
+                            classifiedText = None
 
                             print(f'attachment id {item.id}')
                             print(f'attachment.name {item.name}')
@@ -564,14 +1278,25 @@ class Agent:
                             splunkit(f'Processing attachment: {item.name}', "info")
                             self.logger.info(f"Processing attachment: {item.name}")
 
+                            fingerprints = attachmentFingerprints(item)
+                            duplicate = emailAttachments.lookup(fingerprints) if fingerprints else None
+                            if duplicate is not None:
+                                splunkit(f"{self.workingEmail.id} - {item.name} duplicates {duplicate.get('name')}; skipped", "info")
+                                self.logger.info(f"{item.name} duplicates {duplicate.get('name')}; skipped")
+                                continue
+                            if fingerprints:
+                                emailAttachments.add(fingerprints, {"name": item.name})
+
                             if item.content_type == 'application/pdf':
 
-                                text, tables, coordinates, md_text = pymuLLM(item.name, item.content_bytes)
+                                pdfDocument = item.document()
+                                text, md_text = pdfDocument.pageTexts(), pdfDocument.markdown()
 
                                 if not md_text or not "".join(text).strip():
                                     raise Exception("PDF extracted as blank")
 
                                 try:
+                                    classifiedText = md_text
                                     classification = classifyAttachment(md_text)
 
                                     if classification == "max_new_token_error":
@@ -591,9 +1316,7 @@ class Agent:
                                     return "max_new_token_error"
 
                                 try:
-                                    voucher_dict, evidence_dict = extract_invoice_from_pdf_attachment(
-                                        item.content_bytes
-                                    )
+                                    voucher_dict, evidence_dict = item.extractInvoice()
                                 except Exception as e:
                                     self.RTB_reason = f"pdf_vision extract failed: {e}"
                                     splunkit(self.RTB_reason, "error")
@@ -623,7 +1346,7 @@ class Agent:
                                 }]
 
                                 try:
-                                    llamaresult = llama32(messages)
+                                    llamaresult = routedLlama(messages)
                                     if llamaresult == "max_new_token_error":
                                         raise Exception("max_new_token_error")
                                 except Exception as e:
@@ -650,7 +1373,10 @@ class Agent:
 
                             elif item.content_type == 'image/png' or item.content_type == 'image/jpeg':
 
-                                classifyImageInvoice = checkImageforInvoice(item.content_type, item.content_bytes)
+                                # classification and extraction of the image share one document budget
+                                imageDeadline = time.monotonic() + documentBudgetSeconds
+                                with call_deadline(documentBudgetSeconds):
+                                    classifyImageInvoice = checkImageforInvoice(item.content_type, item.content_bytes)
                                 print(f'The image is an invoice: {classifyImageInvoice}')
                                 self.logger.info(f"The image is an invoice: {classifyImageInvoice}")
                                 splunkit(f"{self.workingEmail.id} - The image is an invoice: - {classifyImageInvoice}", "info")
@@ -676,15 +1402,23 @@ class Agent:
                                     }
                                 ]
 
-                                self.PS_BC_AI_RPT_LOG_DF.at[0,'ERROR_MSG_TXT'] = "Step 4: getEmailAttachments - Success"
-                                self.PS_BC_AI_RPT_LOG_DF.at[0,"BC_REMARKS"] = f"Successfuly read {NumberOfAttachments} attachments from the email"
-                                self.logger.info(f"End of extracting images: PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG_DF}")
-                                splunkit(f"End of extracting images: PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG_DF}", "info")
+                                self.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 4: getEmailAttachments - Success"
+                                self.PS_BC_AI_RPT_LOG.BC_REMARKS = f"Successfuly read {NumberOfAttachments} attachments from the email"
+                                self.logger.info(f"End of extracting images: PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG}")
+                                splunkit(f"End of extracting images: PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG}", "info")
 
                                 print(f'\nmessage {messages}\n')
 
+                                # llama32 and pixtral see the same payload, so run them side by side
+                                with call_deadline(max(imageDeadline - time.monotonic(), 0.0)):
+                                    ensemble = ensemble_call({"llama32": routedLlama, "pixtral": pixtral}, messages, policy="all")
+                                self.logger.info(f"Image extraction model latencies: {ensemble.latencies}")
+                                splunkit(f"Image extraction model latencies: {self.workingEmail.id} - {ensemble.latencies}", "info")
+
                                 try:
-                                    llamarresult = llama32(messages)
+                                    if "llama32" in ensemble.errors:
+                                        raise ensemble.errors["llama32"]
+                                    llamarresult = ensemble.answers.get("llama32", "")
                                     if llamarresult == "max_new_token_error":
                                         raise Exception("max_new_token_error")
                                 except Exception as e:
@@ -697,14 +1431,16 @@ class Agent:
 
                                 print(f"\nLlama returned: {llamarresult}.")
 
-                                pixtralresult = pixtral(messages)
+                                if "pixtral" in ensemble.errors:
+                                    raise ensemble.errors["pixtral"]
+                                pixtralresult = ensemble.answers.get("pixtral", "")
                                 print(f"\nPixTral returned: {pixtralresult}.")
 
                                 if llamarresult.startswith("The image is not an invoice") and pixtralresult.startswith("The image is not an invoice"):
-                                    self.PS_BC_AI_RPT_LOG_DF.at[0,'ERROR_MSG_TXT'] = "Step 4: getEmailAttachments - LLM reported image is not an invoice"
-                                    self.PS_BC_AI_RPT_LOG_DF.at[0,"BC_REMARKS"] = f"Successfuly read {NumberOfAttachments} attachments from the email"
-                                    self.logger.info(f"End of extracting images: PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG_DF}")
-                                    splunkit(f"End of extracting images: PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG_DF}", "info")
+                                    self.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 4: getEmailAttachments - LLM reported image is not an invoice"
+                                    self.PS_BC_AI_RPT_LOG.BC_REMARKS = f"Successfuly read {NumberOfAttachments} attachments from the email"
+                                    self.logger.info(f"End of extracting images: PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG}")
+                                    splunkit(f"End of extracting images: PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG}", "info")
                                     self.logger.info(f"Image is not an invoice")
                                     splunkit(f"Image is not an invoice: {self.workingEmail.id}", "info")
                                     self.messages.append({"role": "assistant", "content": "The image is not an invoice"})
@@ -732,7 +1468,7 @@ class Agent:
                                 }]
 
                                 try:
-                                    llamaresult = llama32(messages)
+                                    llamaresult = routedLlama(messages)
                                     if llamaresult == "max_new_token_error":
                                         raise Exception("max_new_token_error")
                                 except Exception as e:
@@ -763,6 +1499,7 @@ class Agent:
                                 print(f'attachment.content_bytes {md_text}')
 
                                 try:
+                                    classifiedText = md_text
                                     classification = classifyAttachment(md_text)
                                     if classification == "max_new_token_error":
                                         raise Exception('max_new_token_error')
@@ -789,15 +1526,15 @@ class Agent:
                                     }]
                                 }]
 
-                                self.PS_BC_AI_RPT_LOG_DF.at[0,'ERROR_MSG_TXT'] = "Step 4: getEmailAttachments - Success"
-                                self.PS_BC_AI_RPT_LOG_DF.at[0,"BC_REMARKS"] = f"Successfuly read {NumberOfAttachments} attachments from the email"
-                                self.logger.info(f"End of extracting word document: PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG_DF}")
-                                splunkit(f"End of extracting word document: PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG_DF}", "info")
+                                self.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 4: getEmailAttachments - Success"
+                                self.PS_BC_AI_RPT_LOG.BC_REMARKS = f"Successfuly read {NumberOfAttachments} attachments from the email"
+                                self.logger.info(f"End of extracting word document: PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG}")
+                                splunkit(f"End of extracting word document: PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG}", "info")
 
                                 print(f'\nmessage {messages}\n')
 
                                 try:
-                                    llamarresult = llama32(messages)
+                                    llamarresult = routedLlama(messages)
                                     if llamarresult == "max_new_token_error":
                                         raise Exception("max_new_token_error")
                                 except Exception as e:
@@ -830,7 +1567,7 @@ class Agent:
                                 }]
 
                                 try:
-                                    llamaresult = llama32(messages)
+                                    llamaresult = routedLlama(messages)
                                     if llamaresult == "max_new_token_error":
                                         raise Exception("max_new_token_error")
                                 except Exception as e:
@@ -856,13 +1593,15 @@ class Agent:
 
                                 if item.name.lower().endswith('.pdf'):
 
-                                    text, tables, coordinates, md_text = pymuLLM(item.name, item.content_bytes)
+                                    pdfDocument = item.document()
+                                    text, md_text = pdfDocument.pageTexts(), pdfDocument.markdown()
                                     if not md_text or not "".join(text).strip():
                                         raise Exception("PDF extracted as blank")
 
                                     print(f'attachment.content_bytes {md_text}')
 
                                     try:
+                                        classifiedText = md_text
                                         classification = classifyAttachment(md_text)
 
                                         if classification == "max_new_token_error":
@@ -883,9 +1622,7 @@ class Agent:
                                         return "max_new_token_error"
 
                                     try:
-                                        voucher_dict, evidence_dict = extract_invoice_from_pdf_attachment(
-                                            item.content_bytes
-                                        )
+                                        voucher_dict, evidence_dict = item.extractInvoice()
                                     except Exception as e:
                                         self.RTB_reason = f"pdf_vision extract failed: {e}"
                                         splunkit(self.RTB_reason, "error")
@@ -915,7 +1652,7 @@ class Agent:
                                     }]
 
                                     try:
-                                        llamaresult = llama32(messages)
+                                        llamaresult = routedLlama(messages)
                                         if llamaresult == "max_new_token_error":
                                             raise Exception("max_new_token_error")
                                     except Exception as e:
@@ -943,6 +1680,7 @@ class Agent:
                                     print(f'attachment.content_bytes {md_text}')
 
                                     try:
+                                        classifiedText = md_text
                                         classification = classifyAttachment(md_text)
                                         if classification == "max_new_token_error":
                                             raise Exception('max_new_token_error')
@@ -971,7 +1709,7 @@ class Agent:
                                     print(f'\nmessage {messages}\n')
 
                                     try:
-                                        llamarresult = llama32(messages)
+                                        llamarresult = routedLlama(messages)
                                         if llamarresult == "max_new_token_error":
                                             raise Exception("max_new_token_error")
                                     except Exception as e:
@@ -1004,7 +1742,7 @@ class Agent:
                                     }]
 
                                     try:
-                                        llamaresult = llama32(messages)
+                                        llamaresult = routedLlama(messages)
                                         if llamaresult == "max_new_token_error":
                                             raise Exception("max_new_token_error")
                                     except Exception as e:
@@ -1027,16 +1765,24 @@ class Agent:
                                     json_voucher = validateVoucher(newVoucher)
 
                                 else:
-                                    print(f'attachment.content_bytes {item.content_bytes}')
+                                    print(f'attachment skipped {item} size={item.size}')
                                     continue
 
                             else:
-                                print(f'attachment.content_bytes {item.content_bytes}')
+                                print(f'attachment skipped {item} size={item.size}')
                                 continue
 
                             if json_voucher == "Error":
                                 return "Error"
 
+                            if classifiedText and isinstance(json_voucher, dict):
+                                # the outcome labels the attachment whether it was classified locally or by the LLM
+                                logClassificationExample(
+                                    classifiedText,
+                                    bool(json_voucher.get("invoice_number") or json_voucher.get("gross_invoice_amount")),
+                                    "disposition",
+                                )
+
                             if "isvalid" in json_voucher and json_voucher["isvalid"] == "Error":
                                 if json_voucher.get("status_code") == 500:
                                     draft_message = CDR_ConnectionError_prompt
@@ -1074,26 +1820,26 @@ class Agent:
                                     self.logger.info(f'Voucher validation success : {json_voucher["isvalid"]}')
                                     splunkit(f'Voucher validation success : {self.workingEmail.id} *** {json_voucher["isvalid"]}', "info")
 
-                                    self.PS_BC_AI_RPT_LOG_DF.at[0,'BC_REMARKS'] = "Voucher validated successfully"
+                                    self.PS_BC_AI_RPT_LOG.BC_REMARKS = "Voucher validated successfully"
 
                                     if json_voucher.get("invoice_number", "") != "":
-                                        self.PS_BC_AI_RPT_LOG_DF.at[0,'INVOICE_ID'] = json_voucher["invoice_number"]
+                                        self.PS_BC_AI_RPT_LOG.INVOICE_ID = json_voucher["invoice_number"]
                                     if json_voucher.get("invoice_date", "") != "":
-                                        self.PS_BC_AI_RPT_LOG_DF.at[0,'INVOICE_DT'] = json_voucher["invoice_date"]
+                                        self.PS_BC_AI_RPT_LOG.INVOICE_DT = json_voucher["invoice_date"]
                                     if json_voucher.get("gross_invoice_amount", "") != "":
-                                        self.PS_BC_AI_RPT_LOG_DF.at[0,'INVOICE_AMOUNT'] = json_voucher["gross_invoice_amount"].replace(',','').replace('$','')
+                                        self.PS_BC_AI_RPT_LOG.INVOICE_AMOUNT = json_voucher["gross_invoice_amount"].replace(',','').replace('$','')
                                     if json_voucher.get("po_number", "") != "":
-                                        self.PS_BC_AI_RPT_LOG_DF.at[0,'PO_ID'] = json_voucher["po_number"]
+                                        self.PS_BC_AI_RPT_LOG.PO_ID = json_voucher["po_number"]
 
-                                    self.logger.info(f"Return from validateVoucher : PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG_DF}")
-                                    splunkit(f"Return from validateVoucher : PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG_DF}", "info")
+                                    self.logger.info(f"Return from validateVoucher : PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG}")
+                                    splunkit(f"Return from validateVoucher : PS_BC_AI_RPT_LOG_DF: {self.PS_BC_AI_RPT_LOG}", "info")
 
                                     invoiceItems = json_voucher["invoice_items"]
 
                                     self.workingEmail.assignVoucher(json_voucher)
 
                                     result = createDocumentBundle(self.workingEmail, json_voucher, attachment)
-                                    updateEmailDisposition(self.PS_BC_AI_RPT_LOG_DF)
+                                    updateEmailDisposition(self.PS_BC_AI_RPT_LOG)
 
                                 elif json_voucher["isvalid"] == False:
                                     draft_prompt, reason = triagePeopleSoftInvalid(json_voucher)
@@ -1112,24 +1858,24 @@ class Agent:
                                     else:
                                         createReplyMessage(self.workingEmail.id, draft_prompt)
 
-                                    self.PS_BC_AI_RPT_LOG_DF.at[0,'ERROR_MSG_TXT'] = "Step 7: Create a draft response - Success"
-                                    self.PS_BC_AI_RPT_LOG_DF.at[0,"BC_REMARKS"] = "Draft email for missing information created"
-                                    updateEmailDisposition(self.PS_BC_AI_RPT_LOG_DF)
+                                    self.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 7: Create a draft response - Success"
+                                    self.PS_BC_AI_RPT_LOG.BC_REMARKS = "Draft email for missing information created"
+                                    updateEmailDisposition(self.PS_BC_AI_RPT_LOG)
 
                                     self.workingEmail.assignVoucher(json_voucher)
-                                    self.PS_BC_AI_RPT_LOG_DF.at[0,'BC_REMARKS'] = "Voucher validation failed"
-                                    updateEmailDisposition(self.PS_BC_AI_RPT_LOG_DF)
+                                    self.PS_BC_AI_RPT_LOG.BC_REMARKS = "Voucher validation failed"
+                                    updateEmailDisposition(self.PS_BC_AI_RPT_LOG)
 
                                 else:
                                     draft_prompt, reason = triagePeopleSoftInvalid(json_voucher)
                                     self.RTB_reason = reason
                                     createReplyMessage(self.workingEmail.id, draft_prompt)
-                                    updateEmailDisposition(self.PS_BC_AI_RPT_LOG_DF)
+                                    updateEmailDisposition(self.PS_BC_AI_RPT_LOG)
 
                             except Exception as e:
                                 self.logger.error(f"Error exception trapped after voucher validation: {e}")
                                 splunkit(f"Error exception trapped after voucher validation: {e}", "error")
-                                updateEmailDisposition(self.PS_BC_AI_RPT_LOG_DF)
+                                updateEmailDisposition(self.PS_BC_AI_RPT_LOG)
                                 return "Error"
                             finally:
                                 for voucherItem in self.workingEmail.voucher:
@@ -1139,7 +1885,7 @@ class Agent:
                                         result = False
                                         break
 
-                                print(self.PS_BC_AI_RPT_LOG_DF)
+                                print(self.PS_BC_AI_RPT_LOG)
 
                         if len(self.workingEmail.voucher) == 0:
                             return False
@@ -1148,13 +1894,13 @@ class Agent:
                     elif function_name == "validateVoucher":
                         print("\nvalidateVoucher function called")
                         self.messages.append({"role": "assistant", "content": str(result)})
-                        print(self.PS_BC_AI_RPT_LOG_DF)
+                        print(self.PS_BC_AI_RPT_LOG)
 
                     elif function_name == "moveMessage":
-                        self.PS_BC_AI_RPT_LOG_DF.at[0, "BC_REMARKS"] = "Message moved to " + parameters["folderName"]
+                        self.PS_BC_AI_RPT_LOG.BC_REMARKS = "Message moved to " + parameters["folderName"]
                         self.messages.append({"role": "assistant", "content": str(result)})
-                        print(self.PS_BC_AI_RPT_LOG_DF)
-                        updateEmailDisposition(self.PS_BC_AI_RPT_LOG_DF)
+                        print(self.PS_BC_AI_RPT_LOG)
+                        updateEmailDisposition(self.PS_BC_AI_RPT_LOG)
 
                     elif function_name in ("create_draft", "createReplyMessage"):
                         output = "Draft created."
@@ -1162,12 +1908,12 @@ class Agent:
                         self.draft_id = result
 
                     elif function_name == "updateEmailDisposition":
-                        updateEmailDisposition(self.PS_BC_AI_RPT_LOG_DF)
+                        updateEmailDisposition(self.PS_BC_AI_RPT_LOG)
                         self.messages.append({"role": "assistant", "content": str(result)})
 
                     else:
                         self.messages.append({"role": "assistant", "content": str(result)})
-                        print(self.PS_BC_AI_RPT_LOG_DF)
+                        print(self.PS_BC_AI_RPT_LOG)
 
                     return result
 
@@ -1178,7 +1924,7 @@ class Agent:
                     return "Error"
 
             self.messages.append({"role": "assistant", "content": str(result)})
-            print(self.PS_BC_AI_RPT_LOG_DF)
+            print(self.PS_BC_AI_RPT_LOG)
             return result
 
         except Exception as e:
@@ -1187,7 +1933,7 @@ class Agent:
             return "Error"
 
     def llama(self):
-        result = llama32(self.messages)
+        result = llama32(self.messages.window())
         try:
             res = json.loads(result.split("<|python_tag|>")[-1])
             function_name = res["name"]
@@ -1244,8 +1990,18 @@ class Agent:
         return voucher
 
 
-def HelloEmily(agent: Agent):
-    result = getMessageList(1, "Inbox")
+_mime_dump_lock = threading.Lock()
+
+
+def HelloEmily(agent: Agent, result=None):
+    """Process one email. When result is None the first message in the Inbox is fetched, otherwise result is a
+    getMessageList-shaped dict ({"value": [message]}) handed over by the InboxWorkerPool."""
+    if result is None:
+        result = getMessageList(1, "Inbox")
+
+    # every email starts from a fresh llm context; spool files of the previous email are removed
+    agent.messages.reset()
+    agent.workingEmail.releaseAttachments()
 
     if result is None:
         splunkit("Error calling getMessageList.    ", "error")
@@ -1264,29 +2020,30 @@ def HelloEmily(agent: Agent):
 
         agent.workingEmail.assignMimeMessage(mime_msg)
 
-        with open(r"c:\data\Outputfiles\Emily_mime_messageContent.eml", "wb") as f:
-            f.write(agent.workingEmail.mime_message.content)
+        with _mime_dump_lock:
+            with open(r"c:\data\Outputfiles\Emily_mime_messageContent.eml", "wb") as f:
+                f.write(agent.workingEmail.mime_message.content)
 
-        with open(r"c:\data\Outputfiles\Emily_mime_messageText.eml", "wb") as f:
-            f.write(agent.workingEmail.mime_message.text.encode("utf-8"))
+            with open(r"c:\data\Outputfiles\Emily_mime_messageText.eml", "wb") as f:
+                f.write(agent.workingEmail.mime_message.text.encode("utf-8"))
 
         agent.bodyTxt = agent.workingEmail.body["content"]
         print(agent.workingEmail)
 
         # update the log table entries with email dispositions
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "BC_MSG_ID"] = agent.workingEmail.id
+        agent.PS_BC_AI_RPT_LOG.BC_MSG_ID = agent.workingEmail.id
         format_date_time = datetime.fromisoformat(agent.workingEmail.received_date_time)
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "EMAIL_DATETIME"] = format_date_time.strftime("%Y-%m-%d %H:%M:%S")
-        agent.PS_BC_AI_RPT_LOG_DF["EXPORT_DATE"] = datetime.now().strftime("%Y-%m-%d")
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "BC_EMAIL_SUBJTEXT"] = agent.workingEmail.subject
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "ERROR_MSG_TXT"] = "Step 1: getMessageList - Success"
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "BC_REMARKS"] = "Successfuly read the email from the inbox"
+        agent.PS_BC_AI_RPT_LOG.EMAIL_DATETIME = format_date_time.strftime("%Y-%m-%d %H:%M:%S")
+        agent.PS_BC_AI_RPT_LOG.EXPORT_DATE = datetime.now().strftime("%Y-%m-%d")
+        agent.PS_BC_AI_RPT_LOG.BC_EMAIL_SUBJTEXT = agent.workingEmail.subject
+        agent.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 1: getMessageList - Success"
+        agent.PS_BC_AI_RPT_LOG.BC_REMARKS = "Successfuly read the email from the inbox"
 
-        agent.logger.info(f"PS_BC_AI_RPT_LOG_DF: {agent.PS_BC_AI_RPT_LOG_DF}")
-        splunkit(f"PS_BC_AI_RPT_LOG_DF: {agent.PS_BC_AI_RPT_LOG_DF}", "info")
-        updateEmailDisposition(agent.PS_BC_AI_RPT_LOG_DF)
+        agent.logger.info(f"PS_BC_AI_RPT_LOG_DF: {agent.PS_BC_AI_RPT_LOG}")
+        splunkit(f"PS_BC_AI_RPT_LOG_DF: {agent.PS_BC_AI_RPT_LOG}", "info")
+        updateEmailDisposition(agent.PS_BC_AI_RPT_LOG)
 
-        print(agent.PS_BC_AI_RPT_LOG_DF)
+        print(agent.PS_BC_AI_RPT_LOG)
 
         agent.messages.append(
             {
@@ -1294,7 +2051,7 @@ def HelloEmily(agent: Agent):
                 "content": "getMessage list successfully fetched the first email from Inbox. PS_BC_AI_RPT_LOG_DF is also updated.",
             }
         )
-        agent.messages.append({"role": "assistant", "content": str(result)})
+        agent.messages.append({"role": "assistant", "content": summarizeMessageList(result)})
         agent.messages.append(
             {
                 "role": "assistant",
@@ -1302,7 +2059,7 @@ def HelloEmily(agent: Agent):
             }
         )
     else:
-        agent.messages.append({"role": "assistant", "content": str(result)})
+        agent.messages.append({"role": "assistant", "content": summarizeMessageList(result)})
         agent.messages.append({"role": "assistant", "content": "There are no emails in the Inbox. Please check the Inbox."})
         agent.logger.info("There are no emails in the Inbox. Will try again in a few minutes.")
         return True
@@ -1310,12 +2067,12 @@ def HelloEmily(agent: Agent):
     if "rush" in str(agent.workingEmail.subject).lower() or "rush" in str(agent.workingEmail.body).lower():
         moveMessage(agent.workingEmail.id, "Rush")
 
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "ERROR_MSG_TXT"] = "Step 2: Rush Email identified - Success"
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "BC_REMARKS"] = "Email moved to  Rush folder"
+        agent.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 2: Rush Email identified - Success"
+        agent.PS_BC_AI_RPT_LOG.BC_REMARKS = "Email moved to  Rush folder"
         agent.messages.append({"role": "assistant", "content": "Message moved to Rush folder"})
 
-        print(agent.PS_BC_AI_RPT_LOG_DF)
-        updateEmailDisposition(agent.PS_BC_AI_RPT_LOG_DF)
+        print(agent.PS_BC_AI_RPT_LOG)
+        updateEmailDisposition(agent.PS_BC_AI_RPT_LOG)
         return True
 
     message = (
@@ -1330,9 +2087,9 @@ def HelloEmily(agent: Agent):
     if step4response == "Error":
         agent.logger.error("HelloEmily: Possible connection error in step 4: Check invoice related email or not")
         splunkit("HelloEmily: Possible connection error in step 4 : Check invoice related email or not", "error")
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "ERROR_MSG_TXT"] = "Step 4: Check invoice related email or not - Failed"
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "BC_REMARKS"] = "Possible llm connection error in step 4 : Check invoice related email or not"
-        updateEmailDisposition(agent.PS_BC_AI_RPT_LOG_DF)
+        agent.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 4: Check invoice related email or not - Failed"
+        agent.PS_BC_AI_RPT_LOG.BC_REMARKS = "Possible llm connection error in step 4 : Check invoice related email or not"
+        updateEmailDisposition(agent.PS_BC_AI_RPT_LOG)
         return False
 
     # elif json.loads(step4response)['Ans'] == 'No':
@@ -1341,38 +2098,38 @@ def HelloEmily(agent: Agent):
         emailTypeResponse = agent(message)
 
         if '"Ans": "Yes"' in emailTypeResponse:
-            agent.PS_BC_AI_RPT_LOG_DF.at[0, "ERROR_MSG_TXT"] = "Step 4: Vendor Update related email identified - Success"
-            agent.PS_BC_AI_RPT_LOG_DF.at[0, "BC_REMARKS"] = "Email identified as Vendor Update related"
-            updateEmailDisposition(agent.PS_BC_AI_RPT_LOG_DF)
+            agent.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 4: Vendor Update related email identified - Success"
+            agent.PS_BC_AI_RPT_LOG.BC_REMARKS = "Email identified as Vendor Update related"
+            updateEmailDisposition(agent.PS_BC_AI_RPT_LOG)
 
             draft_message = CDR_VendorUpdate_prompt
             createReplyMessage(agent.workingEmail.id, draft_message)
 
             moveMessage(agent.workingEmail.id, "Return to Business Vendor")
-            agent.PS_BC_AI_RPT_LOG_DF.at[0, "ERROR_MSG_TXT"] = "Step 4: Email moved to Return to Business Vendor folder due to Vendor Update related email - Success"
-            agent.PS_BC_AI_RPT_LOG_DF.at[0, "BC_REMARKS"] = "Return to Business Vendor folder"
-            updateEmailDisposition(agent.PS_BC_AI_RPT_LOG_DF)
+            agent.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 4: Email moved to Return to Business Vendor folder due to Vendor Update related email - Success"
+            agent.PS_BC_AI_RPT_LOG.BC_REMARKS = "Return to Business Vendor folder"
+            updateEmailDisposition(agent.PS_BC_AI_RPT_LOG)
 
             splunkit(f" {agent.workingEmail} - Vendor Update Related - Move the message to Return to Business Vendor folder - Passed", "info")
             return True
 
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "ERROR_MSG_TXT"] = "Step 4: Non invoice related email identified - Success"
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "BC_REMARKS"] = "Email identified as non invoice related"
-        updateEmailDisposition(agent.PS_BC_AI_RPT_LOG_DF)
+        agent.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 4: Non invoice related email identified - Success"
+        agent.PS_BC_AI_RPT_LOG.BC_REMARKS = "Email identified as non invoice related"
+        updateEmailDisposition(agent.PS_BC_AI_RPT_LOG)
 
         moveMessage(agent.workingEmail.id, "Non-Invoice Related")
         agent.logger.info(f" {agent.workingEmail} - Non-Invoice Related - Move the message to Non-Invoice Related folder - Passed")
         splunkit(f" {agent.workingEmail} - Non-Invoice Related - Move the message to Non-Invoice Related folder - Passed", "info")
 
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "ERROR_MSG_TXT"] = "Step 4: Email moved to Non-Invoice Related folder - Success"
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "BC_REMARKS"] = "Email moved to Non-Invoice Related folder"
-        updateEmailDisposition(agent.PS_BC_AI_RPT_LOG_DF)
+        agent.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 4: Email moved to Non-Invoice Related folder - Success"
+        agent.PS_BC_AI_RPT_LOG.BC_REMARKS = "Email moved to Non-Invoice Related folder"
+        updateEmailDisposition(agent.PS_BC_AI_RPT_LOG)
         return True
 
     if "Classification: New Invoice" in step4response or '"Ans": "Yes"' in step4response:
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "ERROR_MSG_TXT"] = "Step 4: Invoice related email identified - Success"
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "BC_REMARKS"] = "Sending to get and process attachments"
-        updateEmailDisposition(agent.PS_BC_AI_RPT_LOG_DF)
+        agent.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 4: Invoice related email identified - Success"
+        agent.PS_BC_AI_RPT_LOG.BC_REMARKS = "Sending to get and process attachments"
+        updateEmailDisposition(agent.PS_BC_AI_RPT_LOG)
 
         # Ask Emily to get the attachments and process it
         message = get_and_process_attachments_prompt
@@ -1384,9 +2141,9 @@ def HelloEmily(agent: Agent):
             agent.logger.info(f" {agent.workingEmail} - Attachment validation passed - Move the message to Processed by AI Emily folder ")
             splunkit(f" {agent.workingEmail} - Attachment validation passed - Move the message to Processed by AI Emily folder ", "info")
 
-            agent.PS_BC_AI_RPT_LOG_DF.at[0, "ERROR_MSG_TXT"] = "Step 6: Email processed, attachment extracted, voucher created - Success"
-            agent.PS_BC_AI_RPT_LOG_DF.at[0, "BC_REMARKS"] = "Email moved to Processed by AI Emily folder"
-            updateEmailDisposition(agent.PS_BC_AI_RPT_LOG_DF)
+            agent.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 6: Email processed, attachment extracted, voucher created - Success"
+            agent.PS_BC_AI_RPT_LOG.BC_REMARKS = "Email moved to Processed by AI Emily folder"
+            updateEmailDisposition(agent.PS_BC_AI_RPT_LOG)
             return True
 
         if step5response in (False, "max_new_token_error", "Error"):
@@ -1395,18 +2152,18 @@ def HelloEmily(agent: Agent):
                 agent.RTB_reason = "Unreadable Attachment"
                 createReplyMessage(agent.workingEmail.id, draft_message)
 
-                agent.PS_BC_AI_RPT_LOG_DF.at[0, "ERROR_MSG_TXT"] = "Step 7: Create a draft response - Success"
-                agent.PS_BC_AI_RPT_LOG_DF.at[0, "BC_REMARKS"] = "Draft email for unreadable attachment created"
-                updateEmailDisposition(agent.PS_BC_AI_RPT_LOG_DF)
+                agent.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 7: Create a draft response - Success"
+                agent.PS_BC_AI_RPT_LOG.BC_REMARKS = "Draft email for unreadable attachment created"
+                updateEmailDisposition(agent.PS_BC_AI_RPT_LOG)
                 splunkit(f" {agent.workingEmail} - Step 7: Create a draft response - Success", "info")
 
             moveMessage(agent.workingEmail.id, "Return to Business Vendor")
             agent.logger.info(f" {agent.workingEmail} - Attachment validation failed - Move the message to Return to Business Vendor folder ")
             splunkit(f" {agent.workingEmail} - Attachment validation failed - Move the message to Return to Business Vendor folder ", "info")
 
-            agent.PS_BC_AI_RPT_LOG_DF.at[0, "ERROR_MSG_TXT"] = f"Step 6: Invoice validation failed due to reason: {agent.RTB_reason} - Returned to business"
-            agent.PS_BC_AI_RPT_LOG_DF.at[0, "BC_REMARKS"] = "Return to Business Vendor folder"
-            updateEmailDisposition(agent.PS_BC_AI_RPT_LOG_DF)
+            agent.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = f"Step 6: Invoice validation failed due to reason: {agent.RTB_reason} - Returned to business"
+            agent.PS_BC_AI_RPT_LOG.BC_REMARKS = "Return to Business Vendor folder"
+            updateEmailDisposition(agent.PS_BC_AI_RPT_LOG)
             return True
 
         draft_message = CDR_UnreadableAttachment_prompt
@@ -1416,14 +2173,432 @@ def HelloEmily(agent: Agent):
         agent.logger.info(f" {agent.workingEmail} -Step 5 - Move the message to Return to Business Vendor folder due to unreadable attachment")
         splunkit(f" {agent.workingEmail} -Step 5 - Move the message to Return to Business Vendor folder due to unreadable attachment", "info")
 
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "ERROR_MSG_TXT"] = "Step 5: Email moved to Return to Business Vendor folder due to unreadable attachment - Success"
-        agent.PS_BC_AI_RPT_LOG_DF.at[0, "BC_REMARKS"] = "Return to Business Vendor folder"
-        updateEmailDisposition(agent.PS_BC_AI_RPT_LOG_DF)
+        agent.PS_BC_AI_RPT_LOG.ERROR_MSG_TXT = "Step 5: Email moved to Return to Business Vendor folder due to unreadable attachment - Success"
+        agent.PS_BC_AI_RPT_LOG.BC_REMARKS = "Return to Business Vendor folder"
+        updateEmailDisposition(agent.PS_BC_AI_RPT_LOG)
         return True
 
     return True
 
 
+class MessageLeases:
+    """Claim/lease registry so two workers never process the same message id. With a lease_dir the claims are
+    lock files created with O_EXCL, which also keeps separate agent processes on the same host apart. Leases older
+    than ttl_seconds are treated as abandoned (crashed worker) and can be claimed again."""
+
+    def __init__(self, lease_dir=None, ttl_seconds=900):
+        self.lease_dir = lease_dir
+        self.ttl_seconds = ttl_seconds
+        self._held = {}
+        self._lock = threading.Lock()
+        if lease_dir:
+            os.makedirs(lease_dir, exist_ok=True)
+
+    def _leasePath(self, msg_id):
+        return os.path.join(self.lease_dir, hashlib.sha1(msg_id.encode("utf-8")).hexdigest() + ".lease")
+
+    def _claimFile(self, path):
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) <= self.ttl_seconds:
+                        return False
+                    os.remove(path)  # stale lease left behind by a dead worker
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(f"{os.getpid()} {datetime.now().isoformat()}")
+            return True
+        return False
+
+    def claim(self, msg_id):
+        with self._lock:
+            held_at = self._held.get(msg_id)
+            if held_at is not None and time.time() - held_at <= self.ttl_seconds:
+                return False
+            if self.lease_dir and not self._claimFile(self._leasePath(msg_id)):
+                return False
+            self._held[msg_id] = time.time()
+            return True
+
+    def release(self, msg_id):
+        with self._lock:
+            self._held.pop(msg_id, None)
+            if self.lease_dir:
+                try:
+                    os.remove(self._leasePath(msg_id))
+                except FileNotFoundError:
+                    pass
+
+
+class InboxWatcher(ABC):
+    """Source of new Inbox messages for the InboxWorkerPool. poll() returns getMessageList-shaped message dicts (None
+    on error) and maintains delay: reset to min_interval when a message id shows up that was not in the previous
+    poll, multiplied by backoff on every idle poll up to max_interval."""
+
+    snapshot = False  # True when every poll returns every message still to be processed rather than only changes
+
+    def __init__(self, folder="Inbox", min_interval=1.0, max_interval=30.0, backoff=2.0):
+        self.folder = folder
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.delay = min_interval
+        self.stats = {"polls": 0, "idle_polls": 0, "errors": 0, "messages": 0}
+        self._lastIds = set()
+
+    @abstractmethod
+    def fetch(self, limit):
+        """getMessageList-shaped message dicts, at most limit of them; None on error"""
+
+    def done(self, msg_id, ok):
+        """called once the pool has processed (ok) or failed to process a message this watcher returned"""
+
+    def poll(self, limit):
+        self.stats["polls"] += 1
+        try:
+            messages = self.fetch(limit)
+        except Exception as e:
+            splunkit(f"{type(self).__name__}: fetch failed: {e}", "error")
+            messages = None
+        if messages is None:
+            self.stats["errors"] += 1
+            self.delay = min(self.delay * self.backoff, self.max_interval)
+            return None
+
+        ids = {m.get("id") for m in messages}
+        if ids - self._lastIds:
+            self.delay = self.min_interval
+        else:
+            self.stats["idle_polls"] += 1
+            self.delay = min(self.delay * self.backoff, self.max_interval)
+        self._lastIds = ids
+        self.stats["messages"] += len(messages)
+        return messages
+
+
+class ListInboxWatcher(InboxWatcher):
+    """Lists the first messages of the folder on every poll, as getMessageList always did."""
+
+    snapshot = True
+
+    def fetch(self, limit):
+        result = getMessageList(limit, self.folder)
+        if result is None:
+            return None
+        return result.get("value", [])
+
+
+class DeltaInboxWatcher(InboxWatcher):
+    """Change-feed mode: follows the mailbox delta query and returns the messages added since the stored delta
+    link. The first poll returns the current folder contents. fetchDelta(folder, link) must return one delta page
+    ({"value": [...], "@odata.nextLink" | "@odata.deltaLink": ...}); link is None for the initial sync.
+
+    The delta feed never returns a message twice, so the state file only moves past a delta round once every
+    message of that round has been handed to done(). Messages that were fetched but not processed successfully
+    are kept in the state file and returned again on every poll (and after a restart) until they succeed or the
+    feed reports them removed."""
+
+    snapshot = True
+
+    def __init__(self, fetchDelta=None, state_path=None, **kwargs):
+        super().__init__(**kwargs)
+        self.fetchDelta = fetchDelta or exchangeMailbox.listEmailsDelta
+        self.state_path = state_path
+        self.deltaLink = None  # where the next fetch continues
+        self.savedLink = None  # stored link: every message before it has been processed
+        self._pending = OrderedDict()  # message id -> message, not processed successfully yet
+        self._rounds = []  # [deltaLink, ids not handed to done() yet] per delta round after savedLink
+        self._lock = threading.Lock()
+        self._loadState()
+
+    def _loadState(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            raw = f.read().strip()
+        try:
+            # older state files hold just the delta link
+            state = json.loads(raw) if raw.startswith("{") else {"deltaLink": raw}
+        except ValueError as e:
+            splunkit(f"DeltaInboxWatcher: unreadable state file {self.state_path}: {e}; starting a new sync", "error")
+            return
+        self.deltaLink = self.savedLink = state.get("deltaLink") or None
+        for message in state.get("pending") or []:
+            if message.get("id"):
+                self._pending[message["id"]] = message
+
+    def _saveState(self):
+        """caller holds _lock"""
+        if not self.state_path:
+            return
+        tmp = self.state_path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"deltaLink": self.savedLink, "pending": list(self._pending.values())}, f)
+            os.replace(tmp, self.state_path)
+        except (OSError, TypeError, ValueError) as e:
+            splunkit(f"DeltaInboxWatcher: saving {self.state_path} failed: {e}", "error")
+
+    def _advance(self):
+        """caller holds _lock"""
+        while self._rounds and not self._rounds[0][1]:
+            self.savedLink = self._rounds.pop(0)[0]
+        self._saveState()
+
+    def fetch(self, limit):
+        changes = []
+        page = self.fetchDelta(self.folder, self.deltaLink)
+        while page is not None:
+            changes.extend(page.get("value", []))
+            nextLink = page.get("@odata.nextLink")
+            if not nextLink:
+                break
+            page = self.fetchDelta(self.folder, nextLink)
+        if page is None:
+            return None
+
+        with self._lock:
+            added = set()
+            for m in changes:
+                msg_id = m.get("id")
+                if not msg_id:
+                    continue
+                if "@removed" in m:
+                    # moved or deleted elsewhere: nothing left to process
+                    self._pending.pop(msg_id, None)
+                    added.discard(msg_id)
+                    for _, waiting in self._rounds:
+                        waiting.discard(msg_id)
+                else:
+                    self._pending[msg_id] = m
+                    added.add(msg_id)
+            self.deltaLink = page.get("@odata.deltaLink", self.deltaLink)
+            self._rounds.append([self.deltaLink, added])
+            self._advance()
+            return list(self._pending.values())
+
+    def done(self, msg_id, ok):
+        with self._lock:
+            for _, waiting in self._rounds:
+                waiting.discard(msg_id)
+            if ok:
+                self._pending.pop(msg_id, None)
+            self._advance()
+
+
+# message id -> .eml file for messages handed out by EmlDirectoryWatcher; getMIMEMessage and
+# getEmailAttachments serve those from the file instead of the mailbox
+emlMessagePaths = {}
+
+
+class EmlMimeMessage:
+    """a local .eml file in the shape of the mailbox's MIME response (content bytes and text)"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.content = f.read()
+        self.text = self.content.decode("utf-8", errors="replace")
+
+
+def emlAttachments(path):
+    """the attachments of a local .eml file as getEmailAttachments-shaped fileAttachment dicts"""
+    with open(path, "rb") as f:
+        msg = email.message_from_binary_file(f, policy=email.policy.default)
+    modified = datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc).isoformat()
+    attachments = []
+    for n, part in enumerate(msg.iter_attachments()):
+        payload = part.get_payload(decode=True) or b""
+        attachments.append(
+            {
+                "@odata.type": "#microsoft.graph.fileAttachment",
+                "id": f"{os.path.basename(path)}#{n}",
+                "lastModifiedDateTime": modified,
+                "name": part.get_filename() or f"attachment{n}",
+                "contentType": part.get_content_type(),
+                "size": len(payload),
+                "isInline": part.get_content_disposition() == "inline",
+                "contentId": (part["content-id"] or "").strip("<>") or None,
+                "contentLocation": part["content-location"],
+                "contentBytes": base64.b64encode(payload).decode("ascii"),
+            }
+        )
+    return attachments
+
+
+class EmlDirectoryWatcher(InboxWatcher):
+    """Local stand-in for the mailbox: every new .eml file in directory is returned once as a message dict. The
+    MIME message and attachments of those messages are read from the file (emlMessagePaths)."""
+
+    def __init__(self, directory, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        self._seen = set()
+
+    @staticmethod
+    def _addresses(values):
+        return [{"emailAddress": {"name": n, "address": a}} for n, a in getaddresses(values)]
+
+    def _toMessage(self, path):
+        with open(path, "rb") as f:
+            msg = email.message_from_binary_file(f, policy=email.policy.default)
+        try:
+            received = parsedate_to_datetime(msg["date"])
+        except (TypeError, ValueError):
+            received = datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+        body = msg.get_body(preferencelist=("plain", "html"))
+        content = body.get_content() if body is not None else ""
+        sender = self._addresses(msg.get_all("from", []))
+        emlMessagePaths[os.path.basename(path)] = path
+        return {
+            "id": os.path.basename(path),
+            "subject": msg["subject"] or "",
+            "receivedDateTime": received.isoformat(),
+            "hasAttachments": any(True for _ in msg.iter_attachments()),
+            "internetMessageId": msg["message-id"],
+            "bodyPreview": content[:255],
+            "body": {"contentType": "html" if body is not None and body.get_content_subtype() == "html" else "text", "content": content},
+            "sender": sender[0] if sender else None,
+            "from": sender[0] if sender else None,
+            "toRecipients": self._addresses(msg.get_all("to", [])),
+            "ccRecipients": self._addresses(msg.get_all("cc", [])),
+        }
+
+    def fetch(self, limit):
+        paths = sorted(glob.glob(os.path.join(self.directory, "*.eml")), key=os.path.getmtime)
+        messages = []
+        for path in paths:
+            if len(messages) >= limit:
+                break
+            if path in self._seen:
+                continue
+            self._seen.add(path)
+            messages.append(self._toMessage(path))
+        return messages
+
+
+def makeInboxWatcher(mode=None, folder="Inbox"):
+    """list (default), delta or eml, chosen by EMILY_INBOX_MODE"""
+    mode = (mode or os.getenv("EMILY_INBOX_MODE", "list")).lower()
+    kwargs = {
+        "folder": folder,
+        "min_interval": float(os.getenv("EMILY_POLL_MIN_SECONDS", "1")),
+        "max_interval": float(os.getenv("EMILY_POLL_MAX_SECONDS", "30")),
+    }
+    if mode == "eml":
+        return EmlDirectoryWatcher(os.getenv("EMILY_EML_DIR", "."), **kwargs)
+    if mode == "delta":
+        if hasattr(exchangeMailbox, "listEmailsDelta"):
+            return DeltaInboxWatcher(state_path=os.getenv("EMILY_DELTA_STATE") or None, **kwargs)
+        splunkit("EMILY_INBOX_MODE=delta but the mailbox interface has no listEmailsDelta; using list mode", "error")
+    return ListInboxWatcher(**kwargs)
+
+
+class InboxWorkerPool:
+    """Fetches a batch of Inbox message ids and processes them concurrently. Every worker thread owns its own Agent
+    (working email, disposition record and llm history are per worker), and every message is claimed through
+    MessageLeases before it is handed to a worker."""
+
+    def __init__(self, system_prompt, workers=4, batch_size=None, leases=None, folder="Inbox", watcher=None, recent_ttl=300):
+        self.system_prompt = system_prompt
+        self.workers = workers
+        self.batch_size = batch_size or workers * 2
+        self.folder = folder
+        self.leases = leases or MessageLeases()
+        self.watcher = watcher or ListInboxWatcher(folder=folder)
+        self._backlog = OrderedDict()  # messages seen by the watcher but not yet dispatched
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="emily")
+        self._inflight = {}
+        # ids finished within recent_ttl seconds: a list poll taken just before a message was moved out of the
+        # folder still returns it, and it must not be claimed a second time
+        self._recentlyDone = OrderedDict()
+        self.recent_ttl = recent_ttl
+        self._inflight_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _agent(self):
+        agent = getattr(self._local, "agent", None)
+        if agent is None:
+            agent = Agent(self.system_prompt)
+            self._local.agent = agent
+        return agent
+
+    def processMessage(self, message):
+        msg_id = message.get("id")
+        result = False
+        try:
+            agent = self._agent()
+            agent.workingEmail = CurrentWorkingEmail()
+            agent.RTB_reason = ""
+            result = HelloEmily(agent, {"value": [message]})
+            return result
+        except Exception as e:
+            splunkit(f"InboxWorkerPool: error processing {msg_id}: {e}", "error")
+            return False
+        finally:
+            workingEmail = getattr(getattr(self._local, "agent", None), "workingEmail", None)
+            if workingEmail is not None:
+                workingEmail.releaseAttachments()
+            with self._inflight_lock:
+                self._recentlyDone[msg_id] = time.monotonic()
+                self._recentlyDone.move_to_end(msg_id)
+                self._inflight.pop(msg_id, None)
+            self.watcher.done(msg_id, result is not False)
+            self.leases.release(msg_id)
+
+    def _isBusyOrDone(self, msg_id):
+        """caller holds _inflight_lock"""
+        cutoff = time.monotonic() - self.recent_ttl
+        while self._recentlyDone and next(iter(self._recentlyDone.values())) < cutoff:
+            self._recentlyDone.popitem(last=False)
+        return msg_id in self._inflight or msg_id in self._recentlyDone
+
+    def pollOnce(self):
+        """Claim and dispatch as many new messages as there are idle workers. Returns the number dispatched."""
+        with self._inflight_lock:
+            capacity = self.workers - len(self._inflight)
+        if capacity <= 0:
+            return 0
+
+        if len(self._backlog) < capacity:
+            messages = self.watcher.poll(self.batch_size)
+            if messages is None:
+                splunkit("Error calling getMessageList.    ", "error")
+            else:
+                if self.watcher.snapshot:
+                    self._backlog.clear()
+                with self._inflight_lock:
+                    for message in messages:
+                        msg_id = message.get("id")
+                        if msg_id and not self._isBusyOrDone(msg_id):
+                            self._backlog[msg_id] = message
+
+        dispatched = 0
+        while self._backlog and dispatched < capacity:
+            msg_id, message = self._backlog.popitem(last=False)
+            with self._inflight_lock:
+                if self._isBusyOrDone(msg_id):
+                    continue
+            if not self.leases.claim(msg_id):
+                # held by another worker process; a change-feed watcher keeps it pending and offers it again
+                self.watcher.done(msg_id, False)
+                continue
+            with self._inflight_lock:
+                self._inflight[msg_id] = self._executor.submit(self.processMessage, message)
+            dispatched += 1
+        return dispatched
+
+    def nextDelay(self):
+        """seconds the caller should wait before the next pollOnce"""
+        return self.watcher.min_interval if self._backlog else self.watcher.delay
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
 if __name__ == "__main__":
     agent = Agent(system_prompt)  # initialize and instantiate the Agent object
 
@@ -1440,7 +2615,14 @@ if __name__ == "__main__":
         print(output)
         agent_response = "Your ask:(Type 'bye' to exit) "
 
-    schedule.every(10).seconds.do(lambda: HelloEmily(agent))
+    workerPool = InboxWorkerPool(
+        system_prompt,
+        workers=int(os.getenv("EMILY_WORKERS", "4")),
+        batch_size=int(os.getenv("EMILY_BATCH_SIZE", "0")) or None,
+        leases=MessageLeases(os.getenv("EMILY_LEASE_DIR") or None),
+        watcher=makeInboxWatcher(),
+    )
+
     while True:
         start_time = datetime.now()
         sys.stdout.write("\033[92m")
@@ -1453,9 +2635,8 @@ if __name__ == "__main__":
             "info",
         )
 
-        HelloEmily(agent)
+        workerPool.pollOnce()
 
-        schedule.run_pending()
         end_time = datetime.now()
 
         sys.stdout.write("\033[92m")
@@ -1468,4 +2649,4 @@ if __name__ == "__main__":
             "info",
         )
         splunkit(f"\ntotal time: {end_time - start_time}", "info")
-        time.sleep(1)
+        time.sleep(workerPool.nextDelay())
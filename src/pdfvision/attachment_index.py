@@ -0,0 +1,84 @@
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from .instrumentation import incr
+from .pdf_vision import DEDUP_POLICY, DedupPolicy, PageFingerprint
+
+
+class AttachmentIndex:
+    # Page fingerprints of recently processed attachments -> whatever the caller stored for them
+    # (an extraction result, or just a name). With a path the index survives restarts.
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        *,
+        ttl_seconds: float = 3 * 24 * 3600,
+        max_entries: int = 2000,
+        policy: DedupPolicy = DEDUP_POLICY,
+    ) -> None:
+        if path and not policy.confirm_content:
+            # hash-only matching would return a stored result for another invoice of the same layout
+            raise ValueError("a persistent attachment index needs a DedupPolicy with confirm_content=True")
+        self.path = Path(path) if path else None
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._entries: List[Dict[str, Any]] = self._load()
+
+    def _load(self) -> List[Dict[str, Any]]:
+        if self.path is None or not self.path.exists():
+            return []
+        try:
+            entries = json.loads(self.path.read_text(encoding="utf-8")).get("entries") or []
+        except Exception:
+            return []
+        return self._prune(entries)
+
+    def _prune(self, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        cutoff = time.time() - self.ttl_seconds
+        return [e for e in entries if e.get("ts", 0) >= cutoff][-self.max_entries :]
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps({"entries": self._entries}, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self.path)
+
+    def _same_attachment(self, fingerprints: Sequence[PageFingerprint], entry: Dict[str, Any]) -> bool:
+        pages = entry.get("pages") or []
+        if len(pages) != len(fingerprints):
+            return False
+        return all(fp.matches(PageFingerprint.from_json(p), self.policy) for fp, p in zip(fingerprints, pages))
+
+    def lookup(self, fingerprints: Sequence[Optional[PageFingerprint]]) -> Optional[Dict[str, Any]]:
+        if not fingerprints or any(fp is None for fp in fingerprints):
+            return None
+        with self._lock:
+            self._entries = self._prune(self._entries)
+            for entry in reversed(self._entries):
+                if self._same_attachment(fingerprints, entry):
+                    incr("attachment_index_hits")
+                    return entry.get("payload") or {}
+        incr("attachment_index_misses")
+        return None
+
+    def add(self, fingerprints: Sequence[Optional[PageFingerprint]], payload: Dict[str, Any]) -> None:
+        if not fingerprints or any(fp is None for fp in fingerprints):
+            return
+        entry = {"ts": time.time(), "pages": [fp.to_json() for fp in fingerprints], "payload": payload}
+        with self._lock:
+            self._entries = self._prune(self._entries + [entry])
+            try:
+                self._save()
+            except OSError:
+                pass
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,219 @@
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Protocol, Sequence, Tuple
+
+
+@dataclass
+class MetricEvent:
+    kind: str  # "span" or "counter"
+    name: str
+    value: float
+    labels: Dict[str, str] = field(default_factory=dict)
+    ts: float = field(default_factory=time.time)
+
+
+class MetricSink(Protocol):
+    def emit(self, event: MetricEvent) -> None: ...
+
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _label_key(event: MetricEvent) -> LabelKey:
+    return event.name, tuple(sorted(event.labels.items()))
+
+
+def _format_key(key: LabelKey) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+
+class InMemorySink:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._spans: Dict[LabelKey, List[float]] = {}  # [count, total, max]
+        self._counters: Dict[LabelKey, float] = {}
+
+    def emit(self, event: MetricEvent) -> None:
+        key = _label_key(event)
+        with self._lock:
+            if event.kind == "span":
+                agg = self._spans.setdefault(key, [0, 0.0, 0.0])
+                agg[0] += 1
+                agg[1] += event.value
+                agg[2] = max(agg[2], event.value)
+            else:
+                self._counters[key] = self._counters.get(key, 0) + event.value
+
+    def span_totals(self) -> Dict[str, float]:
+        out: Dict[str, float] = {}
+        with self._lock:
+            for (name, _), (_, total, _) in self._spans.items():
+                out[name] = out.get(name, 0.0) + total
+        return out
+
+    def counter_by_label(self, name: str, label: str) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        with self._lock:
+            for (cname, labels), value in self._counters.items():
+                if cname != name:
+                    continue
+                lv = dict(labels).get(label, "")
+                out[lv] = out.get(lv, 0) + int(value)
+        return out
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = {
+                _format_key(k): {"count": int(c), "total_seconds": round(t, 4), "max_seconds": round(m, 4)}
+                for k, (c, t, m) in sorted(self._spans.items())
+            }
+            counters = {_format_key(k): v for k, v in sorted(self._counters.items())}
+        return {"spans": spans, "counters": counters}
+
+
+class JsonlFileSink:
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._fh = self.path.open("a", encoding="utf-8")
+
+    def emit(self, event: MetricEvent) -> None:
+        line = json.dumps(asdict(event), ensure_ascii=False)
+        with self._lock:
+            self._fh.write(line + "\n")
+            self._fh.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._fh.close()
+
+
+class PrometheusTextExporter:
+    def __init__(self, namespace: str = "pdfvision") -> None:
+        self.namespace = namespace
+        self._memory = InMemorySink()
+
+    def emit(self, event: MetricEvent) -> None:
+        self._memory.emit(event)
+
+    @staticmethod
+    def _labels(labels: Sequence[Tuple[str, str]], extra: Optional[Tuple[str, str]] = None) -> str:
+        items = list(labels) + ([extra] if extra else [])
+        if not items:
+            return ""
+        escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items]
+        return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+    def render(self) -> str:
+        ns = self.namespace
+        lines: List[str] = []
+        with self._memory._lock:
+            spans = sorted(self._memory._spans.items())
+            counters = sorted(self._memory._counters.items())
+
+        if spans:
+            lines.append(f"# HELP {ns}_span_seconds Time spent in each pipeline stage.")
+            lines.append(f"# TYPE {ns}_span_seconds summary")
+            for (name, labels), (count, total, _) in spans:
+                lbl = self._labels(labels, ("span", name))
+                lines.append(f"{ns}_span_seconds_sum{lbl} {total:.6f}")
+                lines.append(f"{ns}_span_seconds_count{lbl} {int(count)}")
+
+        seen = set()
+        for (name, labels), value in counters:
+            metric = f"{ns}_{name}_total"
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} counter")
+                seen.add(metric)
+            lines.append(f"{metric}{self._labels(labels)} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path) -> None:
+        path = Path(path)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(self.render(), encoding="utf-8")
+        tmp.replace(path)
+
+
+class Instrumentation:
+    def __init__(self, sinks: Sequence[MetricSink] = (), *, parent: Optional["Instrumentation"] = None) -> None:
+        self.sinks: List[MetricSink] = list(sinks)
+        self.parent = parent
+        self.memory = InMemorySink()
+
+    def emit(self, event: MetricEvent) -> None:
+        self.memory.emit(event)
+        for sink in self.sinks:
+            try:
+                sink.emit(event)
+            except Exception:
+                pass
+        if self.parent is not None:
+            self.parent.emit(event)
+
+    @contextmanager
+    def span(self, name: str, **labels: Any) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.emit(MetricEvent("span", name, time.perf_counter() - t0, {k: str(v) for k, v in labels.items()}))
+
+    def incr(self, name: str, value: float = 1, **labels: Any) -> None:
+        self.emit(MetricEvent("counter", name, value, {k: str(v) for k, v in labels.items()}))
+
+    @contextmanager
+    def activate(self) -> Iterator["Instrumentation"]:
+        token = _CURRENT.set(self)
+        try:
+            yield self
+        finally:
+            _CURRENT.reset(token)
+
+    def summary(self) -> Dict[str, Any]:
+        return self.memory.summary()
+
+
+_CURRENT: contextvars.ContextVar[Optional[Instrumentation]] = contextvars.ContextVar(
+    "pdfvision_instrumentation", default=None
+)
+
+
+def current_instrumentation() -> Optional[Instrumentation]:
+    return _CURRENT.get()
+
+
+@contextmanager
+def span(name: str, **labels: Any) -> Iterator[None]:
+    instr = _CURRENT.get()
+    if instr is None:
+        yield
+        return
+    with instr.span(name, **labels):
+        yield
+
+
+def incr(name: str, value: float = 1, **labels: Any) -> None:
+    instr = _CURRENT.get()
+    if instr is not None:
+        instr.incr(name, value, **labels)
+
+
+def run_in_current_context(fn: Callable[..., Any]) -> Callable[..., Any]:
+    # Thread pools do not inherit contextvars; capture the caller's context per task.
+    ctx = contextvars.copy_context()
+
+    def runner(*args: Any, **kwargs: Any) -> Any:
+        return ctx.copy().run(fn, *args, **kwargs)
+
+    return runner
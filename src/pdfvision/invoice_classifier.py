@@ -0,0 +1,235 @@
+import argparse
+import hashlib
+import json
+import math
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .pdf_vision import score_invoice_page_text
+
+FEATURE_NAMES = [
+    "invoice",
+    "invoice_label",
+    "amount_due",
+    "total",
+    "po_label",
+    "po_number",
+    "non_invoice",
+    "money_column_rows",
+    "words",
+]
+
+# Hand-set prior used until weights are trained from logged dispositions. It is only trusted on the
+# invoice side: "Bill", "Statement", "Rechnung" and the like carry none of these keywords, so an
+# untrained classifier never rejects locally (see non_invoice_threshold). Length is left to training.
+# A statement of account lists many invoice numbers and can score high here, which is why any
+# non_invoice hit vetoes a local accept (see InvoiceClassifier.decide).
+DEFAULT_WEIGHTS: Dict[str, float] = {
+    "bias": -3.0,
+    "invoice": 1.2,
+    "invoice_label": 1.5,
+    "amount_due": 1.2,
+    "total": 0.6,
+    "po_label": 0.8,
+    "po_number": 0.8,
+    "non_invoice": -1.2,
+    "money_column_rows": 0.5,
+}
+
+
+@dataclass
+class ClassifierDecision:
+    is_invoice: Optional[bool]  # None = ambiguous, escalate to the LLM
+    probability: float
+    features: Dict[str, float]
+
+
+def invoice_features(text: str) -> Dict[str, float]:
+    _, signals = score_invoice_page_text(text or "")
+    return {name: math.log1p(max(signals.get(name, 0), 0)) for name in FEATURE_NAMES}
+
+
+def _sigmoid(z: float) -> float:
+    if z < -60:
+        return 0.0
+    if z > 60:
+        return 1.0
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+class InvoiceClassifier:
+    def __init__(
+        self,
+        weights: Optional[Dict[str, float]] = None,
+        *,
+        invoice_threshold: float = 0.85,
+        # None: never decide "not an invoice" locally; set by training (train_from_jsonl / the CLI)
+        non_invoice_threshold: Optional[float] = None,
+    ) -> None:
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.invoice_threshold = invoice_threshold
+        self.non_invoice_threshold = non_invoice_threshold
+
+    def probability(self, features: Dict[str, float]) -> float:
+        z = self.weights.get("bias", 0.0) + sum(self.weights.get(k, 0.0) * v for k, v in features.items())
+        return _sigmoid(z)
+
+    def decide(self, features: Dict[str, float]) -> Tuple[Optional[bool], float]:
+        p = self.probability(features)
+        # statements, packing lists and the like share invoice keywords; with a non-invoice marker on the
+        # page only the LLM may call it an invoice
+        if p >= self.invoice_threshold and not features.get("non_invoice"):
+            return True, p
+        if self.non_invoice_threshold is not None and p <= self.non_invoice_threshold:
+            return False, p
+        return None, p
+
+    def classify(self, text: str) -> ClassifierDecision:
+        features = invoice_features(text)
+        label, p = self.decide(features)
+        return ClassifierDecision(label, round(p, 4), features)
+
+    def fit(
+        self,
+        examples: Sequence[Tuple[Dict[str, float], bool]],
+        *,
+        epochs: int = 300,
+        learning_rate: float = 0.1,
+        l2: float = 0.01,
+    ) -> "InvoiceClassifier":
+        # Plain batch gradient descent; a few hundred logged dispositions train in milliseconds.
+        if not examples:
+            return self
+        n = float(len(examples))
+        for _ in range(epochs):
+            grad = {k: 0.0 for k in ["bias", *FEATURE_NAMES]}
+            for features, label in examples:
+                err = self.probability(features) - (1.0 if label else 0.0)
+                grad["bias"] += err
+                for k in FEATURE_NAMES:
+                    grad[k] += err * features.get(k, 0.0)
+            for k, g in grad.items():
+                reg = 0.0 if k == "bias" else l2 * self.weights.get(k, 0.0)
+                self.weights[k] = self.weights.get(k, 0.0) - learning_rate * (g / n + reg)
+        return self
+
+    def save(self, path: Path) -> None:
+        payload = {
+            "weights": self.weights,
+            "invoice_threshold": self.invoice_threshold,
+            "non_invoice_threshold": self.non_invoice_threshold,
+        }
+        Path(path).write_text(json.dumps(payload, indent=2), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path: Path) -> "InvoiceClassifier":
+        payload = json.loads(Path(path).read_text(encoding="utf-8"))
+        return cls(
+            payload.get("weights"),
+            invoice_threshold=payload.get("invoice_threshold", 0.85),
+            non_invoice_threshold=payload.get("non_invoice_threshold"),
+        )
+
+
+_log_lock = threading.Lock()
+
+
+# which label wins when one document was logged more than once: the final disposition outcome over the
+# LLM's answer over the local classifier's own decision
+SOURCE_PRIORITY = {"local": 0, "llm": 1, "disposition": 2}
+
+
+def log_classification_example(path: Path, text: str, is_invoice: bool, *, source: str = "llm") -> None:
+    # source: "local" (decided by the classifier), "llm" (escalated) or "disposition" (the email's outcome).
+    # Logging every decision, not only the escalated ones, keeps the training sample unbiased.
+    record = {
+        "features": invoice_features(text),
+        "label": bool(is_invoice),
+        "source": source,
+        "doc": hashlib.sha1((text or "").encode("utf-8")).hexdigest()[:16],
+    }
+    with _log_lock:
+        with Path(path).open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def load_classification_examples(path: Path) -> List[Tuple[Dict[str, float], bool]]:
+    # one example per logged document, labelled by its most trusted source (SOURCE_PRIORITY)
+    by_doc: Dict[Any, Dict[str, Any]] = {}
+    with Path(path).open("r", encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec: Dict[str, Any] = json.loads(line)
+            except Exception:
+                continue
+            key = rec.get("doc") or n
+            old = by_doc.get(key)
+            if old is None or SOURCE_PRIORITY.get(rec.get("source"), 1) >= SOURCE_PRIORITY.get(old.get("source"), 1):
+                by_doc[key] = rec
+    return [(rec.get("features") or {}, bool(rec.get("label"))) for rec in by_doc.values()]
+
+
+def train_from_jsonl(path: Path, **kwargs: Any) -> InvoiceClassifier:
+    return InvoiceClassifier(non_invoice_threshold=0.05).fit(load_classification_examples(path), **kwargs)
+
+
+def _windows(text: str, lines_per_window: int) -> Iterable[Tuple[int, str]]:
+    lines = (text or "").splitlines()
+    for i in range(0, len(lines), lines_per_window):
+        yield i, "\n".join(lines[i : i + lines_per_window])
+
+
+def select_relevant_excerpt(text: str, *, max_chars: int = 6000, lines_per_window: int = 8) -> str:
+    if len(text or "") <= max_chars:
+        return text or ""
+
+    scored = []
+    for start, chunk in _windows(text, lines_per_window):
+        if chunk.strip():
+            score, _ = score_invoice_page_text(chunk)
+            scored.append((score, start, chunk))
+
+    picked: List[Tuple[int, str]] = []
+    used = 0
+    for score, start, chunk in sorted(scored, key=lambda x: (-x[0], x[1])):
+        if used + len(chunk) + 1 > max_chars:
+            continue
+        picked.append((start, chunk))
+        used += len(chunk) + 1
+
+    return "\n".join(chunk for _, chunk in sorted(picked))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Train the local invoice classifier from logged classification examples.")
+    ap.add_argument("examples", type=Path, help="JSONL written by log_classification_example")
+    ap.add_argument("--out", type=Path, required=True, help="Where to write the trained weights JSON")
+    ap.add_argument("--epochs", type=int, default=300)
+    ap.add_argument("--invoice-threshold", type=float, default=0.85)
+    ap.add_argument("--non-invoice-threshold", type=float, default=0.05)
+    args = ap.parse_args()
+
+    examples = load_classification_examples(args.examples)
+    clf = InvoiceClassifier(
+        invoice_threshold=args.invoice_threshold,
+        non_invoice_threshold=args.non_invoice_threshold,
+    ).fit(examples, epochs=args.epochs)
+    clf.save(args.out)
+
+    decided = correct = 0
+    for features, label in examples:
+        decision, _ = clf.decide(features)
+        if decision is not None:
+            decided += 1
+            correct += int(decision == label)
+    print(f"[OK] trained on {len(examples)} examples -> {args.out}")
+    print(f"[OK] decided locally: {decided}/{len(examples)}; correct when decided: {correct}/{decided}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+import copy
+import json
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .instrumentation import Instrumentation, incr, span
+from .pdf_vision import (
+    LINE_ITEM_POLICY,
+    InvoiceExtraction,
+    LineItemPolicy,
+    PdfSource,
+    VisionCallable,
+    _MONEY_TOKEN_RE,
+    _instrumented_extraction,
+    _norm_money,
+    as_pdf_session,
+    extract_invoice_json_from_pdf_bytes_option_c,
+    extract_line_items,
+)
+
+# header fields a template can learn; invoice_description is free text and stays with the model
+TEMPLATE_FIELDS = ["invoice_date", "invoice_number", "gross_invoice_amount", "invoice_tax", "invoice_freight", "po_number"]
+# fields only the model fills; a layout whose verified documents had any of them is not read by coordinates
+MODEL_FIELDS = ("invoice_description", "po_line_number", "po_line_amount")
+REQUIRED_FIELDS = ("invoice_date", "invoice_number", "gross_invoice_amount")
+MONEY_FIELDS = {"gross_invoice_amount", "invoice_tax", "invoice_freight"}
+
+_DATE_RE = re.compile(
+    r"^(?:\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{4}-\d{2}-\d{2}|[A-Za-z]{3,9}\.?\s+\d{1,2},?\s+\d{4}|\d{1,2}[\s-][A-Za-z]{3,9}[\s-]\d{2,4})$"
+)
+_ID_RE = re.compile(r"^(?=.*\d)[A-Za-z0-9][A-Za-z0-9./-]{0,29}$")
+_ANCHOR_RE = re.compile(r"^[a-z]{3,}$")
+
+Word = Sequence[Any]  # PyMuPDF "words" tuple: (x0, y0, x1, y1, text, block_no, line_no, word_no)
+
+
+@dataclass(frozen=True)
+class TemplatePolicy:
+    # anchor positions (fraction of page size) within this distance count as the same spot
+    anchor_tolerance: float = 0.02
+    # share of a template's stable anchors that must be found on the page
+    match_score: float = 0.8
+    # a weaker match still counts as the same layout when learning
+    learn_score: float = 0.6
+    # templates with fewer stable anchors are too generic to trust
+    min_anchors: int = 8
+    # verified documents a template and each of its field rules need before they are used
+    min_support: int = 2
+    max_templates: int = 1000
+
+
+TEMPLATE_POLICY = TemplatePolicy()
+
+
+@dataclass
+class TemplateMatch:
+    template_id: str
+    score: float
+    header: Dict[str, str] = field(default_factory=dict)
+    evidence: Dict[str, Any] = field(default_factory=dict)
+    # every verified document of this layout had no line items
+    no_items: bool = False
+
+
+def _clean(token: Any) -> str:
+    return str(token).strip(" :#.,;()").lower()
+
+
+def _page_anchors(words: Sequence[Word], width: float, height: float) -> List[Tuple[str, float, float]]:
+    out = []
+    for w in words:
+        tok = _clean(w[4])
+        if _ANCHOR_RE.match(tok):
+            out.append((tok, round((float(w[0]) + float(w[2])) / 2 / width, 4), round((float(w[1]) + float(w[3])) / 2 / height, 4)))
+    return out
+
+
+def _matched_anchors(
+    template_anchors: Sequence[Sequence[Any]],
+    page_anchors: Sequence[Tuple[str, float, float]],
+    tolerance: float,
+) -> List[Sequence[Any]]:
+    by_token: Dict[str, List[Tuple[float, float]]] = {}
+    for tok, x, y in page_anchors:
+        by_token.setdefault(tok, []).append((x, y))
+    return [
+        a for a in template_anchors
+        if any(abs(x - a[1]) <= tolerance and abs(y - a[2]) <= tolerance for x, y in by_token.get(a[0], ()))
+    ]
+
+
+def _rows(words: Sequence[Word], tolerance: float = 3.0) -> List[List[Word]]:
+    ws = sorted(words, key=lambda w: ((float(w[1]) + float(w[3])) / 2, float(w[0])))
+    rows: List[List[Word]] = []
+    for w in ws:
+        yc = (float(w[1]) + float(w[3])) / 2
+        if rows and abs(yc - (float(rows[-1][0][1]) + float(rows[-1][0][3])) / 2) <= tolerance:
+            rows[-1].append(w)
+        else:
+            rows.append([w])
+    return [sorted(r, key=lambda w: float(w[0])) for r in rows]
+
+
+def _bbox(words: Sequence[Word]) -> Tuple[float, float, float, float]:
+    return (
+        min(float(w[0]) for w in words),
+        min(float(w[1]) for w in words),
+        max(float(w[2]) for w in words),
+        max(float(w[3]) for w in words),
+    )
+
+
+def _same_value(field_name: str, text: str, value: str) -> bool:
+    if field_name in MONEY_FIELDS:
+        return _norm_money(text.replace(" ", "")) == _norm_money(value)
+    return _clean(text) == _clean(value)
+
+
+def _valid_value(field_name: str, text: str) -> bool:
+    if field_name in MONEY_FIELDS:
+        return bool(_MONEY_TOKEN_RE.match(text.replace(" ", "")))
+    if field_name == "invoice_date":
+        return bool(_DATE_RE.match(text))
+    return bool(_ID_RE.match(text.strip(" :#")))
+
+
+def _locate_value(rows: Sequence[Sequence[Word]], field_name: str, value: str, evidence: str) -> Optional[Tuple[int, int, int]]:
+    # (row index, first word, last word) of the value; the occurrence whose row also holds the evidence wins
+    hits: List[Tuple[int, int, int, bool]] = []
+    ev = (evidence or "").lower()
+    for r, row in enumerate(rows):
+        row_text = " ".join(str(w[4]) for w in row).lower()
+        for i in range(len(row)):
+            for j in range(i, min(i + 4, len(row))):
+                if _same_value(field_name, " ".join(str(w[4]) for w in row[i : j + 1]), value):
+                    hits.append((r, i, j, bool(ev) and (ev in row_text or row_text in ev)))
+    if not hits:
+        return None
+    hits.sort(key=lambda h: not h[3])
+    return hits[0][:3]
+
+
+def _find_label(rows: Sequence[Sequence[Word]], r: int, i: int, j: int) -> Optional[List[Word]]:
+    # label = up to three words just left of the value on its row, else the words above it
+    row = rows[r]
+    left: List[Word] = []
+    for w in reversed(row[:i]):
+        if not re.search(r"[A-Za-z]", str(w[4])) or len(left) == 3:
+            break
+        left.insert(0, w)
+    if left:
+        return left
+    x0, x1 = float(row[i][0]), float(row[j][2])
+    for above in reversed(rows[max(r - 2, 0) : r]):
+        over = [w for w in above if float(w[2]) >= x0 - 4 and float(w[0]) <= x1 + 4 and re.search(r"[A-Za-z]", str(w[4]))]
+        if over:
+            return over[:3]
+    return None
+
+
+def _find_label_words(words: Sequence[Word], label: Sequence[str]) -> List[List[Word]]:
+    out = []
+    for row in _rows(words):
+        toks = [_clean(w[4]) for w in row]
+        for i in range(len(row) - len(label) + 1):
+            if toks[i : i + len(label)] == list(label):
+                out.append(row[i : i + len(label)])
+    return out
+
+
+class LayoutTemplateStore:
+    # Recurring vendor layouts, learned from verified extractions: a set of stable anchor words
+    # (where the labels sit on page one) plus, per header field, the label it follows and the box
+    # the value occupies relative to that label.
+
+    def __init__(self, path: Optional[Path] = None, *, policy: TemplatePolicy = TEMPLATE_POLICY) -> None:
+        self.path = Path(path) if path else None
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._templates: List[Dict[str, Any]] = self._load()
+
+    def _load(self) -> List[Dict[str, Any]]:
+        if self.path is None or not self.path.exists():
+            return []
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8")).get("templates") or []
+        except Exception:
+            return []
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps({"templates": self._templates}, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self.path)
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def _best(self, anchors: Sequence[Tuple[str, float, float]]) -> Tuple[Optional[Dict[str, Any]], float]:
+        tokens = {a[0] for a in anchors}
+        best, best_score = None, 0.0
+        for t in self._templates:
+            ta = t["anchors"]
+            if not ta or len({a[0] for a in ta} & tokens) < 0.5 * len({a[0] for a in ta}):
+                continue
+            score = len(_matched_anchors(ta, anchors, self.policy.anchor_tolerance)) / len(ta)
+            if score > best_score:
+                best, best_score = t, score
+        return best, best_score
+
+    def match(self, pdf: PdfSource) -> Optional[TemplateMatch]:
+        session = as_pdf_session(pdf)
+        if session.page_count < 1:
+            return None
+        with span("template_match"):
+            words = session.page_words(1)
+            width, height = session.page_size(1)
+            with self._lock:
+                tmpl, score = self._best(_page_anchors(words, width, height))
+                # learn() updates templates in place from other threads
+                tmpl = copy.deepcopy(tmpl)
+            p = self.policy
+            if tmpl is None or score < p.match_score or len(tmpl["anchors"]) < p.min_anchors or tmpl["documents"] < p.min_support:
+                incr("template_lookups", outcome="miss")
+                return None
+            # a template hit skips the model, which would leave these empty; templates learned before the
+            # counts were kept are treated the same until they learn again
+            filled = tmpl.get("model_fields")
+            if filled is None or any(filled.get(f) for f in MODEL_FIELDS):
+                incr("template_lookups", outcome="model_fields")
+                return None
+
+            result = TemplateMatch(
+                template_id=tmpl["id"],
+                score=round(score, 3),
+                no_items=tmpl.get("itemless_documents", 0) >= p.min_support and not tmpl.get("item_documents", 0),
+            )
+            for name, rule in tmpl["fields"].items():
+                if rule["support"] < p.min_support or rule["support"] <= rule["conflicts"]:
+                    continue
+                read = self._read_field(session, name, rule)
+                if read is None:
+                    # the layout normally carries this field; a miss means the page is not what we think
+                    incr("template_lookups", outcome="field_miss")
+                    return None
+                result.header[name], result.evidence[name] = read
+            if any(not result.header.get(f) for f in REQUIRED_FIELDS):
+                incr("template_lookups", outcome="incomplete")
+                return None
+        incr("template_lookups", outcome="hit")
+        return result
+
+    def _read_field(self, session: Any, name: str, rule: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, str]]]:
+        page_no = int(rule["page"])
+        if page_no > session.page_count:
+            return None
+        words = session.page_words(page_no)
+        width, height = session.page_size(page_no)
+        lx, ly = rule["label_xy"]
+        labels = [
+            lw for lw in _find_label_words(words, rule["label"])
+            if abs(_bbox(lw)[0] / width - lx) <= 5 * self.policy.anchor_tolerance
+            and abs(_bbox(lw)[1] / height - ly) <= 5 * self.policy.anchor_tolerance
+        ]
+        if not labels:
+            return None
+        label_words = min(labels, key=lambda lw: abs(_bbox(lw)[0] / width - lx) + abs(_bbox(lw)[1] / height - ly))
+        lb = _bbox(label_words)
+        dx0, dy0, dx1, dy1 = rule["value_box"]
+        vw, vh = (dx1 - dx0) * width, (dy1 - dy0) * height
+        grow = max(0.5 * vw, 0.04 * width)
+        box = (
+            lb[0] + dx0 * width - grow,
+            lb[1] + dy0 * height - 0.4 * vh,
+            lb[0] + dx1 * width + grow,
+            lb[1] + dy1 * height + 0.4 * vh,
+        )
+        inside = [
+            w for w in words
+            if not any(w is lw for lw in label_words)
+            and box[0] <= (float(w[0]) + float(w[2])) / 2 <= box[2] and box[1] <= (float(w[1]) + float(w[3])) / 2 <= box[3]
+        ]
+        if not inside:
+            return None
+        rows = _rows(inside)
+        text = " ".join(str(w[4]) for w in rows[0]).strip(" :#")
+        if not _valid_value(name, text):
+            return None
+        value = _norm_money(text.replace(" ", "")) if name in MONEY_FIELDS else text
+        return value, {"page": str(page_no), "evidence": (" ".join(rule["label_text"].split()) + " " + text).strip()[:140]}
+
+    def learn(self, pdf: PdfSource, invoice: Dict[str, Any], evidence: Optional[Dict[str, Any]]) -> Optional[str]:
+        # Only verified results carry _evidence; the evidence row disambiguates repeated values.
+        if not isinstance(evidence, dict) or not all((invoice or {}).get(f) for f in REQUIRED_FIELDS):
+            return None
+        session = as_pdf_session(pdf)
+        with span("template_learn"):
+            width, height = session.page_size(1)
+            anchors = _page_anchors(session.page_words(1), width, height)
+            rules: Dict[str, Dict[str, Any]] = {}
+            for name in TEMPLATE_FIELDS:
+                value = invoice.get(name) or ""
+                ev = evidence.get(name) if isinstance(evidence.get(name), dict) else {}
+                if not value:
+                    continue
+                try:
+                    page_no = int(str(ev.get("page") or "1"))
+                except ValueError:
+                    continue
+                if not 1 <= page_no <= session.page_count:
+                    continue
+                pw, ph = session.page_size(page_no)
+                rows = _rows(session.page_words(page_no))
+                hit = _locate_value(rows, name, str(value), str(ev.get("evidence") or ""))
+                if hit is None:
+                    continue
+                r, i, j = hit
+                label = _find_label(rows, r, i, j)
+                if not label:
+                    continue
+                lb, vb = _bbox(label), _bbox(rows[r][i : j + 1])
+                rules[name] = {
+                    "page": page_no,
+                    "label": [_clean(w[4]) for w in label],
+                    "label_text": " ".join(str(w[4]) for w in label),
+                    "label_xy": [round(lb[0] / pw, 4), round(lb[1] / ph, 4)],
+                    "value_box": [
+                        round((vb[0] - lb[0]) / pw, 4),
+                        round((vb[1] - lb[1]) / ph, 4),
+                        round((vb[2] - lb[0]) / pw, 4),
+                        round((vb[3] - lb[1]) / ph, 4),
+                    ],
+                }
+
+        # scanned / image-only pages have no words to anchor on; such a template could never match and
+        # would only push real vendor templates out of the store
+        if len(anchors) < self.policy.min_anchors or not rules:
+            incr("templates_not_learned", reason="no_anchors" if len(anchors) < self.policy.min_anchors else "no_rules")
+            return None
+
+        with self._lock:
+            tmpl, score = self._best(anchors)
+            if tmpl is None or score < self.policy.learn_score:
+                tmpl = {"id": uuid.uuid4().hex[:12], "anchors": [list(a) for a in anchors], "fields": {}, "documents": 0}
+                self._templates.append(tmpl)
+                self._templates = self._templates[-self.policy.max_templates :]
+            else:
+                # keep only the anchors this document shares: labels and boilerplate survive, item text does not
+                tmpl["anchors"] = [list(a) for a in _matched_anchors(tmpl["anchors"], anchors, self.policy.anchor_tolerance)]
+            tmpl["documents"] += 1
+            tmpl["updated"] = time.time()
+            counter = "item_documents" if (invoice or {}).get("invoice_items") else "itemless_documents"
+            tmpl[counter] = tmpl.get(counter, 0) + 1
+            filled = tmpl.setdefault("model_fields", {})
+            for name in MODEL_FIELDS:
+                filled[name] = filled.get(name, 0) + (1 if (invoice or {}).get(name) else 0)
+            for name, rule in rules.items():
+                old = tmpl["fields"].get(name)
+                if old is None:
+                    tmpl["fields"][name] = {**rule, "support": 1, "conflicts": 0}
+                elif old["label"] == rule["label"] and all(
+                    abs(a - b) <= self.policy.anchor_tolerance for a, b in zip(old["value_box"][:2], rule["value_box"][:2])
+                ):
+                    old["support"] += 1
+                    old["value_box"] = [max(a, b) if k >= 2 else min(a, b) for k, (a, b) in enumerate(zip(old["value_box"], rule["value_box"]))]
+                else:
+                    old["conflicts"] += 1
+                    if old["conflicts"] > old["support"]:
+                        tmpl["fields"][name] = {**rule, "support": 1, "conflicts": 0}
+            try:
+                self._save()
+            except OSError:
+                pass
+        incr("templates_learned")
+        return tmpl["id"]
+
+
+@_instrumented_extraction
+def extract_invoice_with_templates(
+    pdf: PdfSource,
+    *,
+    vision_call: VisionCallable,
+    store: LayoutTemplateStore,
+    return_evidence: bool = False,
+    line_item_policy: Optional[LineItemPolicy] = LINE_ITEM_POLICY,
+    instrumentation: Optional[Instrumentation] = None,
+    **option_c_kwargs: Any,
+) -> InvoiceExtraction:
+    # Known layout: header by coordinates, items from the text layer, no model call.
+    # Unknown layout (or any field that does not read cleanly): option C, and learn from its verified result.
+    session = as_pdf_session(pdf)
+    match = store.match(session)
+    if match is not None:
+        items = extract_line_items(session, None, line_item_policy) if line_item_policy is not None else None
+        # an empty local item list only means "no items" when the layout is known to carry none; otherwise
+        # the table may sit on an image-only page or lack a money column the local reader recognises
+        if items is not None and (items.confident or (not items.items and match.no_items)):
+            obj = {**match.header, "invoice_items": [dict(it) for it in items.items]}
+            evidence = {**match.evidence, "invoice_items": list(items.evidence)}
+            return InvoiceExtraction.from_invoice_obj(
+                obj,
+                evidence=evidence if return_evidence else None,
+                page_numbers=list(range(1, session.page_count + 1)),
+                items_source="text_layer",
+                template_id=match.template_id,
+            )
+        incr("template_lookups", outcome="items_fallback")
+
+    result = extract_invoice_json_from_pdf_bytes_option_c(
+        session,
+        vision_call=vision_call,
+        return_evidence=True,
+        line_item_policy=line_item_policy,
+        **option_c_kwargs,
+    )
+    # learn only from evidence that was checked, by the verify pass or the single-call local checks
+    if option_c_kwargs.get("verify", True) or option_c_kwargs.get("single_call"):
+        store.learn(session, result.invoice_dict(), result.evidence)
+    if not return_evidence:
+        result.evidence = None
+    return result
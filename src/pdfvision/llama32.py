@@ -1,4 +1,5 @@
 import os
+import re
 import requests
 import json
 from dotenv import load_dotenv
@@ -6,16 +7,20 @@ import logging
 load_dotenv()
 
  
-def llama32(messages, model_size=11):
+def llama32(messages, model_size=11, model=None, url=None, max_tokens=None, temperature=None, timeout=None):
   logger = logging.getLogger('__main__.'+__name__)
+  response = None
+  # without a timeout a stuck request blocks the caller indefinitely
+  timeout = timeout or float(os.getenv("PSAFINT_TIMEOUT_SECONDS", "300"))
   try:
-    model = os.environ["MODEL"]
-    url= os.environ["PSAFINT_API_URL"]
+    # model_size picks MODEL_<size> (e.g. MODEL_11, MODEL_90) when it is configured; explicit arguments come from a stage route
+    model = model or os.environ.get(f"MODEL_{model_size}") or os.environ["MODEL"]
+    url = url or os.environ["PSAFINT_API_URL"]
 
     payload = {
       "model": model,
-      "max_tokens": 4096,
-      "temperature": 0.0,
+      "max_tokens": max_tokens or 4096,
+      "temperature": 0.0 if temperature is None else temperature,
       "stop": ["<|eot_id|>","<|eom_id|>"],
       "stream": False,
       "messages": messages     
@@ -27,7 +32,7 @@ def llama32(messages, model_size=11):
       "Authorization": "Basic " + os.environ["TOKEN"]
     }
 
-    response = requests.request("POST", url, headers=headers, data=json.dumps(payload))
+    response = requests.request("POST", url, headers=headers, data=json.dumps(payload), timeout=timeout)
     if response.status_code != 200:
       raise Exception(response.status_code, response.content)
     else:
@@ -39,8 +44,18 @@ def llama32(messages, model_size=11):
     return res['choices'][0]['message']['content']
 
   except Exception as e:
+    if response is None:
+      # timeouts and connection errors reach the caller, which can hedge or give up
+      raise
     if response.status_code in range(400, 600):
       if "422" in str(e) and  "max_new_tokens" in str(e):
           return "max_new_token_error"
       else:
-        return str(e)
\ No newline at end of file
+        return str(e)
+
+
+def is_error_answer(answer):
+  # HTTP failures come back as "(status, body)" text rather than an exception (callers such as the
+  # agent loop parse it); the token-limit sentinel is a real answer, not a transient failure
+  m = re.match(r"\((\d{3}), ", answer or "")
+  return bool(m) and 400 <= int(m.group(1)) < 600
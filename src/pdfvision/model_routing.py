@@ -0,0 +1,132 @@
+import inspect
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from .instrumentation import incr, span
+
+STAGES = ("ocr", "classify", "extract", "verify")
+
+
+@dataclass(frozen=True)
+class StageRoute:
+    # None means "use the next level down": stage route -> default route -> the client's own env config
+    model: Optional[str] = None
+    url: Optional[str] = None
+    model_size: Optional[int] = None
+    max_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+
+    @property
+    def label(self) -> str:
+        if self.model:
+            return self.model
+        return f"size{self.model_size}" if self.model_size else "default"
+
+    def call_kwargs(self) -> Dict[str, Any]:
+        return {k: v for k, v in asdict(self).items() if v is not None}
+
+    def over(self, base: "StageRoute") -> "StageRoute":
+        return StageRoute(**{f.name: getattr(self, f.name) if getattr(self, f.name) is not None else getattr(base, f.name) for f in fields(self)})
+
+
+def _accepted_kwargs(call: Callable[..., Any], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    # clients that do not take a routing parameter (e.g. pixtral) simply do not receive it
+    try:
+        params = inspect.signature(call).parameters
+    except (TypeError, ValueError):
+        return {}
+    if any(p.kind is inspect.Parameter.VAR_KEYWORD for p in params.values()):
+        return kwargs
+    return {k: v for k, v in kwargs.items() if k in params}
+
+
+class ModelRouter:
+    # Maps pipeline stages to model endpoints/parameters and keeps per-stage latency.
+
+    def __init__(self, routes: Optional[Dict[str, StageRoute]] = None, default: StageRoute = StageRoute()) -> None:
+        routes = dict(routes or {})
+        unknown = set(routes) - set(STAGES)
+        if unknown:
+            raise ValueError(f"unknown pipeline stage(s) {sorted(unknown)}; expected one of {STAGES}")
+        self.routes = routes
+        self.default = default
+        self._lock = threading.Lock()
+        self._stats: Dict[str, List[Any]] = {}  # stage -> [model label, calls, total, max]
+
+    @classmethod
+    def from_dict(cls, cfg: Dict[str, Any]) -> "ModelRouter":
+        # {"default": {...}, "stages": {"ocr": {"model_size": 11, "max_tokens": 2048}, ...}}
+        return cls(
+            {stage: StageRoute(**route) for stage, route in (cfg.get("stages") or {}).items()},
+            StageRoute(**(cfg.get("default") or {})),
+        )
+
+    @classmethod
+    def from_file(cls, path: Path) -> "ModelRouter":
+        return cls.from_dict(json.loads(Path(path).read_text(encoding="utf-8")))
+
+    @classmethod
+    def from_env(cls, var: str = "PDF_VISION_ROUTES") -> "ModelRouter":
+        # the variable holds either inline JSON or the path of a JSON file; unset routes nothing
+        value = os.getenv(var, "").strip()
+        if not value:
+            return cls()
+        if value.startswith("{"):
+            return cls.from_dict(json.loads(value))
+        return cls.from_file(Path(value).expanduser())
+
+    def route(self, stage: str) -> StageRoute:
+        return self.routes.get(stage, StageRoute()).over(self.default)
+
+    def bind(self, call: Callable[..., str], stage: str = "extract") -> "RoutedVisionCall":
+        return RoutedVisionCall(self, call, stage)
+
+    def record(self, stage: str, model: str, seconds: float) -> None:
+        with self._lock:
+            agg = self._stats.setdefault(stage, [model, 0, 0.0, 0.0])
+            agg[0] = model
+            agg[1] += 1
+            agg[2] += seconds
+            agg[3] = max(agg[3], seconds)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                stage: {
+                    "model": model,
+                    "calls": calls,
+                    "total_seconds": round(total, 4),
+                    "mean_seconds": round(total / calls, 4) if calls else 0.0,
+                    "max_seconds": round(mx, 4),
+                }
+                for stage, (model, calls, total, mx) in sorted(self._stats.items())
+            }
+
+
+class RoutedVisionCall:
+    # A VisionCallable bound to one stage; _call_vision rebinds it per stage through for_stage().
+
+    def __init__(self, router: ModelRouter, call: Callable[..., str], stage: str = "extract") -> None:
+        self.router = router
+        self.call = call
+        self.stage = stage
+
+    def for_stage(self, stage: str) -> "RoutedVisionCall":
+        return self if stage == self.stage else RoutedVisionCall(self.router, self.call, stage)
+
+    def __call__(self, messages: List[Dict], **overrides: Any) -> str:
+        # overrides are per-call parameters from wrapping layers, e.g. a hedging timeout
+        route = self.router.route(self.stage)
+        kwargs = _accepted_kwargs(self.call, {**route.call_kwargs(), **overrides})
+        incr("routed_calls", stage=self.stage, model=route.label)
+        t0 = time.perf_counter()
+        try:
+            with span("model_call", stage=self.stage, model=route.label):
+                return self.call(messages, **kwargs)
+        finally:
+            self.router.record(self.stage, route.label, time.perf_counter() - t0)
@@ -1,15 +1,40 @@
 import argparse
 import base64
+import functools
+import hashlib
 import importlib
 import json
+import logging
 import os
 import re
-from dataclasses import dataclass
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
 from pathlib import Path
-from typing import Callable, Dict, List, Optional, Sequence, Tuple, Any
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Any, Union
 
 import fitz
 
+try:
+    import numpy as np
+except ImportError:  # declared dependency; without it the pixel-based page checks are skipped
+    np = None
+    logging.getLogger(__name__).warning(
+        "numpy is not installed: blank-page skipping, the ink prescan and perceptual page dedup are disabled"
+    )
+
+from .instrumentation import (
+    Instrumentation,
+    JsonlFileSink,
+    PrometheusTextExporter,
+    current_instrumentation,
+    incr,
+    run_in_current_context,
+    span,
+)
+from .model_routing import ModelRouter
+
 VisionCallable = Callable[[List[Dict]], str]
 
 INVOICE_EXTRACT_SYSTEM_PROMPT = """\
@@ -466,6 +491,28 @@ VERIFIED OUTPUT (zero-total item removed/blanked):
 }
 """
 
+# Single-call mode: the extract prompts plus the verifier's evidence contract. The evidence is then
+# checked locally (_check_evidence_locally) instead of by a second model pass.
+_EVIDENCE_IN_EXTRACT_RULES = """
+EVIDENCE (this request only; overrides "no extra keys" above):
+- Add exactly one extra top-level key "_evidence" next to the schema keys.
+- For every non-empty field, add {"page": "<N>", "evidence": "<short text>"} under its key.
+- Evidence must be copied exactly from {source}, <= 140 characters, must contain the full value
+  (amounts may show "$" and commas) and should include the nearby label (e.g. "INVOICE #", "TOTAL DUE").
+- Page numbers are 1-based strings and must be the page the evidence appears on.
+- "_evidence"."invoice_items" is an array aligned with invoice_items; each entry's evidence holds the
+  item description (or a key part of it) and its item_total.
+- If you cannot copy evidence for a value, leave that value "" instead.
+"""
+
+INVOICE_EXTRACT_WITH_EVIDENCE_SYSTEM_PROMPT = INVOICE_EXTRACT_SYSTEM_PROMPT + _EVIDENCE_IN_EXTRACT_RULES.replace(
+    "{source}", "the visible text of the page"
+)
+
+INVOICE_EXTRACT_WITH_EVIDENCE_FROM_TEXT_SYSTEM_PROMPT = INVOICE_EXTRACT_FROM_TEXT_SYSTEM_PROMPT + _EVIDENCE_IN_EXTRACT_RULES.replace(
+    "{source}", 'the OCR text (a contiguous substring after the "=== PAGE N ===" marker of page N)'
+)
+
 INVOICE_KEYS = [
     "invoice_date",
     "invoice_number",
@@ -492,6 +539,184 @@ class PdfExtractResult:
     text: str
     page_texts: List[str]
     fallback_page_images_b64: List[str]
+    skipped_blank_pages: List[int] = field(default_factory=list)
+
+
+@dataclass
+class PageRunStats:
+    page_no: int
+    action: str = "extract"
+    extracted: bool = False
+    new_items: int = 0
+    extract_seconds: float = 0.0
+    verify_seconds: float = 0.0
+    total_seconds: float = 0.0
+    ocr_text: str = ""
+    note: str = ""
+    locally_blanked: List[str] = field(default_factory=list)
+
+
+HEADER_FIELDS = ["invoice_date", "invoice_number", "gross_invoice_amount", "po_number"]
+
+
+@dataclass
+class EarlyStopPolicy:
+    header_fields: Sequence[str] = tuple(HEADER_FIELDS)
+    # once the header is complete, stop after this many consecutive pages add no new line items
+    unproductive_pages: int = 1
+    # once the header is complete, pages ranked below this score are not sent to the model
+    min_page_score: Optional[float] = None
+    # "skip" drops the remaining pages, "ocr" downgrades them to a plain transcription call whose text is
+    # returned in InvoiceExtraction.ocr_only_texts
+    remaining_pages: str = "skip"
+
+
+@dataclass(frozen=True)
+class BlankPagePolicy:
+    # thumbnail resolution the pixel checks run on
+    dpi: int = 36
+    # gray levels below this count as ink
+    ink_threshold: int = 200
+    # fraction of the page trimmed on every side (scanner edges, punch holes)
+    margin: float = 0.03
+    # a page is blank if at most this fraction of pixels is ink ...
+    max_ink_ratio: float = 0.0002
+    # ... or fewer than min_dense_tiles tiles hold tile_min_ink ink pixels (isolated speckle)
+    tile: int = 8
+    tile_min_ink: int = 6
+    min_dense_tiles: int = 3
+    # ... or the page is one flat tone
+    min_std: float = 2.0
+
+
+BLANK_PAGE_POLICY = BlankPagePolicy()
+
+
+@dataclass(frozen=True)
+class PrescanPolicy:
+    # thumbnail resolution used to find where the ink is
+    dpi: int = 36
+    ink_threshold: int = 220
+    # rows/columns need this many ink pixels to count, so stray speckle does not widen the box
+    min_ink_per_line: int = 2
+    margin: float = 0.02
+    pad_points: float = 12.0
+
+
+PRESCAN_POLICY = PrescanPolicy()
+
+
+@dataclass(frozen=True)
+class DedupPolicy:
+    # thumbnail resolution the perceptual hashes are computed from
+    dpi: int = 36
+    # the hashed region is cropped to pixels darker than this, so margins and scale do not matter
+    ink_threshold: int = 220
+    # largest Hamming distance (pHash and dHash alike) at which two pages still look the same
+    max_distance: int = 4
+    # also require identical text (text-layer pages) or identical thumbnail pixels (image pages):
+    # same-template invoices that differ only in their numbers hash alike. Turning it off lets a PDF
+    # and a PNG of the same invoice match, which is only safe between the attachments of one email.
+    confirm_content: bool = True
+
+
+DEDUP_POLICY = DedupPolicy()
+
+
+@dataclass
+class RenderStats:
+    page_no: int
+    dpi: int
+    full_pixels: int
+    rendered_pixels: int
+    pixels_saved: int
+    # "ink_bbox" (thumbnail prescan), "content_bbox" (vector drawings) or "full"
+    method: str = "full"
+    clip: Optional[Tuple[float, float, float, float]] = None
+
+
+@dataclass
+class PageScore:
+    page_no: int
+    score: float
+    has_text_layer: bool
+    scored: bool
+    signals: Dict[str, int]
+
+
+@dataclass(slots=True)
+class InvoiceExtraction:
+    invoice_date: str = ""
+    invoice_number: str = ""
+    gross_invoice_amount: str = ""
+    invoice_tax: str = ""
+    invoice_freight: str = ""
+    po_number: str = ""
+    po_line_number: str = ""
+    po_line_amount: str = ""
+    invoice_description: str = ""
+    invoice_items: List[Dict[str, str]] = field(default_factory=list)
+    evidence: Optional[Dict[str, Any]] = None
+    page_numbers: List[int] = field(default_factory=list)
+    page_scores: List[PageScore] = field(default_factory=list)
+    page_stats: List[PageRunStats] = field(default_factory=list)
+    skipped_pages: List[int] = field(default_factory=list)
+    # duplicate page -> page whose result it reuses
+    deduplicated_pages: Dict[int, int] = field(default_factory=dict)
+    render_stats: List[RenderStats] = field(default_factory=list)
+    # "model", or "text_layer" when the line items came from the local table extractor
+    items_source: str = "model"
+    # layout template the header was read with, when no model call was needed
+    template_id: str = ""
+    # fields the single-call local evidence checks blanked
+    locally_blanked: List[str] = field(default_factory=list)
+    # page -> transcription of pages downgraded to OCR after an early stop, for classification or archiving
+    ocr_only_texts: Dict[int, str] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+    call_counts: Dict[str, int] = field(default_factory=dict)
+    cache_hits: int = 0
+
+    @classmethod
+    def from_invoice_obj(cls, obj: Optional[Dict[str, Any]], **kwargs: Any) -> "InvoiceExtraction":
+        src = obj if isinstance(obj, dict) else {}
+        header = {k: src.get(k, "") or "" for k in INVOICE_KEYS if k != "invoice_items"}
+        return cls(invoice_items=list(src.get("invoice_items") or []), **header, **kwargs)
+
+    def invoice_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in INVOICE_KEYS}
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.call_counts.values())
+
+
+def format_invoice_json_fenced(result: InvoiceExtraction) -> str:
+    return "```json\n" + json.dumps(result.invoice_dict(), ensure_ascii=False, indent=2) + "\n```"
+
+
+def _instrumented_extraction(fn: Callable[..., InvoiceExtraction]) -> Callable[..., InvoiceExtraction]:
+    # Each extraction run records into its own Instrumentation (so the result carries only this
+    # run's timings and call counts) and forwards every event to the caller's instrumentation.
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> InvoiceExtraction:
+        run = Instrumentation(parent=kwargs.get("instrumentation") or current_instrumentation())
+        with run.activate():
+            with span("total"):
+                result = fn(*args, **kwargs)
+        result.timings = {k: round(v, 4) for k, v in run.memory.span_totals().items()}
+        result.call_counts = run.memory.counter_by_label("vision_calls", "stage")
+        return result
+
+    return wrapper
+
+
+def _call_vision(vision_call: VisionCallable, messages: List[Dict], *, stage: str) -> str:
+    incr("vision_calls", stage=stage)
+    # stage-aware callables (model_routing.RoutedVisionCall) send each stage to its own model
+    if hasattr(vision_call, "for_stage"):
+        vision_call = vision_call.for_stage(stage)
+    with span(stage):
+        return (vision_call(messages) or "").strip()
 
 
 def _b64encode_png(pix: fitz.Pixmap) -> str:
@@ -527,17 +752,88 @@ def _content_bbox(page: fitz.Page, pad: float = 6.0) -> fitz.Rect:
     )
 
 
+def _ink_bbox(page: fitz.Page, policy: Optional[PrescanPolicy]) -> Optional[fitz.Rect]:
+    # Stage one of the two-stage render: find the inked region on a low-DPI grayscale thumbnail.
+    # Unlike _content_bbox this also sees inside embedded scan images.
+    if policy is None or np is None or page.rotation:
+        return None
+    with span("prescan"):
+        ink = _gray_thumbnail(page, policy.dpi) < policy.ink_threshold
+    h, w = ink.shape
+    my, mx = int(h * policy.margin), int(w * policy.margin)
+    ink[:my, :] = False
+    ink[h - my :, :] = False
+    ink[:, :mx] = False
+    ink[:, w - mx :] = False
+
+    rows = np.flatnonzero(ink.sum(axis=1) >= policy.min_ink_per_line)
+    cols = np.flatnonzero(ink.sum(axis=0) >= policy.min_ink_per_line)
+    if not rows.size or not cols.size:
+        return None
+
+    r = page.rect
+    scale = 72.0 / policy.dpi
+    pad = policy.pad_points
+    box = fitz.Rect(
+        r.x0 + cols[0] * scale - pad,
+        r.y0 + rows[0] * scale - pad,
+        r.x0 + (cols[-1] + 1) * scale + pad,
+        r.y0 + (rows[-1] + 1) * scale + pad,
+    )
+    return box & r
+
+
+def _render_page_png_b64_with_stats(
+    page: fitz.Page,
+    *,
+    dpi: int = 300,
+    clip_to_content: bool = True,
+    pad: float = 6.0,
+    prescan: Optional[PrescanPolicy] = PRESCAN_POLICY,
+) -> Tuple[str, RenderStats]:
+    clip_rect: Optional[fitz.Rect] = None
+    method = "full"
+    if clip_to_content:
+        clip_rect = _ink_bbox(page, prescan)
+        method = "ink_bbox"
+        if clip_rect is None or clip_rect.is_empty:
+            clip_rect = _content_bbox(page, pad=pad)
+            method = "content_bbox"
+
+    mat = fitz.Matrix(dpi / 72.0, dpi / 72.0)
+    with span("render"):
+        pix = page.get_pixmap(matrix=mat, clip=clip_rect, alpha=False)
+    incr("pages_rendered")
+
+    full = page.rect * mat
+    full_pixels = int(round(full.width)) * int(round(full.height))
+    rendered = pix.width * pix.height
+    saved = max(full_pixels - rendered, 0)
+    incr("render_pixels", rendered)
+    incr("render_pixels_saved", saved)
+    stats = RenderStats(
+        page_no=page.number + 1,
+        dpi=dpi,
+        full_pixels=full_pixels,
+        rendered_pixels=rendered,
+        pixels_saved=saved,
+        method=method,
+        clip=tuple(round(v, 1) for v in clip_rect) if clip_rect is not None else None,
+    )
+
+    with span("png_encode"):
+        return _b64encode_png(pix), stats
+
+
 def _render_page_png_b64(
     page: fitz.Page,
     *,
     dpi: int = 300,
     clip_to_content: bool = True,
     pad: float = 6.0,
+    prescan: Optional[PrescanPolicy] = PRESCAN_POLICY,
 ) -> str:
-    clip_rect = _content_bbox(page, pad=pad) if clip_to_content else None
-    mat = fitz.Matrix(dpi / 72.0, dpi / 72.0)
-    pix = page.get_pixmap(matrix=mat, clip=clip_rect, alpha=False)
-    return _b64encode_png(pix)
+    return _render_page_png_b64_with_stats(page, dpi=dpi, clip_to_content=clip_to_content, pad=pad, prescan=prescan)[0]
 
 
 def _to_data_url_png(b64_png: str) -> str:
@@ -553,25 +849,784 @@ def _vision_ocr_page_text(page_b64: str, *, vision_call: VisionCallable) -> str:
             ],
         }
     ]
-    return (vision_call(messages) or "").strip()
+    return _call_vision(vision_call, messages, stage="ocr")
+
+def _gray_array(pix: fitz.Pixmap) -> "np.ndarray":
+    a = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+    return a[:, : pix.width]
+
+
+def _gray_thumbnail(page: fitz.Page, dpi: int) -> "np.ndarray":
+    mat = fitz.Matrix(dpi / 72.0, dpi / 72.0)
+    return _gray_array(page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY, alpha=False))
+
+
+def _gray_from_png_b64(b64_png: str, *, max_width: int = 600) -> "np.ndarray":
+    pix = fitz.Pixmap(base64.b64decode(b64_png))
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.n != 1:
+        pix = fitz.Pixmap(fitz.csGRAY, pix)
+    factor, width = 0, pix.width
+    while width > max_width:
+        width //= 2
+        factor += 1
+    if factor:
+        pix.shrink(factor)
+    return _gray_array(pix)
+
+
+def blank_page_signals(gray: "np.ndarray", policy: BlankPagePolicy = BLANK_PAGE_POLICY) -> Dict[str, float]:
+    h, w = gray.shape
+    my, mx = int(h * policy.margin), int(w * policy.margin)
+    gray = gray[my : h - my or h, mx : w - mx or w]
+
+    ink = gray < policy.ink_threshold
+    ink_px = int(ink.sum())
+
+    # ink pixels with no ink to the left or above: a cheap stand-in for connected-component labelling
+    left = np.zeros_like(ink)
+    left[:, 1:] = ink[:, :-1]
+    up = np.zeros_like(ink)
+    up[1:, :] = ink[:-1, :]
+    components = int((ink & ~left & ~up).sum())
+
+    t = policy.tile
+    th, tw = (ink.shape[0] // t) * t, (ink.shape[1] // t) * t
+    dense_tiles = 0
+    if th and tw:
+        tiles = ink[:th, :tw].reshape(th // t, t, tw // t, t).sum(axis=(1, 3))
+        dense_tiles = int((tiles >= policy.tile_min_ink).sum())
+
+    return {
+        "ink_ratio": round(ink_px / max(ink.size, 1), 5),
+        "std": round(float(gray.std()), 3),
+        "components": components,
+        "mean_component_px": round(ink_px / max(components, 1), 2),
+        "dense_tiles": dense_tiles,
+    }
+
+
+def _looks_blank(signals: Dict[str, float], policy: BlankPagePolicy) -> bool:
+    return (
+        signals["ink_ratio"] <= policy.max_ink_ratio
+        or signals["dense_tiles"] < policy.min_dense_tiles
+        or signals["std"] < policy.min_std
+    )
+
+
+def is_blank_page(page: fitz.Page, policy: Optional[BlankPagePolicy] = BLANK_PAGE_POLICY) -> Tuple[bool, Dict[str, float]]:
+    if policy is None or np is None:
+        return False, {}
+    with span("blank_check"):
+        signals = blank_page_signals(_gray_thumbnail(page, policy.dpi), policy)
+    return _looks_blank(signals, policy), signals
+
+
+def is_blank_png_b64(b64_png: str, policy: Optional[BlankPagePolicy] = BLANK_PAGE_POLICY) -> Tuple[bool, Dict[str, float]]:
+    if policy is None or np is None:
+        return False, {}
+    with span("blank_check"):
+        signals = blank_page_signals(_gray_from_png_b64(b64_png), policy)
+    return _looks_blank(signals, policy), signals
+
+
+def _drop_blank_images(
+    page_images_b64: Sequence[str],
+    page_nos: Sequence[int],
+    policy: Optional[BlankPagePolicy],
+) -> Tuple[List[str], List[int], List[int]]:
+    kept_imgs: List[str] = []
+    kept_nos: List[int] = []
+    skipped: List[int] = []
+    for page_no, b64_png in zip(page_nos, page_images_b64):
+        if is_blank_png_b64(b64_png, policy)[0]:
+            incr("pages_skipped_blank")
+            skipped.append(page_no)
+            continue
+        kept_imgs.append(b64_png)
+        kept_nos.append(page_no)
+    return kept_imgs, kept_nos, skipped
+
+
+@dataclass(frozen=True)
+class PageFingerprint:
+    phash: int
+    dhash: int
+    # "t:<sha1>" of the normalized text layer, or "p:<sha1>" of the cropped thumbnail pixels
+    digest: str
+
+    def distance(self, other: "PageFingerprint") -> int:
+        return max(bin(self.phash ^ other.phash).count("1"), bin(self.dhash ^ other.dhash).count("1"))
+
+    def matches(self, other: "PageFingerprint", policy: DedupPolicy = DEDUP_POLICY) -> bool:
+        if policy.confirm_content and self.digest != other.digest:
+            return False
+        return self.distance(other) <= policy.max_distance
+
+    def to_json(self) -> Dict[str, str]:
+        return {"phash": f"{self.phash:016x}", "dhash": f"{self.dhash:016x}", "digest": self.digest}
+
+    @classmethod
+    def from_json(cls, obj: Dict[str, str]) -> "PageFingerprint":
+        return cls(int(obj["phash"], 16), int(obj["dhash"], 16), obj["digest"])
+
+
+def _resize_mean(gray: "np.ndarray", h: int, w: int) -> "np.ndarray":
+    # area-average resize; tiny inputs are repeated up first so every output cell has pixels
+    g = gray.astype(np.float64)
+    if g.shape[0] < h:
+        g = np.repeat(g, -(-h // g.shape[0]), axis=0)
+    if g.shape[1] < w:
+        g = np.repeat(g, -(-w // g.shape[1]), axis=1)
+    rows = np.linspace(0, g.shape[0], h + 1).astype(int)
+    cols = np.linspace(0, g.shape[1], w + 1).astype(int)
+    sums = np.add.reduceat(np.add.reduceat(g, rows[:-1], axis=0), cols[:-1], axis=1)
+    return sums / np.outer(np.diff(rows), np.diff(cols))
+
+
+@functools.lru_cache(maxsize=4)
+def _dct_matrix(n: int) -> "np.ndarray":
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+
+def _bits_to_int(bits: "np.ndarray") -> int:
+    out = 0
+    for b in bits.ravel():
+        out = (out << 1) | int(b)
+    return out
+
+
+def _crop_to_ink(gray: "np.ndarray", ink_threshold: int) -> "np.ndarray":
+    ink = gray < ink_threshold
+    rows = np.flatnonzero(ink.sum(axis=1) >= 2)
+    cols = np.flatnonzero(ink.sum(axis=0) >= 2)
+    if not rows.size or not cols.size:
+        return gray
+    return gray[rows[0] : rows[-1] + 1, cols[0] : cols[-1] + 1]
+
+
+def perceptual_hashes(gray: "np.ndarray") -> Tuple[int, int]:
+    # pHash: signs of the low-frequency 8x8 DCT block (DC term dropped) against their median
+    small = _resize_mean(gray, 32, 32)
+    m = _dct_matrix(32)
+    low = (m @ small @ m.T)[:8, :8].ravel()[1:]
+    phash = _bits_to_int(low > np.median(low))
+    # dHash: horizontal gradient signs on a 9x8 grid
+    grid = _resize_mean(gray, 8, 9)
+    dhash = _bits_to_int(grid[:, 1:] > grid[:, :-1])
+    return phash, dhash
+
+
+def _fingerprint(gray: "np.ndarray", text: str, policy: DedupPolicy) -> PageFingerprint:
+    with span("page_hash"):
+        cropped = _crop_to_ink(gray, policy.ink_threshold)
+        phash, dhash = perceptual_hashes(cropped)
+        norm = " ".join((text or "").lower().split())
+        if norm:
+            digest = "t:" + hashlib.sha1(norm.encode("utf-8")).hexdigest()
+        else:
+            raw = np.ascontiguousarray(cropped).tobytes() + repr(cropped.shape).encode("ascii")
+            digest = "p:" + hashlib.sha1(raw).hexdigest()
+    return PageFingerprint(phash, dhash, digest)
+
+
+def page_fingerprint(
+    page: fitz.Page, policy: Optional[DedupPolicy] = DEDUP_POLICY, *, text: Optional[str] = None
+) -> Optional[PageFingerprint]:
+    if policy is None or np is None:
+        return None
+    if text is None:
+        text = page.get_text("text") or ""
+    return _fingerprint(_gray_thumbnail(page, policy.dpi), text, policy)
+
+
+def image_fingerprint_b64(b64_png: str, policy: Optional[DedupPolicy] = DEDUP_POLICY) -> Optional[PageFingerprint]:
+    if policy is None or np is None:
+        return None
+    return _fingerprint(_gray_from_png_b64(b64_png), "", policy)
+
+
+def find_duplicate_pages(
+    fingerprints: Sequence[Tuple[int, Optional[PageFingerprint]]],
+    policy: Optional[DedupPolicy] = DEDUP_POLICY,
+) -> Dict[int, int]:
+    # duplicate page -> first page it matches; pages without a fingerprint are never duplicates.
+    # Continuation pages of one document share a layout, so content is always confirmed here.
+    if policy is None:
+        return {}
+    if not policy.confirm_content:
+        policy = replace(policy, confirm_content=True)
+    firsts: List[Tuple[int, PageFingerprint]] = []
+    dups: Dict[int, int] = {}
+    for page_no, fp in fingerprints:
+        if fp is None:
+            continue
+        original = next((n for n, seen in firsts if fp.matches(seen, policy)), None)
+        if original is None:
+            firsts.append((page_no, fp))
+        else:
+            dups[page_no] = original
+    if dups:
+        incr("pages_deduplicated", len(dups))
+    return dups
+
+
+def _drop_duplicate_images(
+    page_images_b64: Sequence[str],
+    page_nos: Sequence[int],
+    policy: Optional[DedupPolicy],
+) -> Tuple[List[str], List[int], Dict[int, int]]:
+    if policy is None or np is None or len(page_nos) < 2:
+        return list(page_images_b64), list(page_nos), {}
+    dups = find_duplicate_pages(
+        [(n, image_fingerprint_b64(b64_png, policy)) for n, b64_png in zip(page_nos, page_images_b64)], policy
+    )
+    kept = [(n, b64_png) for n, b64_png in zip(page_nos, page_images_b64) if n not in dups]
+    return [b for _, b in kept], [n for n, _ in kept], dups
+
+
+_MONEY_TOKEN_RE = re.compile(r"^\(?-?\$?\d{1,3}(?:,\d{3})*\.\d{2}\)?$|^\(?-?\$?\d+\.\d{2}\)?$")
+_MONEY_LINE_END_RE = re.compile(r"\$?\s?\d{1,3}(?:,\d{3})*\.\d{2}\)?\s*$|\$?\s?\d+\.\d{2}\)?\s*$")
+
+# (signal name, pattern, weight per hit, max hits counted)
+_INVOICE_SIGNAL_PATTERNS: List[Tuple[str, "re.Pattern[str]", float, int]] = [
+    ("invoice", re.compile(r"\binvoice\b", re.IGNORECASE), 2.0, 3),
+    ("invoice_label", re.compile(r"\binvoice\s*(?:#|no\b|no\.|num|number|nbr|date)", re.IGNORECASE), 4.0, 2),
+    ("amount_due", re.compile(r"\b(?:amount|balance|total)\s+due\b", re.IGNORECASE), 4.0, 2),
+    ("total", re.compile(r"\b(?:sub\s?)?total\b", re.IGNORECASE), 1.5, 4),
+    ("po_label", re.compile(r"\b(?:p\.?\s?o\.?|purchase\s+order)\s*(?:#|no\.?|num|number)?\s*[:#]?\s*[A-Z0-9-]*\d", re.IGNORECASE), 3.0, 2),
+    ("po_number", re.compile(r"\b(?:810|850|816|858|812|817|818|828|830|856)\d{7}\b"), 3.0, 2),
+    ("non_invoice", re.compile(r"\b(?:packing\s+(?:list|slip)|bill\s+of\s+lading|terms\s+(?:and|&)\s+conditions|intentionally\s+left\s+blank|statement\s+of\s+account|account\s+statement|remittance\s+advice|balance\s+forward)\b", re.IGNORECASE), -4.0, 2),
+]
+
+_DENSITY_WORD_BUDGET = 600
+
+
+def _money_column_rows(words: Sequence[Sequence[Any]], *, bucket: float = 12.0) -> int:
+    # words are PyMuPDF "words" tuples: (x0, y0, x1, y1, text, block_no, line_no, word_no)
+    columns: Dict[int, set] = {}
+    for w in words:
+        if len(w) < 5 or not _MONEY_TOKEN_RE.match(str(w[4]).strip()):
+            continue
+        col = int(round(float(w[2]) / bucket))
+        columns.setdefault(col, set()).add(int(round(float(w[1]))))
+    return max((len(rows) for rows in columns.values()), default=0)
+
+
+def score_invoice_page_text(
+    text: str,
+    *,
+    words: Optional[Sequence[Sequence[Any]]] = None,
+) -> Tuple[float, Dict[str, int]]:
+    t = text or ""
+    signals: Dict[str, int] = {}
+    score = 0.0
+
+    for name, pattern, weight, cap in _INVOICE_SIGNAL_PATTERNS:
+        hits = len(pattern.findall(t))
+        signals[name] = hits
+        score += weight * min(hits, cap)
+
+    if words is not None:
+        money_rows = _money_column_rows(words)
+    else:
+        money_rows = sum(1 for line in t.splitlines() if _MONEY_LINE_END_RE.search(line))
+    signals["money_column_rows"] = money_rows
+    if money_rows >= 3:
+        score += 3.0 + 0.25 * min(money_rows - 3, 12)
+
+    word_count = len(words) if words is not None else len(t.split())
+    signals["words"] = word_count
+    if word_count > _DENSITY_WORD_BUDGET and score > 0:
+        score *= (_DENSITY_WORD_BUDGET / word_count) ** 0.5
+
+    return round(score, 3), signals
+
+
+@dataclass(frozen=True)
+class LineItemPolicy:
+    # words whose vertical centres are this close (points) share a row
+    row_tolerance: float = 3.0
+    # right edges of money tokens within this distance share a column
+    column_tolerance: float = 12.0
+    # a money column needs this many rows to count
+    min_column_rows: int = 2
+    # a wrapped description line joins the item above when the gap is under this many row heights
+    max_continuation_gap: float = 1.6
+    min_items: int = 1
+
+
+LINE_ITEM_POLICY = LineItemPolicy()
+
+
+@dataclass
+class LocalLineItems:
+    items: List[Dict[str, str]] = field(default_factory=list)
+    evidence: List[Dict[str, str]] = field(default_factory=list)
+    pages: List[int] = field(default_factory=list)
+    confident: bool = False
+    # "subtotal" (the only way a table is trusted: the items add up to a printed subtotal/total),
+    # or why the table was not trusted
+    reason: str = ""
+
+
+_QTY_TOKEN_RE = re.compile(r"^\d{1,6}(?:\.\d{1,4})?$")
+_SUMMARY_LABEL_RE = re.compile(
+    r"^(?:sub\s*-?\s*total|total|grand\s+total|invoice\s+total|amount\s+due|balance(?:\s+due)?|"
+    r"(?:sales\s+)?tax|freight|shipping|handling|discount|less\b|payments?|deposit|credit)\b",
+    re.IGNORECASE,
+)
+_ITEM_HEADER_WORDS = {
+    "description", "item", "qty", "quantity", "unit", "price", "amount", "total",
+    "rate", "ext", "extended", "part", "sku", "product", "uom",
+}
+
+
+def _money_value(token: str) -> Optional[float]:
+    t = _norm_money(token)
+    neg = t.startswith("(") and t.endswith(")")
+    try:
+        v = float(t.strip("()"))
+    except ValueError:
+        return None
+    return -abs(v) if neg else v
+
+
+def _is_money_word(w: Sequence[Any]) -> bool:
+    return bool(_MONEY_TOKEN_RE.match(str(w[4]).strip()))
+
+
+def _group_rows(words: Sequence[Sequence[Any]], tolerance: float) -> List[List[Sequence[Any]]]:
+    ws = sorted(
+        (w for w in words if len(w) >= 5 and str(w[4]).strip()),
+        key=lambda w: ((float(w[1]) + float(w[3])) / 2, float(w[0])),
+    )
+    rows: List[List[Sequence[Any]]] = []
+    centre = 0.0
+    for w in ws:
+        yc = (float(w[1]) + float(w[3])) / 2
+        if rows and abs(yc - centre) <= tolerance:
+            rows[-1].append(w)
+            centre += (yc - centre) / len(rows[-1])
+        else:
+            rows.append([w])
+            centre = yc
+    return [sorted(r, key=lambda w: float(w[0])) for r in rows]
+
+
+def _money_columns(rows: Sequence[Sequence[Sequence[Any]]], policy: LineItemPolicy) -> List[float]:
+    # right edges of right-aligned money columns, left to right
+    clusters: List[List[float]] = []
+    for x in sorted(float(w[2]) for row in rows for w in row if _is_money_word(w)):
+        if clusters and x - clusters[-1][-1] <= policy.column_tolerance:
+            clusters[-1].append(x)
+        else:
+            clusters.append([x])
+    return [sum(c) / len(c) for c in clusters if len(c) >= policy.min_column_rows]
+
+
+def _page_line_items(
+    words: Sequence[Sequence[Any]], page_no: int, policy: LineItemPolicy
+) -> Tuple[List[Dict[str, str]], List[Dict[str, str]], List[float], int]:
+    # returns items, their evidence, amounts printed on summary rows, and items whose qty * price == total
+    rows = _group_rows(words, policy.row_tolerance)
+    cols = _money_columns(rows, policy)
+    items: List[Dict[str, str]] = []
+    evidence: List[Dict[str, str]] = []
+    summary_amounts: List[float] = []
+    arithmetic_ok = 0
+    if not cols:
+        return items, evidence, summary_amounts, arithmetic_ok
+
+    def column(w: Sequence[Any]) -> Optional[int]:
+        i = min(range(len(cols)), key=lambda k: abs(cols[k] - float(w[2])))
+        return i if abs(cols[i] - float(w[2])) <= policy.column_tolerance else None
+
+    last = len(cols) - 1
+    qty_x: Optional[float] = None
+    prev_bottom: Optional[float] = None
+    desc_x0: Optional[float] = None
+
+    for row in rows:
+        money = {column(w): w for w in row if _is_money_word(w)}
+        money.pop(None, None)
+        label_words = [w for w in row if not _is_money_word(w) and str(w[4]).strip() != "$"]
+        label = " ".join(str(w[4]) for w in label_words).strip(" :")
+        row_text = " ".join(str(w[4]) for w in row)
+        top, bottom = min(float(w[1]) for w in row), max(float(w[3]) for w in row)
+
+        if not money:
+            lowered = {str(w[4]).strip(":#.").lower() for w in row}
+            if len(lowered & _ITEM_HEADER_WORDS) >= 2:
+                hdr = [w for w in row if str(w[4]).strip(":#.").lower() in ("qty", "quantity")]
+                qty_x = (float(hdr[0][0]) + float(hdr[0][2])) / 2 if hdr else None
+                prev_bottom = desc_x0 = None
+                continue
+            # wrapped description line of the item above
+            if items and prev_bottom is not None and desc_x0 is not None:
+                height = max(bottom - top, 1.0)
+                if top - prev_bottom <= policy.max_continuation_gap * height and float(row[0][0]) >= desc_x0 - policy.column_tolerance:
+                    items[-1]["item_description"] = (items[-1]["item_description"] + " " + label).strip()
+                    prev_bottom = bottom
+                    continue
+            prev_bottom = desc_x0 = None
+            continue
+
+        if last not in money:
+            continue
+        # summary rows carry one amount; a "Freight" line with qty and unit price is an item
+        if len(money) == 1 and _SUMMARY_LABEL_RE.match(label) and len(label.split()) <= 5:
+            v = _money_value(str(money[last][4]))
+            if v is not None:
+                summary_amounts.append(v)
+            prev_bottom = desc_x0 = None
+            continue
+
+        total = _money_value(str(money[last][4]))
+        if not label or not total:
+            continue
+        unit_col = max((k for k in money if k < last), default=None)
+        unit = _money_value(str(money[unit_col][4])) if unit_col is not None else None
+
+        # quantity: a plain number (or an earlier money column) that makes qty * unit == total,
+        # otherwise whatever sits under a Qty header
+        first_money_x0 = min(float(w[0]) for w in money.values())
+        qty_candidates = [w for w in label_words if _QTY_TOKEN_RE.match(str(w[4])) and float(w[2]) <= first_money_x0]
+        qty_candidates += [w for k, w in money.items() if unit_col is not None and k < unit_col]
+        qty_word = None
+        if unit:
+            for w in reversed(qty_candidates):
+                q = _money_value(str(w[4]))
+                if q is not None and abs(q * unit - total) <= 0.01 + abs(total) * 0.001:
+                    qty_word = w
+                    break
+            arithmetic_ok += qty_word is not None
+        if qty_word is None and qty_x is not None and qty_candidates:
+            near = min(qty_candidates, key=lambda w: abs((float(w[0]) + float(w[2])) / 2 - qty_x))
+            if abs((float(near[0]) + float(near[2])) / 2 - qty_x) <= 2 * policy.column_tolerance:
+                qty_word = near
+
+        desc_words = [w for w in label_words if w is not qty_word and float(w[2]) <= first_money_x0]
+        # a leading row number is not part of the description
+        if len(desc_words) > 1 and re.fullmatch(r"\d{1,3}\.?", str(desc_words[0][4])):
+            desc_words = desc_words[1:]
+        # a bare number set apart by a column gap is an unrecognised quantity/unit column, not description
+        while (
+            len(desc_words) > 1
+            and _QTY_TOKEN_RE.match(str(desc_words[-1][4]))
+            and float(desc_words[-1][0]) - float(desc_words[-2][2]) > policy.column_tolerance
+        ):
+            desc_words = desc_words[:-1]
+        if not desc_words:
+            continue
+
+        items.append({
+            "item_number": "",
+            "item_description": " ".join(str(w[4]) for w in desc_words),
+            "item_quantity": _norm_money(str(qty_word[4])) if qty_word is not None else "",
+            "item_unit_price": _norm_money(str(money[unit_col][4])) if unit_col is not None else "",
+            "item_total": _norm_money(str(money[last][4])),
+        })
+        evidence.append({"page": str(page_no), "evidence": row_text[:140]})
+        prev_bottom, desc_x0 = bottom, float(desc_words[0][0])
+
+    return items, evidence, summary_amounts, arithmetic_ok
+
+
+def extract_line_items_from_words(
+    pages: Sequence[Tuple[int, Sequence[Sequence[Any]]]],
+    policy: LineItemPolicy = LINE_ITEM_POLICY,
+) -> LocalLineItems:
+    # pages: (page_no, PyMuPDF words) pairs; a table may continue across them
+    out = LocalLineItems()
+    summary_amounts: List[float] = []
+    arithmetic_ok = 0
+    image_only = False
+    for page_no, words in pages:
+        if not words:
+            image_only = True
+            continue
+        items, evidence, amounts, ok = _page_line_items(words, page_no, policy)
+        if items:
+            out.pages.append(page_no)
+        out.items.extend(items)
+        out.evidence.extend(evidence)
+        summary_amounts.extend(amounts)
+        arithmetic_ok += ok
+
+    if len(out.items) < policy.min_items:
+        out.reason = "no item table"
+        return out
+    items_sum = round(sum(_money_value(it["item_total"]) or 0.0 for it in out.items), 2)
+    if any(abs(items_sum - a) <= 0.01 for a in summary_amounts):
+        out.confident, out.reason = True, "subtotal"
+    elif image_only:
+        # items on image-only pages are invisible here; only a matching subtotal proves the list complete
+        out.reason = "image-only pages"
+    else:
+        # rows that check out as quantity * unit price only prove themselves, not that the parser found them all
+        out.reason = f"items sum {items_sum:.2f} matches no printed total ({arithmetic_ok}/{len(out.items)} rows check out)"
+    return out
+
+
+def extract_line_items(
+    pdf: "PdfSource",
+    page_numbers: Optional[Sequence[int]] = None,
+    policy: LineItemPolicy = LINE_ITEM_POLICY,
+) -> LocalLineItems:
+    session = as_pdf_session(pdf)
+    pnos = list(page_numbers) if page_numbers is not None else list(range(1, session.page_count + 1))
+    with span("local_items"):
+        result = extract_line_items_from_words([(n, session.page_words(n)) for n in pnos], policy)
+    incr("local_item_tables", outcome="confident" if result.confident else "fallback")
+    return result
+
+
+class PdfDocumentSession:
+    # Decode and open a PDF once; text, words, tables, markdown and renders are cached per page.
+
+    def __init__(self, pdf_bytes: Optional[bytes] = None, *, path: Optional[Path] = None, name: str = "") -> None:
+        if pdf_bytes is None and path is None:
+            raise ValueError("PdfDocumentSession needs pdf_bytes or path")
+        self.pdf_bytes = pdf_bytes
+        self.path = Path(path) if path is not None else None
+        self.name = name
+        # PyMuPDF documents are not thread-safe; every access goes through this lock.
+        self._lock = threading.RLock()
+        self._doc: Optional[fitz.Document] = None
+        self._texts: Dict[int, str] = {}
+        self._words: Dict[int, List[Tuple[Any, ...]]] = {}
+        self._tables: Dict[int, List[List[List[Any]]]] = {}
+        self._renders: Dict[Tuple[int, int, bool, float, Optional[PrescanPolicy]], str] = {}
+        self.render_stats: Dict[int, RenderStats] = {}
+        self._blank: Dict[Tuple[int, BlankPagePolicy], Tuple[bool, Dict[str, float]]] = {}
+        self._fingerprints: Dict[Tuple[int, DedupPolicy], Optional[PageFingerprint]] = {}
+        self._markdown: Optional[str] = None
+
+    @classmethod
+    def from_b64(cls, pdf_b64: str, *, name: str = "") -> "PdfDocumentSession":
+        with span("b64_decode"):
+            return cls(base64.b64decode(pdf_b64), name=name)
+
+    @classmethod
+    def from_file(cls, path: Path, *, name: str = "") -> "PdfDocumentSession":
+        # MuPDF reads pages from the file on demand; the PDF is never held as a Python bytes object.
+        return cls(path=path, name=name or Path(path).name)
+
+    @property
+    def doc(self) -> fitz.Document:
+        with self._lock:
+            if self._doc is None:
+                with span("pdf_open"):
+                    if self.path is not None:
+                        self._doc = fitz.open(str(self.path), filetype="pdf")
+                    else:
+                        self._doc = fitz.open(stream=self.pdf_bytes, filetype="pdf")
+            return self._doc
+
+    @property
+    def page_count(self) -> int:
+        return self.doc.page_count
+
+    def page_size(self, page_no: int) -> Tuple[float, float]:
+        with self._lock:
+            r = self.doc.load_page(page_no - 1).rect
+        return r.width, r.height
+
+    def page_text(self, page_no: int) -> str:
+        with self._lock:
+            if page_no not in self._texts:
+                with span("get_text"):
+                    self._texts[page_no] = self.doc.load_page(page_no - 1).get_text("text") or ""
+            return self._texts[page_no]
+
+    def page_texts(self) -> List[str]:
+        return [self.page_text(n) for n in range(1, self.page_count + 1)]
+
+    def page_words(self, page_no: int) -> List[Tuple[Any, ...]]:
+        with self._lock:
+            if page_no not in self._words:
+                with span("get_text"):
+                    self._words[page_no] = list(self.doc.load_page(page_no - 1).get_text("words") or [])
+            return self._words[page_no]
+
+    def page_tables(self, page_no: int) -> List[List[List[Any]]]:
+        with self._lock:
+            if page_no not in self._tables:
+                tables: List[List[List[Any]]] = []
+                with span("find_tables"):
+                    try:
+                        for tab in self.doc.load_page(page_no - 1).find_tables().tables:
+                            tables.append(tab.extract())
+                    except Exception:
+                        pass
+                self._tables[page_no] = tables
+            return self._tables[page_no]
+
+    def blank_check(self, page_no: int, policy: Optional[BlankPagePolicy] = BLANK_PAGE_POLICY) -> Tuple[bool, Dict[str, float]]:
+        # pages with a text layer are never blank; only image-only pages pay for the pixel check
+        if policy is None or self.page_text(page_no).strip():
+            return False, {}
+        key = (page_no, policy)
+        with self._lock:
+            if key not in self._blank:
+                self._blank[key] = is_blank_page(self.doc.load_page(page_no - 1), policy)
+            return self._blank[key]
+
+    def fingerprint(self, page_no: int, policy: Optional[DedupPolicy] = DEDUP_POLICY) -> Optional[PageFingerprint]:
+        if policy is None:
+            return None
+        key = (page_no, policy)
+        with self._lock:
+            if key not in self._fingerprints:
+                page = self.doc.load_page(page_no - 1)
+                self._fingerprints[key] = page_fingerprint(page, policy, text=self.page_text(page_no))
+            return self._fingerprints[key]
+
+    def fingerprints(self, policy: Optional[DedupPolicy] = DEDUP_POLICY) -> List[Optional[PageFingerprint]]:
+        return [self.fingerprint(n, policy) for n in range(1, self.page_count + 1)]
+
+    def markdown(self) -> str:
+        with self._lock:
+            if self._markdown is None:
+                with span("markdown"):
+                    # optional dependency (pip install pdfvision[markdown]); without it, plain page text
+                    try:
+                        pymupdf4llm = importlib.import_module("pymupdf4llm")
+                    except ImportError:
+                        pymupdf4llm = None
+                    if pymupdf4llm is not None:
+                        try:
+                            self._markdown = pymupdf4llm.to_markdown(self.doc) or ""
+                        except Exception as e:
+                            logging.getLogger(__name__).warning(
+                                "pymupdf4llm could not convert %s (%s); using plain page text", self.name or "PDF", e
+                            )
+                    if self._markdown is None:
+                        self._markdown = "\n\n".join(
+                            f"=== PAGE {n} ===\n{t.strip()}" for n, t in enumerate(self.page_texts(), start=1)
+                        ).strip()
+            return self._markdown
+
+    def render_page_b64(
+        self,
+        page_no: int,
+        *,
+        dpi: int = 300,
+        clip_to_content: bool = True,
+        pad: float = 6.0,
+        prescan: Optional[PrescanPolicy] = PRESCAN_POLICY,
+    ) -> str:
+        key = (page_no, dpi, clip_to_content, pad, prescan)
+        with self._lock:
+            if key in self._renders:
+                incr("render_cache_hits")
+            else:
+                page = self.doc.load_page(page_no - 1)
+                self._renders[key], self.render_stats[page_no] = _render_page_png_b64_with_stats(
+                    page, dpi=dpi, clip_to_content=clip_to_content, pad=pad, prescan=prescan
+                )
+            return self._renders[key]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._doc is not None:
+                self._doc.close()
+                self._doc = None
+            self._renders.clear()
+
+    def __enter__(self) -> "PdfDocumentSession":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+PdfSource = Union[bytes, Path, PdfDocumentSession]
+
+
+def as_pdf_session(pdf: PdfSource) -> PdfDocumentSession:
+    if isinstance(pdf, PdfDocumentSession):
+        return pdf
+    if isinstance(pdf, Path):
+        return PdfDocumentSession.from_file(pdf)
+    return PdfDocumentSession(pdf)
+
+
+def rank_pdf_pages_for_invoice(
+    pdf: PdfSource,
+    *,
+    ocr_call: Optional[VisionCallable] = None,
+    ocr_dpi: int = 100,
+    blank_policy: Optional[BlankPagePolicy] = BLANK_PAGE_POLICY,
+) -> List[PageScore]:
+    session = as_pdf_session(pdf)
+    out: List[PageScore] = []
+
+    for page_no in range(1, session.page_count + 1):
+        text = session.page_text(page_no)
+
+        if text.strip():
+            score, signals = score_invoice_page_text(text, words=session.page_words(page_no))
+            out.append(PageScore(page_no, score, True, True, signals))
+            continue
+
+        if ocr_call is None:
+            out.append(PageScore(page_no, 0.0, False, False, {}))
+            continue
+
+        if session.blank_check(page_no, blank_policy)[0]:
+            incr("pages_skipped_blank")
+            out.append(PageScore(page_no, 0.0, False, True, {"blank": 1}))
+            continue
+
+        b64_png = session.render_page_b64(page_no, dpi=ocr_dpi, clip_to_content=True)
+        ocr_text = _vision_ocr_page_text(b64_png, vision_call=ocr_call)
+        score, signals = score_invoice_page_text(ocr_text)
+        out.append(PageScore(page_no, score, False, True, signals))
+
+    return out
+
+
+def select_top_pages(
+    scores: Sequence[PageScore],
+    top_k: int,
+    *,
+    min_score: Optional[float] = None,
+) -> List[int]:
+    # unscored pages (image-only, no OCR call) are unknown rather than zero: they take the first slots, in
+    # page order, and the remaining slots go to the best scored pages; never more than top_k pages
+    unscored = [s for s in scores if not s.scored][: max(top_k, 0)]
+    scored = [s for s in scores if s.scored]
+    candidates = [s for s in scored if min_score is None or s.score >= min_score]
+    if not candidates and not unscored:
+        candidates = scored
+    ranked = sorted(candidates, key=lambda s: (-s.score, s.page_no))[: max(top_k - len(unscored), 0)]
+    return sorted(s.page_no for s in unscored + ranked)
+
 
 def extract_pdf_text_and_fallback_images(
-    pdf_bytes: bytes,
+    pdf: PdfSource,
     *,
     dpi: int = 300,
     clip_to_content: bool = True,
     include_page_texts: bool = True,
+    blank_policy: Optional[BlankPagePolicy] = BLANK_PAGE_POLICY,
 ) -> PdfExtractResult:
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    session = as_pdf_session(pdf)
 
     page_texts: List[str] = []
     fallback_imgs: List[str] = []
     all_text_parts: List[str] = []
+    skipped: List[int] = []
 
-    for pno in range(doc.page_count):
-        page = doc.load_page(pno)
-
-        t = page.get_text("text") or ""
+    for page_no in range(1, session.page_count + 1):
+        t = session.page_text(page_no)
         t_stripped = t.strip()
 
         if include_page_texts:
@@ -579,8 +1634,11 @@ def extract_pdf_text_and_fallback_images(
 
         if t_stripped:
             all_text_parts.append(t)
+        elif session.blank_check(page_no, blank_policy)[0]:
+            incr("pages_skipped_blank")
+            skipped.append(page_no)
         else:
-            b64_png = _render_page_png_b64(page, dpi=dpi, clip_to_content=clip_to_content)
+            b64_png = session.render_page_b64(page_no, dpi=dpi, clip_to_content=clip_to_content)
             fallback_imgs.append(b64_png)
 
     full_text = "\n\n".join([p.strip() for p in all_text_parts if p and p.strip()]).strip()
@@ -589,6 +1647,7 @@ def extract_pdf_text_and_fallback_images(
         text=full_text,
         page_texts=page_texts if include_page_texts else [],
         fallback_page_images_b64=fallback_imgs,
+        skipped_blank_pages=skipped,
     )
 
 
@@ -598,9 +1657,8 @@ def extract_pdf_from_b64_and_fallback_images(
     dpi: int = 300,
     clip_to_content: bool = True,
 ) -> PdfExtractResult:
-    pdf_bytes = base64.b64decode(pdf_b64)
     return extract_pdf_text_and_fallback_images(
-        pdf_bytes,
+        PdfDocumentSession.from_b64(pdf_b64),
         dpi=dpi,
         clip_to_content=clip_to_content,
         include_page_texts=True,
@@ -608,19 +1666,20 @@ def extract_pdf_from_b64_and_fallback_images(
 
 
 def render_all_pdf_pages_as_images_b64(
-    pdf_bytes: bytes,
+    pdf: PdfSource,
     *,
     dpi: int = 300,
     clip_to_content: bool = True,
     max_pages: Optional[int] = None,
+    page_numbers: Optional[Sequence[int]] = None,
 ) -> List[str]:
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    session = as_pdf_session(pdf)
+    pnos = range(1, session.page_count + 1) if page_numbers is None else page_numbers
     out: List[str] = []
-    for pno in range(doc.page_count):
+    for page_no in pnos:
         if max_pages is not None and len(out) >= max_pages:
             break
-        page = doc.load_page(pno)
-        out.append(_render_page_png_b64(page, dpi=dpi, clip_to_content=clip_to_content))
+        out.append(session.render_page_b64(page_no, dpi=dpi, clip_to_content=clip_to_content))
     return out
 
 
@@ -644,7 +1703,7 @@ def vision_transcribe_pages(
                 ],
             }
         ]
-        out.append(vision_call(messages) or "")
+        out.append(_call_vision(vision_call, messages, stage="ocr"))
 
     return "\n\n".join([t.strip() for t in out if t and t.strip()]).strip()
 
@@ -774,8 +1833,14 @@ def _extract_first_json_obj(text: str) -> Optional[Dict[str, Any]]:
 
     return None
 
-def _build_pages_user_content(page_images_b64: List[str], *, max_pages: Optional[int]) -> List[Dict[str, Any]]:
+def _build_pages_user_content(
+    page_images_b64: List[str],
+    *,
+    max_pages: Optional[int],
+    page_numbers: Optional[Sequence[int]] = None,
+) -> List[Dict[str, Any]]:
     imgs = page_images_b64 if max_pages is None else page_images_b64[:max_pages]
+    page_nos = list(page_numbers) if page_numbers is not None else list(range(1, len(imgs) + 1))
     content: List[Dict[str, Any]] = []
 
     content.append(
@@ -789,7 +1854,7 @@ def _build_pages_user_content(page_images_b64: List[str], *, max_pages: Optional
         }
     )
 
-    for idx, b64_png in enumerate(imgs, start=1):
+    for idx, b64_png in zip(page_nos, imgs):
         content.append({"type": "text", "text": f"PAGE {idx}:"})
         content.append({"type": "image_url", "image_url": {"url": _to_data_url_png(b64_png)}})
 
@@ -882,6 +1947,106 @@ def _merge_evidence_dicts(evidences: List[Dict[str, Any]]) -> Dict[str, Any]:
 
     return out
 
+def _item_key(it: Dict[str, str]) -> Tuple[str, str]:
+    return _norm_key(it.get("item_description", "")), _norm_money(it.get("item_total", ""))
+
+def _merge_extraction_evidence(
+    pairs: Sequence[Tuple[Dict[str, Any], Dict[str, Any]]],
+    merged_items: Sequence[Dict[str, str]],
+) -> Dict[str, Any]:
+    # Item evidence is a dict keyed by description (verify pass) or a list index-aligned with that
+    # result's items (single-call local checks); list evidence is re-aligned with the merged item list
+    # by (description, total), the key _merge_invoice_items deduplicates on.
+    evidences: List[Dict[str, Any]] = []
+    by_item: Dict[Tuple[str, str], Any] = {}
+    for obj, ev in pairs:
+        items_ev = ev.get("invoice_items")
+        if isinstance(items_ev, list):
+            ev = {k: v for k, v in ev.items() if k != "invoice_items"}
+            for it, item_ev in zip(obj.get("invoice_items") or [], items_ev):
+                by_item.setdefault(_item_key(it), item_ev)
+        evidences.append(ev)
+    out = _merge_evidence_dicts(evidences)
+    if by_item:
+        out["invoice_items"] = [by_item.get(_item_key(it)) for it in merged_items]
+    return out
+
+_MONEY_FIELDS = ("gross_invoice_amount", "invoice_tax", "invoice_freight")
+
+
+def _squash(s: str) -> str:
+    return " ".join((s or "").split())
+
+
+def _evidence_supports(
+    key: str,
+    value: str,
+    ev: Any,
+    page_texts: Optional[Dict[int, str]],
+    valid_pages: Sequence[int],
+) -> bool:
+    if not isinstance(ev, dict):
+        return False
+    snippet = _squash(str(ev.get("evidence") or ""))
+    try:
+        page_no = int(str(ev.get("page") or "").strip())
+    except ValueError:
+        return False
+    if not snippet or page_no not in valid_pages:
+        return False
+    if page_texts is not None and snippet not in _squash(page_texts.get(page_no, "")):
+        return False
+    if key in _MONEY_FIELDS or key == "item_total":
+        return _norm_money(value) in _norm_money(snippet)
+    if key == "invoice_description":
+        return any(w.lower() in snippet.lower() for w in re.findall(r"[A-Za-z]{4,}", value))
+    return _squash(value).lower() in snippet.lower()
+
+
+def _check_evidence_locally(
+    norm: Dict[str, Any],
+    evidence: Optional[Dict[str, Any]],
+    *,
+    page_texts: Optional[Dict[int, str]] = None,
+    valid_pages: Sequence[int],
+) -> Tuple[Dict[str, Any], Dict[str, Any], List[str]]:
+    # The verifier's exact-substring and page rules, applied without a model call. With page_texts
+    # (OCR or text layer) the snippet must occur verbatim on its page; for image-only input only the
+    # page number and value-in-snippet checks apply.
+    evidence = dict(evidence or {})
+    blanked: List[str] = []
+    for key in INVOICE_KEYS:
+        if key in ("invoice_items", "po_line_number", "po_line_amount") or not norm.get(key):
+            continue
+        if _evidence_supports(key, norm[key], evidence.get(key), page_texts, valid_pages):
+            incr("local_checks", field=key, outcome="kept")
+            continue
+        incr("local_checks", field=key, outcome="blanked")
+        norm[key] = ""
+        evidence.pop(key, None)
+        blanked.append(key)
+
+    item_evs = evidence.get("invoice_items")
+    item_evs = item_evs if isinstance(item_evs, list) else []
+    kept_items: List[Dict[str, str]] = []
+    kept_evs: List[Any] = []
+    for i, it in enumerate(norm.get("invoice_items") or []):
+        ev = item_evs[i] if i < len(item_evs) else None
+        if _evidence_supports("item_total", it.get("item_total", ""), ev, page_texts, valid_pages):
+            incr("local_checks", field="invoice_items", outcome="kept")
+            kept_items.append(it)
+            kept_evs.append(ev)
+        else:
+            incr("local_checks", field="invoice_items", outcome="blanked")
+            blanked.append(f"invoice_items[{i}]")
+    norm["invoice_items"] = kept_items
+    if kept_evs:
+        evidence["invoice_items"] = kept_evs
+    else:
+        evidence.pop("invoice_items", None)
+    return norm, evidence, blanked
+
+
 def _build_single_page_user_content(page_b64: str, page_no_1based: int) -> List[Dict[str, Any]]:
     return [
         {
@@ -900,18 +2065,20 @@ def _extract_one_page_obj(
     *,
     vision_call: VisionCallable,
     page_no_1based: int,
+    single_call: bool = False,
     debug_dir: Optional[Path] = None,
 ) -> Optional[Dict[str, Any]]:
     messages = [
-        {"role": "system", "content": INVOICE_EXTRACT_SYSTEM_PROMPT},
+        {"role": "system", "content": INVOICE_EXTRACT_WITH_EVIDENCE_SYSTEM_PROMPT if single_call else INVOICE_EXTRACT_SYSTEM_PROMPT},
         {"role": "user", "content": _build_single_page_user_content(page_b64, page_no_1based)},
     ]
-    raw = (vision_call(messages) or "").strip()
+    raw = _call_vision(vision_call, messages, stage="extract")
 
     if debug_dir:
         (debug_dir / f"raw_extract_p{page_no_1based}.txt").write_text(raw, encoding="utf-8")
 
-    obj = _extract_first_json_obj(raw)
+    with span("parse"):
+        obj = _extract_first_json_obj(raw)
     if debug_dir:
         (debug_dir / f"parsed_extract_p{page_no_1based}.json").write_text(
             json.dumps(obj, ensure_ascii=False, indent=2) if obj else "null",
@@ -944,12 +2111,13 @@ def _verify_one_page_obj(
             ],
         },
     ]
-    raw = (vision_call(messages) or "").strip()
+    raw = _call_vision(vision_call, messages, stage="verify")
 
     if debug_dir:
         (debug_dir / f"raw_verify_p{page_no_1based}.txt").write_text(raw, encoding="utf-8")
 
-    obj2 = _extract_first_json_obj(raw)
+    with span("parse"):
+        obj2 = _extract_first_json_obj(raw)
     if debug_dir:
         (debug_dir / f"parsed_verify_p{page_no_1based}.json").write_text(
             json.dumps(obj2, ensure_ascii=False, indent=2) if obj2 else "null",
@@ -963,6 +2131,48 @@ def _verify_one_page_obj(
     evidence2 = _pop_evidence(norm2)
     return norm2, evidence2
 
+def _extract_and_verify_one_page(
+    page_b64: str,
+    *,
+    vision_call: VisionCallable,
+    page_no_1based: int,
+    verify: bool,
+    single_call: bool = False,
+    debug_dir: Optional[Path] = None,
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], PageRunStats]:
+    stats = PageRunStats(page_no=page_no_1based)
+    t0 = time.perf_counter()
+
+    obj = _extract_one_page_obj(
+        page_b64, vision_call=vision_call, page_no_1based=page_no_1based, single_call=single_call, debug_dir=debug_dir
+    )
+    t1 = time.perf_counter()
+    stats.extract_seconds = t1 - t0
+
+    ev: Optional[Dict[str, Any]] = None
+    if obj is not None and single_call:
+        with span("local_check"):
+            obj, ev, stats.locally_blanked = _check_evidence_locally(
+                obj, _pop_evidence(obj), valid_pages=[page_no_1based]
+            )
+    elif obj is not None and verify:
+        obj, ev = _verify_one_page_obj(
+            page_b64,
+            vision_call=vision_call,
+            page_no_1based=page_no_1based,
+            candidate=obj,
+            debug_dir=debug_dir,
+        )
+        stats.verify_seconds = time.perf_counter() - t1
+
+    stats.extracted = obj is not None
+    stats.total_seconds = time.perf_counter() - t0
+    return obj, ev, stats
+
+def _header_complete(obj: Dict[str, Any], fields: Sequence[str]) -> bool:
+    return all((obj.get(k) or "").strip() for k in fields)
+
+@_instrumented_extraction
 def extract_invoice_json_from_pages_one_image_per_request(
     page_images_b64: List[str],
     *,
@@ -970,46 +2180,146 @@ def extract_invoice_json_from_pages_one_image_per_request(
     verify: bool = True,
     return_evidence: bool = False,
     max_pages: Optional[int] = None,
+    page_numbers: Optional[Sequence[int]] = None,
+    max_workers: int = 1,
+    early_stop: Optional[EarlyStopPolicy] = None,
+    page_scores: Optional[Sequence[PageScore]] = None,
+    blank_policy: Optional[BlankPagePolicy] = BLANK_PAGE_POLICY,
+    dedup_policy: Optional[DedupPolicy] = DEDUP_POLICY,
+    single_call: bool = False,
     debug_dir: Optional[Path] = None,
-) -> Tuple[str, Optional[Dict[str, Any]]]:
+    instrumentation: Optional[Instrumentation] = None,
+) -> InvoiceExtraction:
     extracted_objs: List[Dict[str, Any]] = []
-    evidences: List[Dict[str, Any]] = []
+    evidences: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
 
     if max_pages is not None:
         page_images_b64 = page_images_b64[:max_pages]
-
-    for idx, page_b64 in enumerate(page_images_b64, start=1):
-        obj = _extract_one_page_obj(
-            page_b64, vision_call=vision_call, page_no_1based=idx, debug_dir=debug_dir
+    page_nos = list(page_numbers) if page_numbers is not None else list(range(1, len(page_images_b64) + 1))
+    page_images_b64, page_nos, skipped_blank = _drop_blank_images(page_images_b64, page_nos, blank_policy)
+    page_images_b64, page_nos, deduplicated = _drop_duplicate_images(page_images_b64, page_nos, dedup_policy)
+    pending = list(zip(page_nos, page_images_b64))
+    score_by_page = {s.page_no: s for s in (page_scores or [])}
+
+    def run_page(idx: int, page_b64: str):
+        return _extract_and_verify_one_page(
+            page_b64,
+            vision_call=vision_call,
+            page_no_1based=idx,
+            verify=verify,
+            single_call=single_call,
+            debug_dir=debug_dir,
         )
+
+    def looks_like_non_invoice(idx: int) -> bool:
+        ps = score_by_page.get(idx)
+        if early_stop is None or early_stop.min_page_score is None or ps is None or not ps.scored:
+            return False
+        return ps.score < early_stop.min_page_score
+
+    # Without an early-stop policy every page is dispatched at once; with one, pages go out in
+    # waves of max_workers so the policy can be checked between waves.
+    wave_size = max(max_workers, 1) if early_stop is not None else max(len(pending), 1)
+    workers = min(max(max_workers, 1), max(len(pending), 1))
+
+    page_results: List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], PageRunStats]] = []
+    running = _blank_invoice_obj()
+    unproductive = 0
+    remaining: List[Tuple[int, str, str]] = []
+    pos = 0
+
+    with span("pages"), ThreadPoolExecutor(max_workers=workers) as pool:
+        while pos < len(pending):
+            header_done = early_stop is not None and _header_complete(running, early_stop.header_fields)
+            if header_done and unproductive >= early_stop.unproductive_pages:
+                note = f"header complete and {unproductive} page(s) without new line items"
+                remaining.extend((idx, page_b64, note) for idx, page_b64 in pending[pos:])
+                break
+
+            wave: List[Tuple[int, str]] = []
+            while pos < len(pending) and len(wave) < wave_size:
+                idx, page_b64 = pending[pos]
+                pos += 1
+                if header_done and looks_like_non_invoice(idx):
+                    remaining.append((idx, page_b64, "ranked as non-invoice page"))
+                    continue
+                wave.append((idx, page_b64))
+
+            if not wave:
+                continue
+            if workers > 1 and len(wave) > 1:
+                wave_results = list(pool.map(run_in_current_context(run_page), *zip(*wave)))
+            else:
+                wave_results = [run_page(idx, page_b64) for idx, page_b64 in wave]
+
+            for obj, ev, stats in wave_results:
+                page_results.append((obj, ev, stats))
+                if early_stop is None:
+                    continue
+                was_complete = _header_complete(running, early_stop.header_fields)
+                before = len(running["invoice_items"])
+                if obj is not None:
+                    running = _merge_invoice_objects([running, obj])
+                stats.new_items = len(running["invoice_items"]) - before
+                if was_complete and stats.new_items == 0:
+                    unproductive += 1
+                elif stats.new_items:
+                    unproductive = 0
+
+        # pages left after an early stop are transcribed in the same pool when remaining_pages="ocr"
+        ocr_results: Dict[int, Tuple[str, float]] = {}
+        if remaining and early_stop is not None and early_stop.remaining_pages == "ocr":
+            def ocr_page(idx: int, page_b64: str) -> Tuple[int, Tuple[str, float]]:
+                t0 = time.perf_counter()
+                text = _vision_ocr_page_text(page_b64, vision_call=vision_call)
+                return idx, (text, time.perf_counter() - t0)
+
+            ocr_results = dict(pool.map(run_in_current_context(ocr_page), *zip(*[(i, b) for i, b, _ in remaining])))
+
+    for idx in skipped_blank:
+        page_results.append((None, None, PageRunStats(page_no=idx, action="skipped", note="blank page")))
+    # a duplicate page's result is its original's, which is already in the merge
+    for idx, original in deduplicated.items():
+        page_results.append((None, None, PageRunStats(page_no=idx, action="deduplicated", note=f"duplicate of page {original}")))
+    if skipped_blank or deduplicated:
+        page_results.sort(key=lambda r: r[2].page_no)
+
+    if remaining:
+        for idx, page_b64, note in sorted(remaining):
+            stats = PageRunStats(page_no=idx, action="skipped", note=note)
+            if idx in ocr_results:
+                stats.action = "ocr_only"
+                stats.ocr_text, stats.total_seconds = ocr_results[idx]
+            page_results.append((None, None, stats))
+        page_results.sort(key=lambda r: r[2].page_no)
+
+    for obj, ev, stats in page_results:
         if obj is None:
             continue
-
-        if verify:
-            obj, ev = _verify_one_page_obj(
-                page_b64,
-                vision_call=vision_call,
-                page_no_1based=idx,
-                candidate=obj,
-                debug_dir=debug_dir,
-            )
-            if return_evidence and isinstance(ev, dict):
-                evidences.append(ev)
-
+        if return_evidence and isinstance(ev, dict):
+            evidences.append((obj, ev))
         extracted_objs.append(obj)
 
+    page_kwargs = {
+        "page_numbers": [idx for idx, _ in pending],
+        "page_scores": list(page_scores or []),
+        "page_stats": [stats for _, _, stats in page_results],
+        "skipped_pages": skipped_blank,
+        "deduplicated_pages": deduplicated,
+        "cache_hits": len(deduplicated),
+        "locally_blanked": [f for _, _, stats in page_results for f in stats.locally_blanked],
+        "ocr_only_texts": {idx: text for idx, (text, _) in sorted(ocr_results.items())},
+    }
     if not extracted_objs:
-        blank = _blank_invoice_obj()
-        merged_json = "```json\n" + json.dumps(blank, ensure_ascii=False, indent=2) + "\n```"
-        return merged_json, None
+        return InvoiceExtraction.from_invoice_obj(None, **page_kwargs)
 
-    merged = _merge_invoice_objects(extracted_objs)
-    merged_json = "```json\n" + json.dumps(merged, ensure_ascii=False, indent=2) + "\n```"
-
-    merged_evidence = _merge_evidence_dicts(evidences) if (return_evidence and evidences) else None
-    return merged_json, merged_evidence
+    with span("merge"):
+        merged = _merge_invoice_objects(extracted_objs)
+        merged_evidence = _merge_extraction_evidence(evidences, merged["invoice_items"]) if (return_evidence and evidences) else None
+    return InvoiceExtraction.from_invoice_obj(merged, evidence=merged_evidence, **page_kwargs)
 
 
+@_instrumented_extraction
 def vision_extract_invoice_json_from_pages(
     page_images_b64: List[str],
     *,
@@ -1017,64 +2327,243 @@ def vision_extract_invoice_json_from_pages(
     max_pages: Optional[int] = None,
     verify: bool = True,
     return_evidence: bool = False,
-    debug_dir: Optional[Path] = None
-) -> Tuple[str, Optional[Dict[str, Any]]]:
+    page_numbers: Optional[Sequence[int]] = None,
+    blank_policy: Optional[BlankPagePolicy] = BLANK_PAGE_POLICY,
+    dedup_policy: Optional[DedupPolicy] = DEDUP_POLICY,
+    single_call: bool = False,
+    debug_dir: Optional[Path] = None,
+    instrumentation: Optional[Instrumentation] = None,
+) -> InvoiceExtraction:
+    page_nos = list(page_numbers or range(1, len(page_images_b64) + 1))[: len(page_images_b64)]
+    page_images_b64, page_numbers, skipped_blank = _drop_blank_images(page_images_b64, page_nos, blank_policy)
+    page_images_b64, page_numbers, deduplicated = _drop_duplicate_images(page_images_b64, page_numbers, dedup_policy)
+    dedup_kwargs = {"deduplicated_pages": deduplicated, "cache_hits": len(deduplicated)}
     if not page_images_b64:
-        blank = _blank_invoice_obj()
-        out = "```json\n" + json.dumps(blank, ensure_ascii=False, indent=2) + "\n```"
-        return out, None
+        return InvoiceExtraction.from_invoice_obj(None, skipped_pages=skipped_blank, **dedup_kwargs)
 
+    page_kwargs = {"page_numbers": list(page_numbers)[:max_pages], "skipped_pages": skipped_blank, **dedup_kwargs}
     messages_extract: List[Dict[str, Any]] = [
-        {"role": "system", "content": INVOICE_EXTRACT_SYSTEM_PROMPT},
-        {"role": "user", "content": _build_pages_user_content(page_images_b64, max_pages=max_pages)},
+        {"role": "system", "content": INVOICE_EXTRACT_WITH_EVIDENCE_SYSTEM_PROMPT if single_call else INVOICE_EXTRACT_SYSTEM_PROMPT},
+        {"role": "user", "content": _build_pages_user_content(page_images_b64, max_pages=max_pages, page_numbers=page_numbers)},
     ]
-    raw_extract = (vision_call(messages_extract) or "").strip()
+    raw_extract = _call_vision(vision_call, messages_extract, stage="extract")
     if debug_dir:
         (debug_dir / "raw_extract.txt").write_text(raw_extract, encoding="utf-8")
 
-    obj = _extract_first_json_obj(raw_extract)
+    with span("parse"):
+        obj = _extract_first_json_obj(raw_extract)
     if obj is None:
-        blank = _blank_invoice_obj()
-        out = "```json\n" + json.dumps(blank, ensure_ascii=False, indent=2) + "\n```"
-        return out, None
+        return InvoiceExtraction.from_invoice_obj(None, **page_kwargs)
 
     norm = _normalize_invoice_obj(obj)
 
+    if single_call:
+        valid_pages = list(page_kwargs["page_numbers"])
+        with span("local_check"):
+            # positional page numbers ("1" for the first image sent) are mapped back before the page check
+            norm, evidence, blanked = _check_evidence_locally(
+                norm, _remap_evidence_pages(_pop_evidence(norm), valid_pages), valid_pages=valid_pages
+            )
+        return InvoiceExtraction.from_invoice_obj(
+            norm, evidence=evidence if return_evidence else None, locally_blanked=blanked, **page_kwargs
+        )
+
     if not verify:
         evidence = _pop_evidence(norm)
-        out = "```json\n" + json.dumps(norm, ensure_ascii=False, indent=2) + "\n```"
-        return out, evidence if return_evidence else None
+        return InvoiceExtraction.from_invoice_obj(norm, evidence=evidence if return_evidence else None, **page_kwargs)
 
     candidate_json = json.dumps(norm, ensure_ascii=False, indent=2)
     messages_verify: List[Dict[str, Any]] = [
         {"role": "system", "content": INVOICE_VERIFY_SYSTEM_PROMPT},
         {
             "role": "user",
-            "content": _build_pages_user_content(page_images_b64, max_pages=max_pages)
+            "content": _build_pages_user_content(page_images_b64, max_pages=max_pages, page_numbers=page_numbers)
             + [
                 {"type": "text", "text": "CANDIDATE JSON (to verify and correct):"},
                 {"type": "text", "text": candidate_json},
             ],
         },
     ]
-    raw_verify = (vision_call(messages_verify) or "").strip()
+    raw_verify = _call_vision(vision_call, messages_verify, stage="verify")
     if debug_dir:
         (debug_dir / "raw_verify.txt").write_text(raw_verify, encoding="utf-8")
 
-    obj2 = _extract_first_json_obj(raw_verify)
+    with span("parse"):
+        obj2 = _extract_first_json_obj(raw_verify)
     if obj2 is None:
         evidence = _pop_evidence(norm)
-        out = "```json\n" + json.dumps(norm, ensure_ascii=False, indent=2) + "\n```"
-        return out, evidence if return_evidence else None
+        return InvoiceExtraction.from_invoice_obj(norm, evidence=evidence if return_evidence else None, **page_kwargs)
 
     norm2 = _normalize_invoice_obj(obj2)
     evidence2 = _pop_evidence(norm2)
 
-    out = "```json\n" + json.dumps(norm2, ensure_ascii=False, indent=2) + "\n```"
-    return out, evidence2 if return_evidence else None
+    return InvoiceExtraction.from_invoice_obj(norm2, evidence=evidence2 if return_evidence else None, **page_kwargs)
+
+@dataclass(frozen=True)
+class PageGroupingPolicy:
+    # most page images one request may carry
+    max_images: int = 4
+    # most base64 image bytes one request may carry; a single larger page still goes alone
+    max_payload_bytes: int = 8_000_000
+    # groups in flight at once
+    max_workers: int = 4
+
+
+PAGE_GROUPING_POLICY = PageGroupingPolicy()
+
+
+def plan_page_groups(
+    page_images_b64: Sequence[str],
+    page_nos: Sequence[int],
+    policy: PageGroupingPolicy = PAGE_GROUPING_POLICY,
+) -> List[List[int]]:
+    # Consecutive pages are packed greedily, so a table running across a page break stays in one
+    # request whenever the budget allows; the result holds indexes into page_images_b64.
+    groups: List[List[int]] = []
+    current: List[int] = []
+    current_bytes = 0
+    for i, b64_png in enumerate(page_images_b64[: len(page_nos)]):
+        size = len(b64_png)
+        if current and (len(current) >= policy.max_images or current_bytes + size > policy.max_payload_bytes):
+            groups.append(current)
+            current, current_bytes = [], 0
+        current.append(i)
+        current_bytes += size
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _remap_evidence_pages(evidence: Optional[Dict[str, Any]], page_nos: Sequence[int]) -> Optional[Dict[str, Any]]:
+    # Inside a group the model sometimes numbers pages by their position in the request ("1", "2")
+    # instead of the labels it was given; positions are mapped back to the document's page numbers.
+    if not isinstance(evidence, dict):
+        return evidence
+
+    def remap(ev: Any) -> Any:
+        if not isinstance(ev, dict):
+            return ev
+        try:
+            page = int(str(ev.get("page") or "").strip())
+        except ValueError:
+            return ev
+        if page in page_nos or not 1 <= page <= len(page_nos):
+            return ev
+        incr("evidence_pages_remapped")
+        return {**ev, "page": str(page_nos[page - 1])}
 
+    out: Dict[str, Any] = {}
+    for k, v in evidence.items():
+        if k == "invoice_items" and isinstance(v, list):
+            out[k] = [remap(ev) for ev in v]
+        elif k == "invoice_items" and isinstance(v, dict):
+            out[k] = {desc: remap(ev) for desc, ev in v.items()}
+        else:
+            out[k] = remap(v)
+    return out
+
+
+@_instrumented_extraction
+def extract_invoice_json_from_pages_grouped(
+    page_images_b64: List[str],
+    *,
+    vision_call: VisionCallable,
+    grouping: PageGroupingPolicy = PAGE_GROUPING_POLICY,
+    verify: bool = True,
+    return_evidence: bool = False,
+    max_pages: Optional[int] = None,
+    page_numbers: Optional[Sequence[int]] = None,
+    blank_policy: Optional[BlankPagePolicy] = BLANK_PAGE_POLICY,
+    dedup_policy: Optional[DedupPolicy] = DEDUP_POLICY,
+    single_call: bool = False,
+    debug_dir: Optional[Path] = None,
+    instrumentation: Optional[Instrumentation] = None,
+) -> InvoiceExtraction:
+    # Between one giant request (vision_extract_invoice_json_from_pages) and one request per page
+    # (extract_invoice_json_from_pages_one_image_per_request): pages are packed into requests under
+    # the grouping budget, the groups run concurrently and their results are merged.
+    if max_pages is not None:
+        page_images_b64 = page_images_b64[:max_pages]
+    page_nos = list(page_numbers) if page_numbers is not None else list(range(1, len(page_images_b64) + 1))
+    page_images_b64, page_nos, skipped_blank = _drop_blank_images(page_images_b64, page_nos, blank_policy)
+    page_images_b64, page_nos, deduplicated = _drop_duplicate_images(page_images_b64, page_nos, dedup_policy)
+    groups = [[page_nos[i] for i in g] for g in plan_page_groups(page_images_b64, page_nos, grouping)]
+    img_by_page = dict(zip(page_nos, page_images_b64))
+    incr("page_groups", value=len(groups))
+
+    def run_group(group_no: int, group: List[int]) -> Tuple[InvoiceExtraction, float]:
+        group_dir = None
+        if debug_dir:
+            group_dir = debug_dir / f"group_{group_no:02d}"
+            group_dir.mkdir(parents=True, exist_ok=True)
+        t0 = time.perf_counter()
+        res = vision_extract_invoice_json_from_pages(
+            [img_by_page[n] for n in group],
+            vision_call=vision_call,
+            verify=verify,
+            return_evidence=return_evidence,
+            page_numbers=group,
+            blank_policy=None,
+            dedup_policy=None,
+            single_call=single_call,
+            debug_dir=group_dir,
+        )
+        return res, time.perf_counter() - t0
+
+    workers = min(max(grouping.max_workers, 1), max(len(groups), 1))
+    with span("pages"):
+        if workers > 1 and len(groups) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                group_results = list(pool.map(run_in_current_context(run_group), range(1, len(groups) + 1), groups))
+        else:
+            group_results = [run_group(i, g) for i, g in enumerate(groups, start=1)]
+
+    extracted_objs: List[Dict[str, Any]] = []
+    evidences: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+    page_stats: List[PageRunStats] = []
+    locally_blanked: List[str] = []
+    for group_no, (group, (res, seconds)) in enumerate(zip(groups, group_results), start=1):
+        obj = res.invoice_dict()
+        extracted = any(v for k, v in obj.items() if k not in ("po_line_number", "po_line_amount"))
+        for n in group:
+            page_stats.append(PageRunStats(
+                page_no=n, extracted=extracted, total_seconds=seconds, note=f"group {group_no}/{len(groups)} pages {group}"
+            ))
+        locally_blanked.extend(res.locally_blanked)
+        if not extracted:
+            continue
+        extracted_objs.append(obj)
+        evidence = _remap_evidence_pages(res.evidence, group)
+        if return_evidence and isinstance(evidence, dict):
+            evidences.append((obj, evidence))
+
+    for idx in skipped_blank:
+        page_stats.append(PageRunStats(page_no=idx, action="skipped", note="blank page"))
+    for idx, original in deduplicated.items():
+        page_stats.append(PageRunStats(page_no=idx, action="deduplicated", note=f"duplicate of page {original}"))
+    page_stats.sort(key=lambda s: s.page_no)
+
+    page_kwargs = {
+        "page_numbers": page_nos,
+        "page_stats": page_stats,
+        "skipped_pages": skipped_blank,
+        "deduplicated_pages": deduplicated,
+        "cache_hits": len(deduplicated),
+        "locally_blanked": locally_blanked,
+    }
+    if debug_dir:
+        (debug_dir / "page_groups.json").write_text(json.dumps(groups), encoding="utf-8")
+    if not extracted_objs:
+        return InvoiceExtraction.from_invoice_obj(None, **page_kwargs)
+
+    with span("merge"):
+        merged = _merge_invoice_objects(extracted_objs)
+        merged_evidence = _merge_extraction_evidence(evidences, merged["invoice_items"]) if (return_evidence and evidences) else None
+    return InvoiceExtraction.from_invoice_obj(merged, evidence=merged_evidence, **page_kwargs)
+
+@_instrumented_extraction
 def extract_invoice_json_from_pdf_bytes_option_c(
-    pdf_bytes: bytes,
+    pdf: PdfSource,
     *,
     vision_call: VisionCallable,
     dpi: int = 300,
@@ -1082,15 +2571,100 @@ def extract_invoice_json_from_pdf_bytes_option_c(
     verify: bool = True,
     return_evidence: bool = False,
     max_pages: Optional[int] = None,
+    top_k_pages: Optional[int] = None,
+    rank_ocr_call: Optional[VisionCallable] = None,
+    blank_policy: Optional[BlankPagePolicy] = BLANK_PAGE_POLICY,
+    dedup_policy: Optional[DedupPolicy] = DEDUP_POLICY,
+    line_item_policy: Optional[LineItemPolicy] = LINE_ITEM_POLICY,
+    single_call: bool = False,
     debug_dir: Optional[Path] = None,
-) -> Tuple[str, Optional[Dict[str, Any]]]:
-    page_imgs = render_all_pdf_pages_as_images_b64(
-        pdf_bytes, dpi=dpi, clip_to_content=clip_to_content, max_pages=max_pages
-    )
+    instrumentation: Optional[Instrumentation] = None,
+) -> InvoiceExtraction:
+    session = as_pdf_session(pdf)
+    page_numbers: Optional[List[int]] = None
+    scores: List[PageScore] = []
+    if top_k_pages is not None:
+        with span("rank"):
+            scores = rank_pdf_pages_for_invoice(session, ocr_call=rank_ocr_call, blank_policy=blank_policy)
+        page_numbers = select_top_pages(scores, top_k_pages)
+        if debug_dir:
+            (debug_dir / "page_ranking.json").write_text(
+                json.dumps([asdict(s) for s in scores], ensure_ascii=False, indent=2),
+                encoding="utf-8",
+            )
+
+    # blank pages are dropped before rendering; the kept pages keep their original numbers
+    skipped_blank: List[int] = []
+    if blank_policy is not None:
+        candidates = page_numbers if page_numbers is not None else list(range(1, session.page_count + 1))
+        page_numbers = []
+        for page_no in candidates:
+            if session.blank_check(page_no, blank_policy)[0]:
+                incr("pages_skipped_blank")
+                skipped_blank.append(page_no)
+            else:
+                page_numbers.append(page_no)
+
+    # repeated copies of a page are dropped too; their OCR text would only repeat the original's
+    deduplicated: Dict[int, int] = {}
+    if dedup_policy is not None and np is not None:
+        candidates = page_numbers if page_numbers is not None else list(range(1, session.page_count + 1))
+        deduplicated = find_duplicate_pages([(n, session.fingerprint(n, dedup_policy)) for n in candidates], dedup_policy)
+        page_numbers = [n for n in candidates if n not in deduplicated]
+
+    with span("render_pages"):
+        page_imgs = render_all_pdf_pages_as_images_b64(
+            session,
+            dpi=dpi,
+            clip_to_content=clip_to_content,
+            max_pages=max_pages,
+            page_numbers=page_numbers,
+        )
+    page_nos = page_numbers if page_numbers is not None else list(range(1, len(page_imgs) + 1))
+    rendered_nos = list(page_nos[: len(page_imgs)])
+    page_kwargs = {
+        "page_numbers": rendered_nos,
+        "page_scores": scores,
+        "skipped_pages": skipped_blank,
+        "deduplicated_pages": deduplicated,
+        "cache_hits": len(deduplicated),
+        "render_stats": [session.render_stats[n] for n in rendered_nos if n in session.render_stats],
+    }
+    if debug_dir:
+        (debug_dir / "render_stats.json").write_text(
+            json.dumps([asdict(r) for r in page_kwargs["render_stats"]], ensure_ascii=False, indent=2),
+            encoding="utf-8",
+        )
+    if not page_imgs:
+        return InvoiceExtraction.from_invoice_obj(None, **page_kwargs)
+
+    # Born-digital item tables are read from the text layer; the model then only returns the header,
+    # which keeps long item lists from running into its output-token limit.
+    local_items: Optional[LocalLineItems] = None
+    if line_item_policy is not None:
+        local_items = extract_line_items(session, rendered_nos, line_item_policy)
+        if debug_dir:
+            (debug_dir / "local_items.json").write_text(
+                json.dumps(asdict(local_items), ensure_ascii=False, indent=2),
+                encoding="utf-8",
+            )
+        if local_items.confident:
+            page_kwargs["items_source"] = "text_layer"
+        else:
+            local_items = None
+
+    def with_local_items(obj: Dict[str, Any], evidence: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if local_items is not None:
+            obj["invoice_items"] = [dict(it) for it in local_items.items]
+            if evidence is not None:
+                evidence["invoice_items"] = list(local_items.evidence)
+        return obj
 
     page_texts: List[str] = []
-    for i, img_b64 in enumerate(page_imgs, start=1):
+    ocr_by_page: Dict[int, str] = {}
+    for i, img_b64 in zip(page_nos, page_imgs):
         t = _vision_ocr_page_text(img_b64, vision_call=vision_call)
+        ocr_by_page[i] = t
         page_texts.append(f"=== PAGE {i} ===\n{t}")
         if debug_dir:
             (debug_dir / f"ocr_p{i}.txt").write_text(t, encoding="utf-8")
@@ -1105,27 +2679,43 @@ def extract_invoice_json_from_pdf_bytes_option_c(
         f"{combined_text}\n"
         "-----END OCR TEXT-----\n"
     )
+    if local_items is not None:
+        extract_user_text += (
+            "\nThe line items were already read from the PDF text layer. "
+            'Extract the header fields only and return "invoice_items": [].\n'
+        )
 
-    raw = (vision_call([
-        {"role": "system", "content": INVOICE_EXTRACT_FROM_TEXT_SYSTEM_PROMPT},
+    extract_prompt = INVOICE_EXTRACT_WITH_EVIDENCE_FROM_TEXT_SYSTEM_PROMPT if single_call else INVOICE_EXTRACT_FROM_TEXT_SYSTEM_PROMPT
+    raw = _call_vision(vision_call, [
+        {"role": "system", "content": extract_prompt},
         {"role": "user", "content": [{"type": "text", "text": extract_user_text}]},
-    ]) or "").strip()
+    ], stage="extract")
 
     if debug_dir:
         (debug_dir / "raw_extract_combined.txt").write_text(raw, encoding="utf-8")
 
-    obj = _extract_first_json_obj(raw)
+    with span("parse"):
+        obj = _extract_first_json_obj(raw)
     if obj is None:
-        blank = _blank_invoice_obj()
-        return "```json\n" + json.dumps(blank, ensure_ascii=False, indent=2) + "\n```", None
+        return InvoiceExtraction.from_invoice_obj(with_local_items(_blank_invoice_obj()), **page_kwargs)
 
     norm = _normalize_invoice_obj(obj)
 
+    if single_call:
+        with span("local_check"):
+            norm, evidence, blanked = _check_evidence_locally(
+                norm, _pop_evidence(norm), page_texts=ocr_by_page, valid_pages=list(ocr_by_page)
+            )
+        norm = with_local_items(norm, evidence)
+        return InvoiceExtraction.from_invoice_obj(
+            norm, evidence=evidence if return_evidence else None, locally_blanked=blanked, **page_kwargs
+        )
+
     if not verify:
-        out = "```json\n" + json.dumps(norm, ensure_ascii=False, indent=2) + "\n```"
-        return out, None
-    
-    candidate_json = json.dumps(norm, ensure_ascii=False, indent=2)
+        return InvoiceExtraction.from_invoice_obj(with_local_items(norm), **page_kwargs)
+
+    # locally read items are not re-verified by the model
+    candidate_json = json.dumps(norm if local_items is None else {**norm, "invoice_items": []}, ensure_ascii=False, indent=2)
     verify_user_text = (
         "OCR TEXT (verbatim):\n"
         "-----BEGIN OCR TEXT-----\n"
@@ -1136,35 +2726,32 @@ def extract_invoice_json_from_pdf_bytes_option_c(
         f"{candidate_json}\n"
         "-----END CANDIDATE JSON-----\n"
     )
-    raw_v = (vision_call([
+    raw_v = _call_vision(vision_call, [
         {"role": "system", "content": INVOICE_VERIFY_FROM_TEXT_SYSTEM_PROMPT},
         {"role": "user", "content": [{"type": "text", "text": verify_user_text}]},
-    ]) or "").strip()
-
+    ], stage="verify")
 
     if debug_dir:
         (debug_dir / "raw_verify_combined.txt").write_text(raw_v, encoding="utf-8")
 
-    obj_v = _extract_first_json_obj(raw_v)
+    with span("parse"):
+        obj_v = _extract_first_json_obj(raw_v)
     if obj_v is None:
-        out = "```json\n" + json.dumps(norm, ensure_ascii=False, indent=2) + "\n```"
-        return out, None
-    
+        return InvoiceExtraction.from_invoice_obj(with_local_items(norm), **page_kwargs)
+
     norm_v = _normalize_invoice_obj(obj_v)
-    evidence = _pop_evidence(norm_v) if return_evidence else None
+    evidence = _pop_evidence(norm_v)
+    if return_evidence and local_items is not None:
+        evidence = evidence if evidence is not None else {}
+    norm_v = with_local_items(norm_v, evidence)
 
-    out = "```json\n" + json.dumps(norm_v, ensure_ascii=False, indent=2) + "\n```"
-    return out, evidence
+    return InvoiceExtraction.from_invoice_obj(norm_v, evidence=evidence if return_evidence else None, **page_kwargs)
 
 def _write_png_b64_to_file(b64_png: str, out_path: Path) -> None:
     out_path.parent.mkdir(parents=True, exist_ok=True)
     out_path.write_bytes(base64.b64decode(b64_png))
 
 
-def _load_pdf_bytes(pdf_path: Path) -> bytes:
-    return pdf_path.read_bytes()
-
-
 def _default_out_dir(pdf_path: Path) -> Path:
     return pdf_path.parent / f"{pdf_path.stem}__vision_fallback_out"
 
@@ -1179,6 +2766,7 @@ def _summarize_result(res: PdfExtractResult, pdf_path: Path) -> Dict:
         "pages_with_text": extracted_pages,
         "pages_blank_text": blank_pages,
         "fallback_images_count": len(res.fallback_page_images_b64),
+        "skipped_blank_pages": res.skipped_blank_pages,
         "extracted_text_chars": len(res.text or ""),
     }
 
@@ -1188,7 +2776,7 @@ def _load_vision_adapter_from_env() -> Optional[VisionCallable]:
         return None
 
     if adapter == "llama32":
-        candidates = [("src.scripts.llama32", "llama32"), ("scripts.llama32", "llama32"), ("llama32", "llama32")]
+        candidates = [("src.scripts.llama32", "llama32"), ("scripts.llama32", "llama32"), ("pdfvision.llama32", "llama32"), ("llama32", "llama32")]
     elif adapter == "pixtral":
         candidates = [("src.scripts.Pixtral", "pixtral"), ("scripts.Pixtral", "pixtral"), ("Pixtral", "pixtral")]
     else:
@@ -1198,10 +2786,12 @@ def _load_vision_adapter_from_env() -> Optional[VisionCallable]:
         try:
             mod = importlib.import_module(mod_name)
             fn = getattr(mod, fn_name)
-            if callable(fn):
-                return fn
+            if not callable(fn):
+                continue
         except Exception:
             continue
+        # PDF_VISION_ROUTES sends OCR / extract / verify calls to per-stage models
+        return ModelRouter.from_env().bind(fn) if os.getenv("PDF_VISION_ROUTES", "").strip() else fn
 
     return None
 
@@ -1221,12 +2811,46 @@ def main() -> int:
     parser.add_argument("--no-clip", action="store_true", help="Do not clip to content bbox; render full page area.")
     parser.add_argument("--out-dir", type=str, default="", help="Output directory; default is next to PDF.")
     parser.add_argument("--max-pages", type=int, default=0, help="Limit pages to OCR/extract (0 = no limit).")
+    parser.add_argument(
+        "--top-k-pages",
+        type=int,
+        default=0,
+        help="Extract only the K pages ranked most invoice-like from the text layer (0 = all pages).",
+    )
+    parser.add_argument(
+        "--single-call",
+        action="store_true",
+        help="Extract values and evidence in one model call and check the evidence locally instead of a verify call.",
+    )
     parser.add_argument("--write-text", action="store_true", help="Write extracted/ocr text to out-dir/text.txt.")
     parser.add_argument("--write-json", action="store_true", help="Write extracted invoice JSON to out-dir/invoice.json.")
     parser.add_argument("--write-evidence", action="store_true", help="Write verifier evidence to out-dir/evidence.json.")
     parser.add_argument("--summary-json", action="store_true", help="Also write summary.json to out-dir.")
+    parser.add_argument("--metrics-jsonl", type=str, default="", help="Append per-stage metric events to this JSONL file.")
+    parser.add_argument("--metrics-prom", type=str, default="", help="Write Prometheus text-format metrics to this file.")
     args = parser.parse_args()
 
+    sinks: List[Any] = []
+    if args.metrics_jsonl:
+        sinks.append(JsonlFileSink(Path(args.metrics_jsonl).expanduser()))
+    prom = PrometheusTextExporter() if args.metrics_prom else None
+    if prom:
+        sinks.append(prom)
+
+    instrumentation = Instrumentation(sinks)
+    with instrumentation.activate():
+        rc = _run_cli(args)
+
+    print("\n[METRICS] " + json.dumps(instrumentation.summary(), ensure_ascii=False))
+    if prom:
+        prom.write(Path(args.metrics_prom).expanduser())
+    for sink in sinks:
+        if isinstance(sink, JsonlFileSink):
+            sink.close()
+    return rc
+
+
+def _run_cli(args: argparse.Namespace) -> int:
     pdf_path = Path(args.pdf).expanduser().resolve()
     if not pdf_path.exists():
         print(f"ERROR: PDF not found: {pdf_path}")
@@ -1235,10 +2859,10 @@ def main() -> int:
     out_dir = Path(args.out_dir).expanduser().resolve() if args.out_dir else _default_out_dir(pdf_path)
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    pdf_bytes = _load_pdf_bytes(pdf_path)
+    session = PdfDocumentSession.from_file(pdf_path)
 
     res = extract_pdf_text_and_fallback_images(
-        pdf_bytes,
+        session,
         dpi=args.dpi,
         clip_to_content=(not args.no_clip),
         include_page_texts=True,
@@ -1288,17 +2912,28 @@ def main() -> int:
             print(f"\nWrote outputs to: {out_dir}")
             return 0
 
-        invoice_json_text, evidence = extract_invoice_json_from_pdf_bytes_option_c(
-            pdf_bytes,
+        extraction = extract_invoice_json_from_pdf_bytes_option_c(
+            session,
             vision_call=vision_call,
             dpi=args.dpi,
             clip_to_content=(not args.no_clip),
             max_pages=max_pages,
+            top_k_pages=(args.top_k_pages if args.top_k_pages > 0 else None),
             verify=True,
+            single_call=args.single_call,
             return_evidence=args.write_evidence,
             debug_dir=out_dir,
         )
+        invoice_json_text = format_invoice_json_fenced(extraction)
+        evidence = extraction.evidence
         print("\n[DEBUG] extract() returned:")
+        print(f"[DEBUG] calls: {extraction.call_counts} timings: {extraction.timings}")
+        full_px = sum(r.full_pixels for r in extraction.render_stats)
+        saved_px = sum(r.pixels_saved for r in extraction.render_stats)
+        print(f"[DEBUG] rendered pixels saved: {saved_px}/{full_px} skipped blank pages: {extraction.skipped_pages}")
+        print(f"[DEBUG] deduplicated pages: {extraction.deduplicated_pages}")
+        if args.single_call:
+            print(f"[DEBUG] blanked by local evidence checks: {extraction.locally_blanked}")
         print(f"[DEBUG] invoice_json_text chars: {len(invoice_json_text or '')}")
         print(f"[DEBUG] evidence type: {type(evidence).__name__}")
         if isinstance(evidence, dict):
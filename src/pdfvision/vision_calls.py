@@ -0,0 +1,359 @@
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from .instrumentation import incr, run_in_current_context, span
+from .model_routing import _accepted_kwargs
+from .pdf_vision import VisionCallable
+
+ENSEMBLE_POLICIES = ("all", "first_confident", "majority")
+
+
+@dataclass
+class EnsembleResult:
+    answer: Optional[str]
+    winner: Optional[str]
+    policy: str
+    answers: Dict[str, str] = field(default_factory=dict)
+    errors: Dict[str, BaseException] = field(default_factory=dict)
+    latencies: Dict[str, float] = field(default_factory=dict)
+    cancelled: List[str] = field(default_factory=list)
+
+
+def _timed(name: str, call: VisionCallable, messages: List[Dict]) -> Callable[[], str]:
+    def run() -> str:
+        incr("vision_calls", stage="ensemble", model=name)
+        with span("model_call", model=name):
+            return call(messages)
+
+    return run
+
+
+def ensemble_call(
+    calls: Dict[str, VisionCallable],
+    messages: List[Dict],
+    *,
+    policy: str = "all",
+    prefer: Optional[str] = None,
+    is_confident: Optional[Callable[[str], bool]] = None,
+    vote_key: Optional[Callable[[str], str]] = None,
+    timeout: Optional[float] = None,
+) -> EnsembleResult:
+    if policy not in ENSEMBLE_POLICIES:
+        raise ValueError(f"unknown ensemble policy {policy!r}; expected one of {ENSEMBLE_POLICIES}")
+    if not calls:
+        raise ValueError("ensemble_call needs at least one model")
+
+    names = list(calls)
+    prefer = prefer if prefer in calls else names[0]
+    if timeout is None:
+        # inside call_deadline the models that do not enforce the budget themselves are abandoned with it
+        timeout = remaining_budget()
+    result = EnsembleResult(answer=None, winner=None, policy=policy)
+
+    pool = ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="ensemble")
+    started = time.perf_counter()
+    futures: Dict[Future, str] = {
+        pool.submit(run_in_current_context(_timed(name, calls[name], messages))): name for name in names
+    }
+    pending = set(futures)
+
+    try:
+        deadline = None if timeout is None else started + timeout
+        while pending:
+            remaining = None if deadline is None else max(deadline - time.perf_counter(), 0.0)
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+
+            for fut in done:
+                name = futures[fut]
+                result.latencies[name] = round(time.perf_counter() - started, 4)
+                try:
+                    result.answers[name] = fut.result() or ""
+                except Exception as e:
+                    result.errors[name] = e
+
+            if policy == "first_confident":
+                confident = [
+                    n for n in names
+                    if n in result.answers and (is_confident is None or is_confident(result.answers[n]))
+                ]
+                if confident:
+                    result.winner = confident[0]
+                    break
+    finally:
+        # Calls that already started cannot be interrupted; they are abandoned rather than awaited.
+        for fut in pending:
+            fut.cancel()
+            result.cancelled.append(futures[fut])
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if result.winner is None and policy == "majority" and result.answers:
+        key = vote_key or (lambda a: a.strip().lower())
+        votes = Counter(key(a) for a in result.answers.values())
+        top = votes.most_common()
+        best = [v for v, c in top if c == top[0][1]]
+        agreeing = [n for n in names if n in result.answers and key(result.answers[n]) in best]
+        result.winner = prefer if prefer in agreeing else agreeing[0]
+
+    if result.winner is None:
+        result.winner = prefer if prefer in result.answers else next(
+            (n for n in names if n in result.answers), None
+        )
+
+    result.answer = result.answers.get(result.winner) if result.winner else None
+    return result
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+# monotonic time by which the current document must be done; copied into worker threads with the context
+_DEADLINE: ContextVar[Optional[float]] = ContextVar("pdfvision_call_deadline", default=None)
+
+
+@contextmanager
+def call_deadline(seconds: Optional[float]) -> Iterator[None]:
+    # Per-document time budget: every HedgedCall inside gets at most what is left of it. Nested
+    # budgets can only shorten the outer one; None leaves it unchanged.
+    outer = _DEADLINE.get()
+    deadline = outer if seconds is None else time.monotonic() + seconds
+    token = _DEADLINE.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def remaining_budget() -> Optional[float]:
+    deadline = _DEADLINE.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def payload_key(messages: List[Dict]) -> str:
+    return hashlib.sha256(
+        json.dumps(messages, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+
+
+class SingleFlightCall:
+    # Concurrent calls with byte-identical messages wait on one upstream request and share its
+    # result (or its exception, except a DeadlineExceeded from the leader's own budget). Nothing is kept once that request finishes, so this complements a
+    # persistent cache rather than replacing one: it only absorbs bursts of duplicate traffic.
+
+    def __init__(self, call: VisionCallable, *, stage: Optional[str] = None, _shared: Optional[Dict[str, Any]] = None) -> None:
+        self.call = call
+        self.stage = stage
+        self._shared = _shared if _shared is not None else {"lock": threading.Lock(), "inflight": {}, "coalesced": 0}
+
+    @property
+    def coalesced(self) -> int:
+        return self._shared["coalesced"]
+
+    def for_stage(self, stage: str) -> "SingleFlightCall":
+        # stage-aware callables (model_routing.RoutedVisionCall) keep routing; the stage is part of the
+        # key because the same messages may go to different models in different stages
+        if not hasattr(self.call, "for_stage") or stage == self.stage:
+            return self
+        return SingleFlightCall(self.call.for_stage(stage), stage=stage, _shared=self._shared)
+
+    def __call__(self, messages: List[Dict]) -> str:
+        key = f"{self.stage or ''}:{payload_key(messages)}"
+        lock, inflight = self._shared["lock"], self._shared["inflight"]
+        followed = False
+        while True:
+            with lock:
+                flight = inflight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = inflight[key] = Future()
+                elif not followed:
+                    self._shared["coalesced"] += 1
+            if leader:
+                break
+
+            if not followed:
+                followed = True
+                incr("coalesced_calls", stage=self.stage or "")
+            # a follower waits no longer than its own document budget allows ...
+            budget = remaining_budget()
+            try:
+                with span("coalesced_wait"):
+                    return flight.result(timeout=None if budget is None else max(budget, 0.0))
+            except DeadlineExceeded:
+                # ... and does not inherit the leader's budget running out: it tries again, as leader
+                # unless another caller got there first
+                continue
+            except FutureTimeoutError:
+                incr("deadline_exceeded", stage=self.stage or "")
+                raise DeadlineExceeded(f"document time budget exhausted waiting for a coalesced {self.stage or 'vision'} call")
+
+        # the key is released before the outcome is published, so a retrying follower cannot find the
+        # finished flight again
+        try:
+            answer = self.call(messages)
+        except BaseException as e:
+            with lock:
+                inflight.pop(key, None)
+            flight.set_exception(e)
+            raise
+        with lock:
+            inflight.pop(key, None)
+        flight.set_result(answer)
+        return answer
+
+
+@dataclass(frozen=True)
+class HedgePolicy:
+    # a duplicate request goes out once the first has run longer than this percentile of recent latencies
+    percentile: float = 95.0
+    # hedge delay until min_samples latencies have been seen for the stage
+    initial_delay: float = 10.0
+    min_samples: int = 20
+    # latencies remembered per stage
+    window: int = 200
+    min_delay: float = 0.5
+    max_delay: float = 60.0
+    # ceiling for one call (both attempts) when no document budget is active, or a shorter one
+    call_timeout: float = 300.0
+
+
+HEDGE_POLICY = HedgePolicy()
+
+
+class LatencyTracker:
+    def __init__(self, window: int = HEDGE_POLICY.window) -> None:
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, stage: str, pct: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(stage) or ())
+        if not samples:
+            return None
+        rank = min(max(math.ceil(pct / 100.0 * len(samples)), 1), len(samples))
+        return samples[rank - 1]
+
+    def count(self, stage: str) -> int:
+        with self._lock:
+            return len(self._samples.get(stage) or ())
+
+
+class HedgedCall:
+    # Sends a second, identical request when the first runs past the stage's latency percentile and
+    # returns whichever succeeds first. A failed first attempt (an exception, or an answer is_error
+    # flags, for clients that report HTTP failures as text) triggers the hedge immediately; when every
+    # attempt fails, the last error answer is returned as the client would have, else the last
+    # exception is raised. Both attempts get the remaining deadline as their request timeout (when the
+    # client takes one), so the loser is abandoned without being awaited and ends on its own by the deadline.
+
+    def __init__(
+        self,
+        call: VisionCallable,
+        policy: HedgePolicy = HEDGE_POLICY,
+        *,
+        is_error: Optional[Callable[[str], bool]] = None,
+        stage: Optional[str] = None,
+        tracker: Optional[LatencyTracker] = None,
+    ) -> None:
+        self.call = call
+        self.policy = policy
+        self.is_error = is_error
+        self.stage = stage
+        self.tracker = tracker if tracker is not None else LatencyTracker(policy.window)
+
+    def for_stage(self, stage: str) -> "HedgedCall":
+        if stage == self.stage:
+            return self
+        call = self.call.for_stage(stage) if hasattr(self.call, "for_stage") else self.call
+        return HedgedCall(call, self.policy, is_error=self.is_error, stage=stage, tracker=self.tracker)
+
+    def hedge_delay(self) -> float:
+        stage = self.stage or ""
+        observed = None
+        if self.tracker.count(stage) >= self.policy.min_samples:
+            observed = self.tracker.percentile(stage, self.policy.percentile)
+        delay = self.policy.initial_delay if observed is None else observed
+        return min(max(delay, self.policy.min_delay), self.policy.max_delay)
+
+    def _attempt(self, messages: List[Dict], timeout: float) -> str:
+        return self.call(messages, **_accepted_kwargs(self.call, {"timeout": timeout}))
+
+    def __call__(self, messages: List[Dict]) -> str:
+        stage = self.stage or ""
+        budget = remaining_budget()
+        timeout = self.policy.call_timeout if budget is None else min(budget, self.policy.call_timeout)
+        if timeout <= 0:
+            incr("deadline_exceeded", stage=stage)
+            raise DeadlineExceeded(f"document time budget exhausted before the {stage or 'vision'} call")
+
+        started = time.monotonic()
+        deadline = started + timeout
+        hedge_at = started + self.hedge_delay()
+        pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hedge")
+        attempts: Dict[Future, Tuple[str, float]] = {}
+
+        def launch(role: str) -> Future:
+            t0 = time.monotonic()
+            fut = pool.submit(run_in_current_context(self._attempt), messages, max(deadline - t0, 0.001))
+            attempts[fut] = (role, t0)
+            return fut
+
+        pending = {launch("primary")}
+        hedged = False
+        errors: List[BaseException] = []
+        error_answer: Optional[str] = None
+        try:
+            while pending or not hedged:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                if not hedged and (not pending or now >= hedge_at):
+                    hedged = True
+                    incr("hedged_calls", stage=stage)
+                    pending.add(launch("hedge"))
+                until = deadline if hedged else min(hedge_at, deadline)
+                done, pending = wait(pending, timeout=max(until - now, 0.0), return_when=FIRST_COMPLETED)
+                for fut in done:
+                    role, t0 = attempts[fut]
+                    try:
+                        answer = fut.result()
+                    except Exception as e:
+                        incr("hedge_attempt_errors", stage=stage, attempt=role)
+                        errors.append(e)
+                        continue
+                    if self.is_error is not None and self.is_error(answer):
+                        incr("hedge_attempt_errors", stage=stage, attempt=role)
+                        error_answer = answer
+                        continue
+                    self.tracker.record(stage, time.monotonic() - t0)
+                    if hedged:
+                        incr("hedge_wins", stage=stage, attempt=role)
+                    return answer
+        finally:
+            for fut in pending:
+                fut.cancel()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        if not pending and error_answer is not None:
+            return error_answer
+        if errors and not pending:
+            raise errors[-1]
+        incr("deadline_exceeded", stage=stage)
+        raise DeadlineExceeded(f"{stage or 'vision'} call did not finish within {timeout:.2f}s")
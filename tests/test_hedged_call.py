@@ -0,0 +1,177 @@
+import threading
+import time
+
+import pytest
+
+from pdfvision.vision_calls import (
+    DeadlineExceeded,
+    HedgedCall,
+    HedgePolicy,
+    call_deadline,
+    ensemble_call,
+    remaining_budget,
+)
+
+MESSAGES = [{"role": "user", "content": "extract the invoice"}]
+
+# hedge after 50ms until enough latencies have been seen
+FAST_HEDGE = HedgePolicy(initial_delay=0.05, min_delay=0.01, call_timeout=5.0)
+# no latency-based hedge within a test's lifetime
+NO_TIMED_HEDGE = HedgePolicy(initial_delay=30.0, max_delay=30.0, call_timeout=5.0)
+
+
+def is_error_answer(answer):
+    return answer.startswith("(503, ")
+
+
+class ScriptedCall:
+    # Fake vision client: the n-th call runs the n-th script entry, a callable taking the request
+    # timeout. Records each call's timeout and the document budget seen from its worker thread.
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.timeouts = []
+        self.budgets = []
+        self._lock = threading.Lock()
+
+    @property
+    def calls(self):
+        return len(self.timeouts)
+
+    def __call__(self, messages, timeout=None):
+        with self._lock:
+            step = self.script[len(self.timeouts)]
+            self.timeouts.append(timeout)
+            self.budgets.append(remaining_budget())
+        return step(timeout)
+
+
+def answer(text, after=0.0):
+    def step(timeout):
+        time.sleep(after)
+        return text
+
+    return step
+
+
+def fail(exc):
+    def step(timeout):
+        raise exc
+
+    return step
+
+
+def block(event):
+    # a client that hangs until released, or until its request timeout like a real HTTP client
+    def step(timeout):
+        if not event.wait(timeout):
+            raise TimeoutError("read timed out")
+        return "late"
+
+    return step
+
+
+def test_slow_primary_is_hedged_and_the_loser_abandoned():
+    stuck = threading.Event()
+    try:
+        call = ScriptedCall(block(stuck), answer("hedge"))
+        started = time.monotonic()
+        assert HedgedCall(call, FAST_HEDGE)(MESSAGES) == "hedge"
+        # the primary is still blocked: the hedged call returned without waiting for it
+        assert time.monotonic() - started < 1.0
+        assert call.calls == 2
+        assert not stuck.is_set()
+    finally:
+        stuck.set()
+
+
+def test_fast_primary_is_not_hedged():
+    call = ScriptedCall(answer("primary"))
+    assert HedgedCall(call, FAST_HEDGE)(MESSAGES) == "primary"
+    assert call.calls == 1
+
+
+def test_error_answer_triggers_the_hedge_immediately():
+    call = ScriptedCall(answer("(503, 'busy')"), answer("ok"))
+    started = time.monotonic()
+    assert HedgedCall(call, NO_TIMED_HEDGE, is_error=is_error_answer)(MESSAGES) == "ok"
+    assert time.monotonic() - started < 1.0
+    assert call.calls == 2
+
+
+def test_exception_triggers_the_hedge_immediately():
+    call = ScriptedCall(fail(ConnectionError("reset")), answer("ok"))
+    assert HedgedCall(call, NO_TIMED_HEDGE)(MESSAGES) == "ok"
+    assert call.calls == 2
+
+
+def test_error_answer_is_returned_when_every_attempt_fails():
+    call = ScriptedCall(answer("(503, 'busy')"), answer("(503, 'still busy')"))
+    assert HedgedCall(call, NO_TIMED_HEDGE, is_error=is_error_answer)(MESSAGES) == "(503, 'still busy')"
+
+
+def test_last_exception_is_raised_when_every_attempt_fails():
+    call = ScriptedCall(fail(ConnectionError("reset")), fail(ValueError("bad json")))
+    with pytest.raises(ValueError):
+        HedgedCall(call, NO_TIMED_HEDGE)(MESSAGES)
+
+
+def test_attempts_get_the_remaining_budget_as_timeout():
+    stuck = threading.Event()
+    try:
+        call = ScriptedCall(block(stuck), block(stuck))
+        started = time.monotonic()
+        with call_deadline(0.2):
+            # both attempts time out at the deadline: the client's own timeout may surface before
+            # DeadlineExceeded (a TimeoutError too), either way within the budget
+            with pytest.raises(TimeoutError):
+                HedgedCall(call, FAST_HEDGE)(MESSAGES)
+        assert time.monotonic() - started < 1.0
+        assert call.calls == 2
+        assert all(0 < t <= 0.2 for t in call.timeouts)
+    finally:
+        stuck.set()
+
+
+def test_exhausted_budget_raises_before_calling():
+    call = ScriptedCall(answer("unused"))
+    with call_deadline(0):
+        with pytest.raises(DeadlineExceeded):
+            HedgedCall(call, FAST_HEDGE)(MESSAGES)
+    assert call.calls == 0
+
+
+def test_budget_is_copied_into_the_attempt_threads():
+    call = ScriptedCall(answer("ok"))
+    with call_deadline(5):
+        HedgedCall(call, FAST_HEDGE)(MESSAGES)
+    assert call.budgets[0] is not None and 0 < call.budgets[0] <= 5
+    assert remaining_budget() is None
+
+
+def test_budget_is_copied_into_ensemble_threads_and_bounds_the_ensemble():
+    stuck = threading.Event()
+    try:
+        fast, slow = ScriptedCall(answer("fast")), ScriptedCall(block(stuck))
+        started = time.monotonic()
+        with call_deadline(0.2):
+            result = ensemble_call({"fast": fast, "slow": slow}, MESSAGES)
+        assert time.monotonic() - started < 1.0
+        assert result.answer == "fast"
+        assert result.cancelled == ["slow"]
+        assert fast.budgets[0] is not None and fast.budgets[0] <= 0.2
+    finally:
+        stuck.set()
+
+
+def test_nested_deadline_only_shortens_the_outer_one():
+    assert remaining_budget() is None
+    with call_deadline(0.5):
+        with call_deadline(10):
+            assert remaining_budget() <= 0.5
+        with call_deadline(None):
+            assert remaining_budget() <= 0.5
+        with call_deadline(0.1):
+            assert remaining_budget() <= 0.1
+        assert 0.1 < remaining_budget() <= 0.5
+    assert remaining_budget() is None
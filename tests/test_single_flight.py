@@ -0,0 +1,132 @@
+import threading
+import time
+
+import pytest
+
+from pdfvision.vision_calls import DeadlineExceeded, SingleFlightCall, call_deadline
+
+MESSAGES = [{"role": "user", "content": "extract the invoice"}]
+
+
+class GatedCall:
+    # Fake vision client: each call blocks until `release` is set, then returns (or raises) the next
+    # scripted outcome.
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, messages):
+        with self._lock:
+            self.calls += 1
+            outcome = self.outcomes.pop(0)
+        self.entered.set()
+        assert self.release.wait(5)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def run_in_thread(fn):
+    out = {}
+
+    def target():
+        try:
+            out["answer"] = fn()
+        except BaseException as e:
+            out["error"] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread, out
+
+
+def wait_for(predicate, timeout=5.0):
+    stop = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < stop, "condition not reached"
+        time.sleep(0.005)
+
+
+def test_identical_concurrent_calls_share_one_request():
+    call = GatedCall("answer")
+    single = SingleFlightCall(call)
+
+    leader, leader_out = run_in_thread(lambda: single(MESSAGES))
+    assert call.entered.wait(5)
+    follower, follower_out = run_in_thread(lambda: single(list(MESSAGES)))
+    wait_for(lambda: single.coalesced == 1)
+    call.release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert call.calls == 1
+    assert leader_out == {"answer": "answer"}
+    assert follower_out == {"answer": "answer"}
+
+
+def test_leader_exception_is_shared_with_followers():
+    call = GatedCall(ValueError("bad gateway"))
+    single = SingleFlightCall(call)
+
+    leader, leader_out = run_in_thread(lambda: single(MESSAGES))
+    assert call.entered.wait(5)
+    follower, follower_out = run_in_thread(lambda: single(MESSAGES))
+    wait_for(lambda: single.coalesced == 1)
+    call.release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert call.calls == 1
+    assert isinstance(leader_out["error"], ValueError)
+    assert isinstance(follower_out["error"], ValueError)
+
+
+def test_follower_retries_after_leader_deadline_exceeded():
+    # the leader's budget running out is not the follower's failure: it calls again itself
+    call = GatedCall(DeadlineExceeded("leader budget exhausted"), "answer")
+    single = SingleFlightCall(call)
+
+    leader, leader_out = run_in_thread(lambda: single(MESSAGES))
+    assert call.entered.wait(5)
+    follower, follower_out = run_in_thread(lambda: single(MESSAGES))
+    wait_for(lambda: single.coalesced == 1)
+    call.release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert isinstance(leader_out["error"], DeadlineExceeded)
+    assert follower_out == {"answer": "answer"}
+    assert call.calls == 2
+
+
+def test_follower_waits_no_longer_than_its_own_budget():
+    call = GatedCall("answer")
+    single = SingleFlightCall(call)
+
+    leader, leader_out = run_in_thread(lambda: single(MESSAGES))
+    assert call.entered.wait(5)
+
+    started = time.monotonic()
+    with call_deadline(0.1):
+        with pytest.raises(DeadlineExceeded):
+            single(MESSAGES)
+    assert time.monotonic() - started < 1.0
+
+    call.release.set()
+    leader.join(5)
+    assert leader_out == {"answer": "answer"}
+    assert call.calls == 1
+
+
+def test_different_messages_are_not_coalesced():
+    answers = []
+    single = SingleFlightCall(lambda messages: answers.append(messages) or messages[0]["content"])
+
+    assert single([{"role": "user", "content": "a"}]) == "a"
+    assert single([{"role": "user", "content": "b"}]) == "b"
+    assert len(answers) == 2
+    assert single.coalesced == 0